@@ -0,0 +1,116 @@
+import asyncio
+import contextlib
+import io
+import multiprocessing
+import multiprocessing.pool
+import os
+import platform
+import time
+
+import harness
+import plugin
+import rpc_shim
+
+import main
+
+# The server and a forked worker as two processes with their own plugin
+# volumes: the server runs the real plugin against the local artifact
+# server and hands its ArtifactSource to the worker over rpc_shim, the
+# worker prepares btop and the themes from it. Checks that the worker gets
+# identical files without going upstream, falls back to the upstream url
+# for an artifact the server doesn't have, and that the server refuses
+# reads of anything that isn't a file of an artifact it described.
+
+METRICS = {
+    'prepare_ms': ("Worker prepare from the server", 'ms', True, 50),
+}
+
+
+async def worker_checks(port: int, release_url: str, theme_urls: list[str], extra_url: str) -> dict:
+    source = await rpc_shim.RemoteObject(port).connect()
+    worker = main.BtopWorker()
+    try:
+        started = time.perf_counter()
+        exe = await worker.prepare(source, theme_urls + [extra_url])
+        prepare_ms = (time.perf_counter() - started) * 1000
+
+        with open(exe, 'rb') as f:
+            assert f.read() == plugin.FAKE_BTOP, "btop differs from the server's"
+        for i, url in enumerate(theme_urls):
+            with open(os.path.join(worker.themes_dir, url.split('/')[-1]), 'rb') as f:
+                assert f.read() == plugin.theme(i), f"{url} differs from the server's"
+        assert os.path.exists(os.path.join(worker.themes_dir, extra_url.split('/')[-1])), "the upstream fallback was not installed"
+
+        described = await source.describe(f'btop-{platform.system()}-{platform.machine()}', release_url)
+        digest = described['digest']
+        assert await source.read(digest, 'btop/bin/btop', 0, 16) == plugin.FAKE_BTOP[:16]
+        rejected = 0
+        for bad_digest, path in (
+            ('../../../etc', 'passwd'),
+            (digest.upper(), 'btop/bin/btop'),
+            (digest[:-1], 'btop/bin/btop'),
+            ('0' * 64, ''),
+            (digest, '../../../../../etc/passwd'),
+            (digest, 'btop/bin'),
+            (digest, 'btop/README.md'),
+        ):
+            try:
+                await source.read(bad_digest, path, 0, 16)
+            except Exception:
+                rejected += 1
+            else:
+                raise AssertionError(f"the server served {path!r} of {bad_digest!r}")
+        return {'prepare_ms': prepare_ms, 'rejected': rejected}
+    finally:
+        await source.close()
+
+
+def worker_main(port: int, release_url: str, theme_urls: list[str], extra_url: str) -> tuple[dict, str]:
+    # a fresh interpreter, so harness gave it its own home and plugin volume
+    plugin.point_downloads(release_url)
+    output = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(output):
+            return asyncio.run(worker_checks(port, release_url, theme_urls, extra_url)), output.getvalue()
+    finally:
+        harness.cleanup()
+
+
+async def measure(pool: multiprocessing.pool.Pool, server: harness.ArtifactServer, theme_urls: list[str]) -> tuple[dict, str]:
+    p = await plugin.start_plugin()
+    await p.downloaded
+    thememanager = await p.getDevice('thememanager')
+    await thememanager.themes_loaded
+    # only on the upstream server
+    extra_url = server.add('/themes/upstream-only.theme', plugin.theme(99))
+    requested = len(server.requests)
+
+    rpc, port = await rpc_shim.serve(p.artifact_source)
+    try:
+        loop = asyncio.get_running_loop()
+        release_url = main.DOWNLOADS[platform.system().lower()][platform.machine().lower()]['url']
+        result = pool.apply_async(worker_main, (port, release_url, theme_urls, extra_url))
+        results, output = await loop.run_in_executor(None, result.get)
+    finally:
+        rpc.close()
+        await rpc.wait_closed()
+
+    upstream = [path for path, _ in server.requests[requested:]]
+    assert upstream == ['/themes/upstream-only.theme'], f"the worker went upstream for {upstream}"
+    assert p.artifact_source.served >= len(plugin.FAKE_BTOP), p.artifact_source.served
+    return results, output
+
+
+def run(args) -> dict[str, float]:
+    # spawned, so the worker shares nothing with this process but the socket
+    with multiprocessing.get_context('spawn').Pool(1) as pool, harness.ArtifactServer() as server:
+        theme_urls = plugin.serve_release(server)
+        with contextlib.redirect_stdout(io.StringIO()):
+            results, output = asyncio.run(measure(pool, server, theme_urls))
+    print(output, end='')
+    print(f"worker matched the server's files, fell back upstream once, {results['rejected']} bad reads rejected")
+    return {'prepare_ms': results['prepare_ms']}
+
+
+if __name__ == '__main__':
+    harness.main('artifact_sharing', METRICS, run)
@@ -0,0 +1,66 @@
+import os
+import sys
+import time
+
+import harness
+
+import collector
+import history
+from main import BtopHostMetrics
+
+# What one host metrics sample costs, wall and cpu time, with the /proc
+# files kept open as the collector does against reopening them for every
+# sample, and what recording it in the history file adds.
+
+SAMPLES = 2000
+
+METRICS = {
+    'sample_us': ("Sample, files kept open", 'us', True, 50),
+    'sample_cpu_us': ("Sample cpu time, files kept open", 'us', True, 50),
+    'reopen_us': ("Sample, files reopened", 'us', True, 50),
+    'history_us': ("History record", 'us', True, 10),
+}
+
+
+def reopen(c: collector.Collector) -> None:
+    # what the collector would cost without keeping its files open
+    for file in (c.stat, c.meminfo, c.loadavg, c.netdev, c.diskstats, c.temperature):
+        if file:
+            file.close()
+
+
+def per_sample(fn, samples: int = SAMPLES) -> tuple[float, float]:
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    for _ in range(samples):
+        fn()
+    return (time.perf_counter() - wall) / samples * 1000000, (time.process_time() - cpu) / samples * 1000000
+
+
+def run(args) -> dict[str, float]:
+    results = {}
+    c = collector.Collector(os.environ['SCRYPTED_PLUGIN_VOLUME'])
+    c.sample()
+    results['sample_us'], results['sample_cpu_us'] = per_sample(c.sample)
+
+    def reopened() -> None:
+        reopen(c)
+        c.sample()
+    results['reopen_us'], _ = per_sample(reopened)
+
+    # samples microseconds apart have no cpu usage to report, memory is
+    # always there
+    metrics = c.sample()
+    assert metrics.get('memory') is not None, metrics
+    h = history.History(os.path.join(os.environ['SCRYPTED_PLUGIN_VOLUME'], 'history', 'host.bin'), list(BtopHostMetrics.SENSORS))
+    now = time.time()
+    samples = iter(range(SAMPLES))
+    results['history_us'], _ = per_sample(lambda: h.record(now + next(samples), metrics))
+    return results
+
+
+if __name__ == '__main__':
+    if not collector.Collector().available():
+        print("/proc is not readable here, nothing to measure")
+        sys.exit(0)
+    harness.main('collector_overhead', METRICS, run)
@@ -0,0 +1,87 @@
+import random
+import time
+import types
+
+import harness
+
+import scrypted_sdk
+from device_index import DeviceIndex
+
+# getDeviceByName through the plugin's DeviceIndex against the sdk's linear
+# scan of systemState, on synthetic registries of up to 10k devices, plus
+# what keeping the index current costs: a full rebuild and one device
+# renamed through the systemManager listener.
+
+SIZES = (100, 1000, 10000)
+LOOKUPS = 20000
+SCAN_LOOKUPS = 500
+
+METRICS = {
+    **{
+        f'{kind}_us_{size}': (f"{title}, {size} devices", 'us', True, floor)
+        for size in SIZES
+        for kind, title, floor in (('index', "index lookup", 1), ('scan', "linear scan", 50))
+    },
+    'rebuild_ms_10000': ("index rebuild, 10000 devices", 'ms', True, 5),
+    # a rename marks the index dirty, the next lookup rebuilds it
+    'rename_ms_10000': ("rename and lookup, 10000 devices", 'ms', True, 5),
+}
+
+
+def system_state(size: int) -> dict:
+    # shaped like the server's, one in ten devices is a plugin
+    state = {}
+    for i in range(size):
+        plugin = i % 10 == 0
+        state[str(i)] = {
+            'name': {'value': f"Device {i}"},
+            'pluginId': {'value': f"@scrypted/plugin-{i}"},
+            'interfaces': {'value': [scrypted_sdk.ScryptedInterface.ScryptedPlugin.value] if plugin else [scrypted_sdk.ScryptedInterface.Settings.value]},
+        }
+    return state
+
+
+def per_lookup(lookup, names: list[str]) -> float:
+    started = time.perf_counter()
+    for name in names:
+        lookup(name)
+    return (time.perf_counter() - started) / len(names) * 1000000
+
+
+def run(args) -> dict[str, float]:
+    rng = random.Random(0)
+    results = {}
+    for size in SIZES:
+        state = system_state(size)
+        manager = scrypted_sdk.SystemManager()
+        manager.systemState = state
+        # devices are their ids, so both lookups can be compared
+        manager.devices = {id: id for id in state}
+        index = DeviceIndex(state)
+        index.lookup("Device 0")
+
+        # names and plugin ids, found anywhere in the registry
+        names = [f"Device {rng.randrange(size)}" if rng.random() < 0.8 else f"@scrypted/plugin-{rng.randrange(0, size, 10)}" for _ in range(LOOKUPS)]
+        for name in names[:SCAN_LOOKUPS]:
+            found, scanned = index.lookup(name), manager.getDeviceByName(name)
+            assert found == scanned, f"index found {found} for {name}, the scan {scanned}"
+        results[f'index_us_{size}'] = per_lookup(index.lookup, names)
+        results[f'scan_us_{size}'] = per_lookup(manager.getDeviceByName, names[:SCAN_LOOKUPS])
+
+    started = time.perf_counter()
+    index.rebuild()
+    results['rebuild_ms_10000'] = (time.perf_counter() - started) * 1000
+
+    renames = 100
+    started = time.perf_counter()
+    for i in range(renames):
+        id = str(rng.randrange(1, size, 10) + 1)
+        state[id]['name']['value'] = f"Renamed {i}"
+        index.on_event(types.SimpleNamespace(id=id), {'property': 'name'}, f"Renamed {i}")
+        assert index.lookup(f"Renamed {i}") == id
+    results['rename_ms_10000'] = (time.perf_counter() - started) / renames * 1000
+    return results
+
+
+if __name__ == '__main__':
+    harness.main('device_lookup', METRICS, run)
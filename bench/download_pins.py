@@ -0,0 +1,31 @@
+import re
+import sys
+
+import harness
+
+import main
+
+# Checks that every entry in DOWNLOADS pins the sha256 of its archive.
+# Without a pin the download is installed unverified. Run
+# scripts/pin_downloads.py to fill them in.
+
+SHA256 = re.compile(r'^[0-9a-f]{64}$')
+
+
+def unpinned() -> list[str]:
+    missing = []
+    for system, machines in main.DOWNLOADS.items():
+        for machine, entry in machines.items():
+            if not SHA256.match(entry.get('sha256', '')):
+                missing.append(f"{system}/{machine}: {entry['url']}")
+    return missing
+
+
+if __name__ == '__main__':
+    missing = unpinned()
+    for entry in missing:
+        print("Missing sha256:", entry)
+    if missing:
+        print("Run scripts/pin_downloads.py and commit the pins")
+        sys.exit(1)
+    print("All downloads are pinned")
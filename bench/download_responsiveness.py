@@ -0,0 +1,84 @@
+import asyncio
+import contextlib
+import io
+import time
+import zipfile
+
+import harness
+
+import downloader
+import main
+
+# Checks that the event loop keeps serving while a large artifact downloads
+# and extracts, by timing a 10 ms ticker on the loop for the whole
+# download. Sessions, settings and rpc calls all share that loop, so a
+# download that holds it shows up as stalls everywhere else.
+
+DOWNLOAD_SIZE = 256 * 1024 * 1024
+# slow enough that each download spans a couple of hundred ticks
+RATE = 128 * 1024 * 1024
+TICK = 0.01
+# the loop may never stall for longer than this
+MAX_LAG = 0.1
+
+METRICS = {
+    'plain_lag_max_ms': ("Worst loop stall, download", 'ms', True, 20),
+    'plain_lag_p99_ms': ("p99 loop stall, download", 'ms', True, 5),
+    'zip_lag_max_ms': ("Worst loop stall, download and extract", 'ms', True, 20),
+    'zip_lag_p99_ms': ("p99 loop stall, download and extract", 'ms', True, 5),
+}
+
+
+async def measure(download) -> tuple[float, float]:
+    lags = []
+    last = time.perf_counter()
+    done = False
+
+    async def ticker() -> None:
+        nonlocal last
+        while not done:
+            await asyncio.sleep(TICK)
+            now = time.perf_counter()
+            lags.append(max(now - last - TICK, 0))
+            last = now
+
+    ticking = asyncio.ensure_future(ticker())
+    try:
+        await download
+    finally:
+        # a stall still going on when the download returns counts too
+        lags.append(max(time.perf_counter() - last - TICK, 0))
+        done = True
+        await ticking
+    lags.sort()
+    return lags[-1] * 1000, lags[int(len(lags) * 0.99)] * 1000
+
+
+def run(args) -> dict[str, float]:
+    block = harness.payload(1024 * 1024)
+    data = block * (DOWNLOAD_SIZE // len(block))
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_STORED) as z:
+        z.writestr('btop/bin/btop', data)
+
+    results = {}
+    with harness.ArtifactServer(RATE) as server, contextlib.redirect_stdout(io.StringIO()):
+        downloads = {
+            'plain': lambda: downloader.download_file(server.add('/payload', data), 'payload', log=log),
+            'zip': lambda: downloader.download_file(server.add('/btop.zip', archive.getvalue()), 'btop.zip', main.extract_zip, ['btop/bin/btop'], log=log),
+        }
+        for name, download in downloads.items():
+            worst, p99 = asyncio.run(measure(download()))
+            assert worst < MAX_LAG * 1000, f"{name}: the event loop stalled for {worst:.0f} ms during the download"
+            results[f'{name}_lag_max_ms'] = worst
+            results[f'{name}_lag_p99_ms'] = p99
+            harness.remove_store()
+    return results
+
+
+def log(*args) -> None:
+    pass
+
+
+if __name__ == '__main__':
+    harness.main('download_responsiveness', METRICS, run)
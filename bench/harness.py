@@ -0,0 +1,224 @@
+import argparse
+import hashlib
+import http.server
+import json
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Callable
+
+# Shared pieces for the scripts in bench/: the plugin sources on sys.path,
+# the scrypted_sdk stand-in next to this file, a scratch plugin volume and
+# home directory, a local artifact server and the baseline comparison.
+# Import this before any plugin module.
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(BENCH_DIR), 'src')
+BASELINE = os.path.join(BENCH_DIR, 'baseline.json')
+# a metric regresses when it is this much worse than its baseline, and by
+# more than the metric's noise floor
+REGRESSION = 1.5
+
+for path in (SRC_DIR, BENCH_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+scratch = tempfile.mkdtemp(prefix='btop-bench-')
+os.environ['HOME'] = os.path.join(scratch, 'home')
+os.environ['SCRYPTED_PLUGIN_VOLUME'] = os.path.join(scratch, 'volume')
+os.makedirs(os.environ['HOME'])
+os.makedirs(os.path.join(os.environ['SCRYPTED_PLUGIN_VOLUME'], 'files'))
+
+
+def cleanup() -> None:
+    shutil.rmtree(scratch, ignore_errors=True)
+
+
+class ArtifactHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self) -> None:
+        server: ArtifactServer = self.server.artifacts
+        server.requests.append((self.path, dict(self.headers)))
+        data = server.files.get(self.path.split('?')[0], None)
+        if data is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        etag = '"' + hashlib.sha256(data).hexdigest()[:16] + '"'
+        if self.headers.get('If-None-Match', None) == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        start = 0
+        match = re.match(r'bytes=(\d+)-$', self.headers.get('Range', ''))
+        if match and self.headers.get('If-Range', etag) == etag:
+            start = int(match.group(1))
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{len(data) - 1}/{len(data)}')
+        else:
+            self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(data) - start))
+        self.end_headers()
+
+        # drop_after cuts the first response short once, to exercise resuming
+        limit = len(data)
+        if server.drop_after is not None:
+            limit = min(limit, start + server.drop_after)
+            server.drop_after = None
+        sent = start
+        started = time.monotonic()
+        while sent < limit:
+            block = data[sent:min(sent + 64 * 1024, limit)]
+            try:
+                self.wfile.write(block)
+            except ConnectionError:
+                # the client gave up on this response
+                return
+            sent += len(block)
+            if server.rate:
+                ahead = (sent - start) / server.rate - (time.monotonic() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+        if sent < len(data):
+            self.close_connection = True
+            self.connection.shutdown(2)
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+
+class ArtifactServer:
+    # Serves in-memory files over loopback with ETag, If-Range and Range
+    # like the release hosts do, optionally throttled to rate bytes/s.
+
+    def __init__(self, rate: float = None) -> None:
+        self.files: dict[str, bytes] = {}
+        self.rate = rate
+        self.drop_after: int = None
+        self.requests: list[tuple[str, dict]] = []
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), ArtifactHandler)
+        self.server.daemon_threads = True
+        self.server.artifacts = self
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self) -> 'ArtifactServer':
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def add(self, path: str, data: bytes) -> str:
+        self.files[path] = data
+        return self.url(path)
+
+    def url(self, path: str) -> str:
+        return f'http://127.0.0.1:{self.server.server_address[1]}{path}'
+
+
+def remove_store() -> None:
+    # the store dedupes by content, start over so each run downloads again
+    import downloader
+    from artifact_store import remove_path
+    remove_path(os.path.join(downloader.files_path(), 'store'))
+    downloader.store = None
+
+
+def payload(size: int, seed: int = 0) -> bytes:
+    # incompressible, so an archive of it is as large as what it holds
+    return random.Random(seed).randbytes(size)
+
+
+def timed(fn: Callable[[], Any]) -> float:
+    started = time.perf_counter()
+    fn()
+    return time.perf_counter() - started
+
+
+def load_baseline(name: str) -> dict[str, float]:
+    try:
+        with open(BASELINE) as f:
+            return json.load(f).get(name, {})
+    except FileNotFoundError:
+        return {}
+
+
+def save_baseline(name: str, results: dict[str, float]) -> None:
+    try:
+        with open(BASELINE) as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        baseline = {}
+    baseline[name] = {metric: round(value, 3) for metric, value in results.items()}
+    with open(BASELINE, 'w') as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def compare(results: dict[str, float], baseline: dict[str, float], metrics: dict[str, tuple]) -> dict[str, str]:
+    # metrics: name -> (title, unit, lower is better, noise floor)
+    regressions = {}
+    for metric, value in results.items():
+        base = baseline.get(metric, None)
+        if base is None or metric not in metrics:
+            continue
+        title, unit, lower, floor = metrics[metric]
+        if lower:
+            regressed = value > base * REGRESSION and value - base > floor
+        else:
+            regressed = value * REGRESSION < base and base - value > floor
+        if regressed:
+            regressions[metric] = f"{title}: {value:.2f} {unit}, baseline {base:.2f} {unit}"
+    return regressions
+
+
+def main(name: str | Callable[[argparse.Namespace], str], metrics: dict[str, tuple], run: Callable[[argparse.Namespace], dict[str, float]], parser: argparse.ArgumentParser = None) -> None:
+    # runs a benchmark, prints its metrics next to the checked in baseline
+    # and exits non-zero on a regression. name may depend on the arguments,
+    # when they change what is measured.
+    parser = parser or argparse.ArgumentParser()
+    parser.add_argument('--update-baseline', action='store_true', help=f"store this run as the baseline in {os.path.relpath(BASELINE)}")
+    args = parser.parse_args()
+    if callable(name):
+        name = name(args)
+    try:
+        results = run(args)
+    finally:
+        cleanup()
+
+    baseline = load_baseline(name)
+    regressions = compare(results, baseline, metrics)
+    for metric, (title, unit, _, _) in metrics.items():
+        if metric not in results:
+            continue
+        line = f"{title}: {results[metric]:.2f} {unit}"
+        if metric in baseline:
+            line += f" (baseline {baseline[metric]:.2f} {unit})"
+        if metric in regressions:
+            line += " REGRESSED"
+        print(line)
+
+    if args.update_baseline:
+        save_baseline(name, results)
+        print("Baseline updated")
+    elif regressions:
+        print(f"{name}: performance regressed")
+        sys.exit(1)
@@ -0,0 +1,106 @@
+import asyncio
+import contextlib
+import http.client
+import io
+import multiprocessing
+import multiprocessing.pool
+import platform
+import sys
+import time
+import urllib.parse
+
+import harness
+import plugin
+
+# Load test of the host metrics OpenMetrics endpoint: the real plugin
+# serves it over loopback http while client processes scrape it as fast
+# as they can on keep-alive connections, once with the snapshot cache at
+# its default ttl and once with it off. With the cache, /proc must be
+# read at most once per ttl no matter how many scrapes come in.
+
+CLIENTS = 8
+DURATION = 5
+
+METRICS = {
+    **{
+        f'{mode}_{metric}': (f"{title}, {label}", unit, lower, floor)
+        for mode, label in (('cached', "cached"), ('uncached', "no cache"))
+        for metric, title, unit, lower, floor in (
+            ('requests_per_second', "Scrapes/s", 'req/s', False, 0),
+            ('p50_ms', "p50 latency", 'ms', True, 2),
+            ('p99_ms', "p99 latency", 'ms', True, 5),
+        )
+    },
+}
+
+
+def client(url: str, duration: float) -> list[float]:
+    # runs in its own process so the clients don't compete with the
+    # plugin for the gil
+    parsed = urllib.parse.urlsplit(url)
+    conn = http.client.HTTPConnection(parsed.netloc, timeout=10)
+    latencies = []
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        conn.request('GET', parsed.path)
+        response = conn.getresponse()
+        body = response.read()
+        latencies.append(time.perf_counter() - started)
+        if response.status != 200 or not body.endswith(b'# EOF\n'):
+            raise Exception(f"bad scrape: HTTP {response.status} {body[-100:]!r}")
+    conn.close()
+    return latencies
+
+
+async def scrape(pool: multiprocessing.pool.Pool, url: str) -> list[float]:
+    loop = asyncio.get_running_loop()
+    result = pool.starmap_async(client, [(url, DURATION)] * CLIENTS)
+    return [latency for latencies in await loop.run_in_executor(None, result.get) for latency in latencies]
+
+
+async def measure(pool: multiprocessing.pool.Pool, notes: list[str]) -> dict[str, float]:
+    p = await plugin.start_plugin()
+    hostmetrics = await p.getDevice('hostmetrics')
+    await hostmetrics.collecting
+    endpoint = plugin.EndpointServer(hostmetrics)
+    url = await endpoint.start()
+    results = {}
+    try:
+        for mode, ttl in (('cached', hostmetrics.snapshot.ttl), ('uncached', 0)):
+            hostmetrics.snapshot.ttl = ttl
+            samples = hostmetrics.collector.samples
+            started = time.monotonic()
+            latencies = sorted(await scrape(pool, url))
+            elapsed = time.monotonic() - started
+            sampled = hostmetrics.collector.samples - samples
+            if ttl:
+                # the periodic collector samples too
+                allowed = elapsed / ttl + elapsed / hostmetrics.sample_interval + 2
+                assert sampled <= allowed, f"{sampled} samples for {len(latencies)} scrapes in {elapsed:.1f}s with a {ttl}s ttl"
+            notes.append(f"{mode}: {len(latencies)} scrapes, {sampled} samples of /proc")
+            results[f'{mode}_requests_per_second'] = len(latencies) / elapsed
+            results[f'{mode}_p50_ms'] = latencies[len(latencies) // 2] * 1000
+            results[f'{mode}_p99_ms'] = latencies[int(len(latencies) * 0.99)] * 1000
+    finally:
+        await endpoint.close()
+    return results
+
+
+def run(args) -> dict[str, float]:
+    # the clients fork before the event loop and the plugin's threads exist
+    with multiprocessing.get_context('fork').Pool(CLIENTS) as pool, harness.ArtifactServer() as server:
+        plugin.serve_release(server)
+        notes = []
+        # the plugin logs its startup
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = asyncio.run(measure(pool, notes))
+    print('\n'.join(notes))
+    return results
+
+
+if __name__ == '__main__':
+    if platform.system() != 'Linux':
+        print("host metrics are only collected on linux")
+        sys.exit(0)
+    harness.main('metrics_load', METRICS, run)
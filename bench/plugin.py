@@ -0,0 +1,126 @@
+import asyncio
+import io
+import json
+import platform
+from typing import Any
+import zipfile
+
+import harness
+
+import scrypted_sdk
+import main
+
+# Runs the real BtopPlugin against the scrypted_sdk stand-in, with the btop
+# release and the themes served from a local ArtifactServer instead of
+# github. The "btop" in the release is a shell script that paints a screen
+# and keeps updating it, enough for sessions, snapshots and first byte
+# timings.
+
+THEMES = 8
+FAKE_BTOP = '''#!/bin/sh
+# stands in for btop: a full paint, then a small update every 100 ms
+printf '\\033[2J\\033[H'
+i=0
+while [ $i -lt 24 ]; do
+    printf '\\033[%d;1H\\033[38;5;%dmrow %d \\342\\243\\277\\342\\243\\277\\342\\243\\277\\342\\243\\277' $((i + 1)) $((16 + i)) $i
+    i=$((i + 1))
+done
+while :; do
+    printf '\\033[1;1Hcpu %s' "$(date +%S)"
+    sleep 0.1
+done
+'''.encode()
+
+scrypted_sdk.fork_main = main.fork
+
+
+def theme(i: int) -> bytes:
+    return f'# Bench theme {i}\ntheme[main_bg]="#{i:06x}"\ntheme[main_fg]="#cccccc"\n'.encode()
+
+
+def release() -> bytes:
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr('btop/bin/btop', FAKE_BTOP)
+        for i in range(THEMES):
+            z.writestr(f'btop/share/btop/themes/bundled{i}.theme', theme(i))
+        z.writestr('btop/README.md', b'not extracted\n')
+    return data.getvalue()
+
+
+def serve_release(server: harness.ArtifactServer) -> list[str]:
+    # points the plugin's download table and theme manager at the server,
+    # returns the theme urls
+    url = server.add('/btop-release.zip', release())
+    point_downloads(url)
+    theme_urls = [server.add(f'/themes/bench{i}.theme', theme(i)) for i in range(THEMES)]
+    scrypted_sdk.deviceManager.getDeviceStorage('thememanager').setItem('theme_urls', json.dumps(theme_urls))
+    return theme_urls
+
+
+def point_downloads(url: str) -> None:
+    # the btop download for this platform, as the release at url
+    main.DOWNLOADS[platform.system().lower()] = {
+        platform.machine().lower(): {
+            "url": url,
+            "exe": "btop/bin/btop",
+            "members": ["btop/bin/btop", "btop/share/btop/themes"],
+            "extract": main.extract_zip,
+        },
+    }
+
+
+async def start_plugin() -> main.BtopPlugin:
+    # returns once the plugin is ready to serve, like the stage the
+    # startup benchmark stops at
+    plugin = main.create_scrypted_plugin()
+    await plugin.startup.stage('config_reconciled')
+    return plugin
+
+
+class EndpointServer:
+    # Plain http on loopback in front of a device's onRequest, the way the
+    # scrypted server routes /endpoint/<plugin>/ requests to the plugin.
+
+    def __init__(self, device: Any) -> None:
+        self.device = device
+        self.server: asyncio.Server = None
+        self.requests = 0
+
+    async def start(self) -> str:
+        self.server = await asyncio.start_server(self.connection, '127.0.0.1', 0)
+        return f'http://127.0.0.1:{self.server.sockets[0].getsockname()[1]}/endpoint/@scrypted/btop/public/{self.device.nativeId}/metrics'
+
+    async def close(self) -> None:
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                method, url, _ = line.decode().split(' ', 2)
+                headers = {}
+                while (header := await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    key, _, value = header.decode().partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                response = scrypted_sdk.HttpResponse()
+                await self.device.onRequest({
+                    'url': url,
+                    'method': method,
+                    'headers': headers,
+                    'rootPath': f'/endpoint/@scrypted/btop/public/{self.device.nativeId}',
+                    'isPublicEndpoint': True,
+                }, response)
+                self.requests += 1
+                body = response.body.encode() if isinstance(response.body, str) else bytes(response.body)
+                head = [f'HTTP/1.1 {response.options.get("code", 200)} OK', f'Content-Length: {len(body)}']
+                head += [f'{key}: {value}' for key, value in response.options.get('headers', {}).items()]
+                writer.write(('\r\n'.join(head) + '\r\n\r\n').encode() + body)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,157 @@
+import asyncio
+import contextlib
+import io
+import statistics
+import time
+from typing import Any, AsyncGenerator, Awaitable, Callable
+import zipfile
+
+import harness
+import plugin
+
+import downloader
+import main
+import scrypted_sdk
+from sessions import dim_message
+
+# The plugin benchmark, run from outside the plugin runtime: the real
+# BtopPlugin, BtopConfig and BtopThemeManager against the scrypted_sdk
+# stand-in, with btop and the themes served by a local ArtifactServer.
+# Measures cold and warm startup up to config_reconciled, download
+# throughput through download_sync, stream_sync and revalidate_sync,
+# getDeviceByName through the plugin's patched systemManager as the
+# registry grows, and connectStream to first byte.
+
+STARTUP_RUNS = 3
+DOWNLOAD_SIZE = 64 * 1024 * 1024
+REVALIDATIONS = 200
+REGISTRY_SIZES = (100, 1000, 10000)
+LOOKUPS = 10000
+FIRST_BYTE_RUNS = 5
+FIRST_BYTE_TIMEOUT = 30
+
+METRICS = {
+    'startup_cold_ms': ("Cold startup", 'ms', True, 200),
+    'startup_warm_ms': ("Warm startup", 'ms', True, 100),
+    'download_mib_s': ("download_sync throughput", 'MiB/s', False, 50),
+    'stream_mib_s': ("stream_sync throughput, zip", 'MiB/s', False, 50),
+    'revalidate_ms': ("revalidate_sync, not modified", 'ms', True, 2),
+    **{
+        f'lookup_us_{size}': (f"getDeviceByName, {size} devices", 'us', True, 5)
+        for size in REGISTRY_SIZES
+    },
+    'first_byte_ms': ("connectStream first byte", 'ms', True, 50),
+}
+
+
+def startup(cold: bool) -> float:
+    # each start gets a loop of its own, like a plugin process
+    if cold:
+        harness.remove_store()
+
+    async def start() -> float:
+        started = time.perf_counter()
+        await plugin.start_plugin()
+        return (time.perf_counter() - started) * 1000
+    return asyncio.run(start())
+
+
+def throughput(fn) -> float:
+    harness.remove_store()
+    return DOWNLOAD_SIZE / harness.timed(fn) / 1024 / 1024
+
+
+def measure_downloads(server: harness.ArtifactServer) -> dict[str, float]:
+    data = harness.payload(DOWNLOAD_SIZE)
+    url = server.add('/payload.bin', data)
+    archive = io.BytesIO()
+    # stored, it's the download and extract path being measured, not zlib
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_STORED) as z:
+        z.writestr('payload/payload.bin', data)
+    zip_url = server.add('/payload.zip', archive.getvalue())
+    quiet = lambda *args: None
+
+    results = {
+        'download_mib_s': throughput(lambda: downloader.download_sync(url, 'payload.bin', log=quiet)),
+        'stream_mib_s': throughput(lambda: downloader.stream_sync(zip_url, 'payload', main.extract_zip, ['payload/payload.bin'], log=quiet)),
+    }
+
+    theme_url = server.add('/themes/revalidated.theme', plugin.theme(0))
+    downloader.revalidate_sync(theme_url, 'revalidated.theme', log=quiet)
+    requested = len(server.requests)
+    elapsed = harness.timed(lambda: [downloader.revalidate_sync(theme_url, 'revalidated.theme', log=quiet) for _ in range(REVALIDATIONS)])
+    assert len(server.requests) - requested == REVALIDATIONS, "revalidate_sync did not go to the server"
+    results['revalidate_ms'] = elapsed / REVALIDATIONS * 1000
+    return results
+
+
+def measure_lookups() -> dict[str, float]:
+    # devices are registered the way the server announces them, so the
+    # index sees each one through its listener
+    manager = scrypted_sdk.systemManager
+    results = {}
+    added = 0
+    for size in REGISTRY_SIZES:
+        while added < size:
+            interfaces = [scrypted_sdk.ScryptedInterface.ScryptedPlugin.value] if added % 10 == 0 else [scrypted_sdk.ScryptedInterface.Settings.value]
+            manager.add(f'bench-{added}', f"Bench Device {added}", interfaces, f'bench-{added}', f"@bench/plugin-{added}")
+            added += 1
+        names = [f"Bench Device {i * 7919 % size}" for i in range(LOOKUPS)]
+        assert manager.getDeviceByName(names[0]) == f'bench-{0}'
+        assert manager.getDeviceByName(f"@bench/plugin-{size - 10}") == f'bench-{size - 10}'
+        started = time.perf_counter()
+        for name in names:
+            manager.getDeviceByName(name)
+        results[f'lookup_us_{size}'] = (time.perf_counter() - started) / LOOKUPS * 1000000
+    return results
+
+
+async def first_byte(connect: Callable[[AsyncGenerator[Any, None]], Awaitable[AsyncGenerator[Any, None]]]) -> float:
+    # ms from connectStream to the first output, the input stays open
+    # until then like a terminal's would
+    stop = asyncio.Event()
+
+    async def input() -> AsyncGenerator[Any, None]:
+        yield dim_message(80, 24)
+        await stop.wait()
+
+    started = time.monotonic()
+    output = await connect(input())
+    try:
+        async for _ in output:
+            return (time.monotonic() - started) * 1000
+        raise Exception("btop exited without any output")
+    finally:
+        stop.set()
+        await output.aclose()
+
+
+def measure_first_byte() -> float:
+    async def measure() -> float:
+        p = await plugin.start_plugin()
+
+        async def connect(input):
+            return await p.connectStream(input, None)
+        runs = []
+        for _ in range(FIRST_BYTE_RUNS):
+            runs.append(await asyncio.wait_for(first_byte(connect), FIRST_BYTE_TIMEOUT))
+        return statistics.median(runs)
+    return asyncio.run(measure())
+
+
+def run(args) -> dict[str, float]:
+    results = {}
+    with harness.ArtifactServer() as server:
+        plugin.serve_release(server)
+        # the plugin logs its startup
+        with contextlib.redirect_stdout(io.StringIO()):
+            results['startup_cold_ms'] = statistics.median(startup(cold=True) for _ in range(STARTUP_RUNS))
+            results['startup_warm_ms'] = statistics.median(startup(cold=False) for _ in range(STARTUP_RUNS))
+            results['first_byte_ms'] = measure_first_byte()
+            results.update(measure_lookups())
+            results.update(measure_downloads(server))
+    return results
+
+
+if __name__ == '__main__':
+    harness.main('plugin_benchmark', METRICS, run)
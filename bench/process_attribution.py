@@ -0,0 +1,68 @@
+import os
+import subprocess
+import sys
+import time
+
+import harness
+
+import attribution
+import procfs
+
+# Checks which plugin real processes are attributed to, from the
+# environment and command line they were started with, and times
+# identifying every process on this host. btop started by the terminal
+# service carries the session marker next to a plugin volume inherited
+# from whoever spawned it, in either order, and is ours either way.
+
+OWN = '@scrypted/btop'
+CORE_VOLUME = '/server/volume/plugins/@scrypted/core'
+PLUGIN_IDS = {OWN, '@scrypted/core', '@scrypted/homekit'}
+
+METRICS = {
+    'identify_us': ("Identify one process", 'us', True, 20),
+}
+
+CASES = (
+    ("volume before the marker", ['SCRYPTED_PLUGIN_VOLUME=' + CORE_VOLUME, 'SCRYPTED_BTOP_SESSION=1-1'], [], OWN),
+    ("marker before the volume", ['SCRYPTED_BTOP_SESSION=1-1', 'SCRYPTED_PLUGIN_VOLUME=' + CORE_VOLUME], [], OWN),
+    ("volume only", ['SCRYPTED_PLUGIN_VOLUME=' + CORE_VOLUME], [], '@scrypted/core'),
+    ("command line only", [], ['@scrypted/homekit'], '@scrypted/homekit'),
+    ("nothing", [], [], None),
+)
+
+
+def spawn(env: list[str], args: list[str]) -> subprocess.Popen:
+    # env -i sets the variables in the order given
+    return subprocess.Popen(['env', '-i', *env, 'sh', '-c', 'sleep 30', 'sh', *args])
+
+
+def run(args) -> dict[str, float]:
+    a = attribution.Attribution()
+    # as if this process were the plugin
+    a.own_plugin_id = OWN
+    processes = [(title, spawn(env, cmdline), expected) for title, env, cmdline, expected in CASES]
+    try:
+        # until each sh has exec'd with its environment
+        time.sleep(0.2)
+        for title, process, expected in processes:
+            environ = [entry.split(b'=', 1)[0] for entry in procfs.read_environ(process.pid) if entry]
+            found = a.identify(process.pid, PLUGIN_IDS)
+            assert found == expected, f"{title}: attributed to {found}, not {expected} (environ {environ})"
+            print(f"{title}: {found}")
+    finally:
+        for _, process, _ in processes:
+            process.kill()
+            process.wait()
+
+    pids = procfs.pids()
+    started = time.perf_counter()
+    for pid in pids:
+        a.identify(pid, PLUGIN_IDS)
+    return {'identify_us': (time.perf_counter() - started) / max(len(pids), 1) * 1000000}
+
+
+if __name__ == '__main__':
+    if not os.path.isdir('/proc/self'):
+        print("/proc is not readable here, nothing to check")
+        sys.exit(0)
+    harness.main('process_attribution', METRICS, run)
@@ -0,0 +1,93 @@
+import asyncio
+import itertools
+import pickle
+import struct
+from typing import Any
+
+# A minimal stand-in for the scrypted rpc between the plugin and its forks:
+# an object served on a loopback socket in one process, and a proxy in
+# another whose method calls are awaitable and may overlap, with errors
+# raised on the caller's side. Only the remote's public async methods are
+# callable.
+
+HEADER = struct.Struct('>I')
+
+
+async def read_message(reader: asyncio.StreamReader) -> Any:
+    size, = HEADER.unpack(await reader.readexactly(HEADER.size))
+    return pickle.loads(await reader.readexactly(size))
+
+
+def write_message(writer: asyncio.StreamWriter, message: Any) -> None:
+    data = pickle.dumps(message)
+    writer.write(HEADER.pack(len(data)) + data)
+
+
+async def serve(obj: Any) -> tuple[asyncio.Server, int]:
+    # returns the server and its port
+    async def call(writer: asyncio.StreamWriter, id: int, method: str, args: tuple) -> None:
+        try:
+            if method.startswith('_'):
+                raise Exception(f"{method} is not callable")
+            write_message(writer, (id, True, await getattr(obj, method)(*args)))
+        except Exception as e:
+            write_message(writer, (id, False, f"{type(e).__name__}: {e}"))
+
+    async def connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        calls = set()
+        try:
+            while True:
+                id, method, args = await read_message(reader)
+                task = asyncio.ensure_future(call(writer, id, method, args))
+                calls.add(task)
+                task.add_done_callback(calls.discard)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for task in calls:
+                task.cancel()
+            writer.close()
+
+    server = await asyncio.start_server(connection, '127.0.0.1', 0)
+    return server, server.sockets[0].getsockname()[1]
+
+
+class RemoteObject:
+
+    def __init__(self, port: int) -> None:
+        self.port = port
+        self.ids = itertools.count()
+        self.pending: dict[int, asyncio.Future] = {}
+        self.writer: asyncio.StreamWriter = None
+        self.receiving: asyncio.Task = None
+
+    async def connect(self) -> 'RemoteObject':
+        reader, self.writer = await asyncio.open_connection('127.0.0.1', self.port)
+        self.receiving = asyncio.ensure_future(self.receive(reader))
+        return self
+
+    async def close(self) -> None:
+        self.writer.close()
+        self.receiving.cancel()
+
+    async def receive(self, reader: asyncio.StreamReader) -> None:
+        try:
+            while True:
+                id, ok, result = await read_message(reader)
+                future = self.pending.pop(id)
+                if ok:
+                    future.set_result(result)
+                else:
+                    future.set_exception(Exception(result))
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            for future in self.pending.values():
+                future.set_exception(e)
+            self.pending.clear()
+
+    def __getattr__(self, method: str) -> Any:
+        async def call(*args: Any) -> Any:
+            id = next(self.ids)
+            future = self.pending[id] = asyncio.get_running_loop().create_future()
+            write_message(self.writer, (id, method, args))
+            return await future
+        return call
@@ -0,0 +1,226 @@
+import asyncio
+import enum
+import os
+import sys
+import types
+from typing import Any, Callable
+
+# Stand-in for the parts of scrypted_sdk the plugin uses, enough to run
+# BtopPlugin and its devices outside of a scrypted server. The registry
+# starts empty except for @scrypted/core, whose terminal service runs
+# commands on a local pty like the real one does.
+
+
+class ScryptedInterface(enum.Enum):
+    DeviceProvider = 'DeviceProvider'
+    HttpRequestHandler = 'HttpRequestHandler'
+    Readme = 'Readme'
+    ScryptedDevice = 'ScryptedDevice'
+    ScryptedPlugin = 'ScryptedPlugin'
+    Scriptable = 'Scriptable'
+    Sensors = 'Sensors'
+    Settings = 'Settings'
+    StreamService = 'StreamService'
+    TTYSettings = 'TTYSettings'
+
+
+class ScryptedDeviceType(enum.Enum):
+    API = 'API'
+    Builtin = 'Builtin'
+    Sensor = 'Sensor'
+
+
+Setting = dict
+ScriptSource = dict
+HttpRequest = dict
+
+
+class HttpResponse:
+    async def send(self, body: Any, options: dict = None) -> None:
+        self.body = body
+        self.options = options or {}
+
+
+class Storage:
+    def __init__(self) -> None:
+        self.items: dict[str, str] = {}
+
+    def getItem(self, key: str) -> str | None:
+        return self.items.get(key, None)
+
+    def setItem(self, key: str, value: str) -> None:
+        self.items[key] = value
+
+    def removeItem(self, key: str) -> None:
+        self.items.pop(key, None)
+
+
+class ScryptedDevice:
+    pass
+
+
+class ScryptedDeviceBase(ScryptedDevice):
+    def __init__(self, nativeId: str = None) -> None:
+        self.nativeId = nativeId
+        self.storage = deviceManager.getDeviceStorage(nativeId)
+
+    def print(self, *args: Any) -> None:
+        if deviceManager.verbose:
+            print(*args, file=sys.stderr)
+
+    async def onDeviceEvent(self, eventInterface: str, eventData: Any) -> None:
+        deviceManager.events.append((self.nativeId, eventInterface, eventData))
+
+
+class DeviceProvider:
+    pass
+
+
+class HttpRequestHandler:
+    pass
+
+
+class Readme:
+    pass
+
+
+class Scriptable:
+    pass
+
+
+class Sensors:
+    pass
+
+
+class Settings:
+    pass
+
+
+class StreamService:
+    pass
+
+
+class TTYSettings:
+    pass
+
+
+class TerminalService:
+    async def connectStream(self, input: Any, options: Any) -> Any:
+        import pty_process
+        return await pty_process.connect(options['cmd'], input, options.get('env', None))
+
+
+class Core:
+    def __init__(self) -> None:
+        self.terminalservice = TerminalService()
+
+    async def getDevice(self, nativeId: str) -> Any:
+        return self.terminalservice if nativeId == 'terminalservice' else None
+
+
+class SystemManager:
+    def __init__(self) -> None:
+        self.systemState: dict[str, dict] = {}
+        self.devices: dict[str, Any] = {}
+        self.listeners: list[Callable] = []
+
+    def getDeviceById(self, id: str) -> Any:
+        return self.devices.get(id, None)
+
+    def getDeviceByName(self, name: str) -> Any:
+        # the sdk's linear scan, which the plugin replaces with its index
+        for id, state in self.systemState.items():
+            interfaces = state.get('interfaces', {}).get('value', None) or []
+            if ScryptedInterface.ScryptedPlugin.value in interfaces and state.get('pluginId', {}).get('value', None) == name:
+                return self.getDeviceById(id)
+            if state.get('name', {}).get('value', None) == name:
+                return self.getDeviceById(id)
+        return None
+
+    def listen(self, callback: Callable) -> None:
+        self.listeners.append(callback)
+
+    def add(self, id: str, name: str, interfaces: list[str], device: Any = None, pluginId: str = None) -> None:
+        # registers a device and tells the listeners, like a device being
+        # created or renamed on the server
+        self.systemState[id] = {
+            'name': {'value': name},
+            'pluginId': {'value': pluginId or name},
+            'interfaces': {'value': interfaces},
+        }
+        self.devices[id] = device
+        for listener in list(self.listeners):
+            listener(types.SimpleNamespace(id=id), {'property': 'name'}, name)
+
+
+class DeviceManager:
+    def __init__(self) -> None:
+        self.storages: dict[str, Storage] = {}
+        self.discovered: dict[str, dict] = {}
+        self.events: list[tuple] = []
+        self.restarts = 0
+        self.verbose = bool(os.environ.get('BTOP_BENCH_VERBOSE', None))
+
+    def getDeviceStorage(self, nativeId: str = None) -> Storage:
+        return self.storages.setdefault(nativeId, Storage())
+
+    async def onDeviceDiscovered(self, device: dict) -> None:
+        self.discovered[device['nativeId']] = device
+
+    async def requestRestart(self) -> None:
+        self.restarts += 1
+
+
+class EndpointManager:
+    async def getAuthenticatedPath(self, nativeId: str = None) -> str:
+        return f'/endpoint/@scrypted/btop/{nativeId or ""}'
+
+    async def getInsecurePublicLocalEndpoint(self, nativeId: str = None) -> str:
+        return f'http://127.0.0.1:11080/endpoint/@scrypted/btop/public/{nativeId or ""}'
+
+
+class ClusterManager:
+    # not a cluster unless a script sets workers
+    def __init__(self) -> None:
+        self.workers: dict[str, dict] = {}
+        self.worker_id = None
+
+    def getClusterMode(self) -> str | None:
+        return 'server' if self.workers else None
+
+    def getClusterWorkerId(self) -> str | None:
+        return self.worker_id
+
+    async def getClusterWorkers(self) -> dict[str, dict]:
+        return dict(self.workers)
+
+
+class Fork:
+    def __init__(self, result: asyncio.Future) -> None:
+        self.result = result
+
+
+class SDK:
+    async def connectRPCObject(self, value: Any) -> Any:
+        return value
+
+
+systemManager = SystemManager()
+deviceManager = DeviceManager()
+endpointManager = EndpointManager()
+clusterManager = ClusterManager()
+sdk = SDK()
+# the plugin's fork() entry point, set by whoever imports main
+fork_main: Callable[[], Any] = None
+forks = 0
+
+
+def fork(options: dict = None) -> Fork:
+    # a fork runs in this process, which is all the plugin can tell apart
+    # through the rpc proxies anyway
+    global forks
+    forks += 1
+    return Fork(asyncio.ensure_future(fork_main()))
+
+
+systemManager.add('core', '@scrypted/core', [ScryptedInterface.ScryptedPlugin.value, ScryptedInterface.DeviceProvider.value], Core())
@@ -0,0 +1,113 @@
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import random
+import time
+from typing import AsyncGenerator
+
+import harness
+
+import stream_stage
+
+# Replays a captured btop session through the coalescing stage as fast as
+# it will go and reports the messages and bytes per second that come out,
+# plain and compressed. A capture is an asciicast v2 file, like the
+# plugin's own session recordings (one output event per pty read). Without
+# one, a deterministic stand-in shaped like btop's output is generated:
+# a full paint, then an update every update_ms split into pty sized reads.
+
+RUNS = 5
+COLS, ROWS = 200, 60
+UPDATES = 300
+PTY_READ = 4095
+
+METRICS = {
+    'messages_per_second': ("Messages/s", 'msg/s', False, 0),
+    'mib_per_second': ("Throughput", 'MiB/s', False, 0),
+    'compressed_messages_per_second': ("Messages/s, compressed", 'msg/s', False, 0),
+    'compressed_mib_per_second': ("Throughput, compressed", 'MiB/s', False, 0),
+}
+
+
+def load_capture(path: str) -> list[bytes]:
+    opener = gzip.open if path.endswith('.gz') else open
+    writes = []
+    with opener(path, 'rt') as f:
+        for line in f:
+            event = json.loads(line)
+            if isinstance(event, list) and event[1] == 'o':
+                writes.append(event[2].encode())
+    return writes
+
+
+def paint(rng: random.Random, rows: range) -> bytes:
+    # cursor moves, 256 colour runs and braille graph cells, like btop's boxes
+    out = []
+    for row in rows:
+        out.append(f'\x1b[{row + 1};1f')
+        col = 0
+        while col < COLS:
+            run = rng.randint(4, 24)
+            out.append(f'\x1b[38;5;{rng.randint(16, 255)}m')
+            out.append(''.join(rng.choice('⣀⣄⣤⣦⣶⣷⣿ ─│0123456789%') for _ in range(min(run, COLS - col))))
+            col += run
+    return ''.join(out).encode()
+
+
+def synthetic() -> list[bytes]:
+    rng = random.Random(0)
+    writes = []
+    for update in range(UPDATES):
+        # a full repaint now and then (resize, redraw), graphs and the
+        # process list otherwise
+        if update % 50 == 0:
+            output = b'\x1b[2J' + paint(rng, range(ROWS))
+        else:
+            output = paint(rng, range(0, ROWS, 3))
+        writes += [output[i:i + PTY_READ] for i in range(0, len(output), PTY_READ)]
+    return writes
+
+
+async def replay(writes: list[bytes], compress: bool) -> tuple[float, int, int]:
+    async def source() -> AsyncGenerator[bytes, None]:
+        for write in writes:
+            yield write
+            # a pty read per loop iteration, like the real source
+            await asyncio.sleep(0)
+
+    stats = stream_stage.StreamStats()
+    largest = 0
+    started = time.perf_counter()
+    async for frame in stream_stage.coalesce(source(), stats, interval=0.001, compress=compress):
+        largest = max(largest, len(frame))
+    elapsed = time.perf_counter() - started
+    # deflate can grow incompressible input by a few bytes per block
+    assert largest <= stream_stage.FRAME_MAX_BYTES + 64, f"{largest} byte frame over the {stream_stage.FRAME_MAX_BYTES} byte limit"
+    return elapsed, stats.frames, stats.bytes
+
+
+def run(args: argparse.Namespace) -> dict[str, float]:
+    writes = load_capture(args.capture) if args.capture else synthetic()
+    size = sum(len(write) for write in writes)
+    print(f"{len(writes)} writes, {size / 1024 / 1024:.1f} MiB")
+    results = {}
+    for compress, prefix in ((False, ''), (True, 'compressed_')):
+        best = None
+        for _ in range(RUNS):
+            elapsed, frames, _ = asyncio.run(replay(writes, compress))
+            if best is None or elapsed < best[0]:
+                best = (elapsed, frames)
+        elapsed, frames = best
+        print(f"{'compressed' if compress else 'plain'}: {frames} messages")
+        results[f'{prefix}messages_per_second'] = frames / elapsed
+        results[f'{prefix}mib_per_second'] = size / elapsed / 1024 / 1024
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--capture', help="asciicast v2 recording to replay (.cast or .cast.gz)")
+    # a capture is compared with its own baseline, not the generated stream's
+    harness.main(lambda args: f'stream_replay:{os.path.basename(args.capture)}' if args.capture else 'stream_replay', METRICS, run, parser)
@@ -0,0 +1,228 @@
+import contextlib
+import io
+import os
+import tarfile
+import threading
+import time
+from typing import Any
+import zipfile
+import zlib
+
+import harness
+
+import downloader
+import main
+from artifact_store import path_size
+
+# Wall time and peak disk use of installing a btop release archive, the
+# old way (download to a .tmp, then extractall) against the streaming path
+# production uses (extract the wanted members while downloading, keeping
+# only a small prefix of the archive on disk). The streaming peak has to
+# be below the old one. Also checks that the streaming path resumes after
+# a dropped connection and, for archives within the spool limit, after a
+# restart, that it reads zips written with data descriptors, and that a
+# corrupt archive leaves nothing behind.
+
+BINARY_SIZE = 24 * 1024 * 1024
+THEMES = 40
+RATE = 48 * 1024 * 1024
+MEMBERS = ['btop/bin/btop', 'btop/share/btop/themes']
+RUNS = 3
+
+METRICS = {
+    **{
+        f'{format}_{path}_{metric}': (f"{format} {path} path {title}", unit, True, floor)
+        for format in ('zip', 'tbz')
+        for path in ('old', 'streaming')
+        for metric, title, unit, floor in (('seconds', "wall time", 's', 0.2), ('peak_mib', "peak disk", 'MiB', 4))
+    },
+}
+
+
+class Unseekable(io.RawIOBase):
+    # zipfile writes data descriptors instead of seeking back when its
+    # output can't seek, the way streaming zip tools do
+    def __init__(self) -> None:
+        self.data = io.BytesIO()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b: bytes) -> int:
+        return self.data.write(b)
+
+
+def archive(format: str, binary_size: int = BINARY_SIZE, descriptors: bool = False) -> bytes:
+    files = {'btop/bin/btop': harness.payload(binary_size)}
+    for i in range(THEMES):
+        files[f'btop/share/btop/themes/theme{i}.theme'] = f'theme[main_bg]="#{i:06x}"\n'.encode() * 50
+    files['btop/README.md'] = b'not extracted\n' * 1000
+    if format == 'zip':
+        output = Unseekable() if descriptors else io.BytesIO()
+        with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as z:
+            for name, content in files.items():
+                # a stored member too, it is copied rather than inflated
+                z.writestr(name, content, zipfile.ZIP_STORED if name.endswith('README.md') else zipfile.ZIP_DEFLATED)
+        return (output.data if descriptors else output).getvalue()
+    data = io.BytesIO()
+    with tarfile.open(fileobj=data, mode='w:bz2') as z:
+        for name, content in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            z.addfile(info, io.BytesIO(content))
+    return data.getvalue()
+
+
+class DiskSampler:
+    # peak size of the artifact store while something runs
+    def __init__(self) -> None:
+        self.root = os.path.join(downloader.files_path(), 'store')
+        self.peak = 0
+        self.running = True
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+
+    def sample(self) -> None:
+        while self.running:
+            self.peak = max(self.peak, path_size(self.root))
+            time.sleep(0.002)
+
+    def __enter__(self) -> 'DiskSampler':
+        self.base = path_size(self.root)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.running = False
+        self.thread.join()
+
+    def peak_mib(self) -> float:
+        return (self.peak - self.base) / 1024 / 1024
+
+
+def old_path(url: str, filename: str, extract) -> str:
+    # what the plugin did before streaming: the whole archive to disk, then
+    # all of it extracted
+    store = downloader.get_store()
+    tmp = store.tmp_path(filename)
+    digest = downloader.fetch(url, tmp, log)
+    staging = store.staging_path(filename)
+    if extract is main.extract_zip:
+        with zipfile.ZipFile(tmp, 'r') as z:
+            z.extractall(staging)
+    else:
+        with tarfile.open(tmp, 'r:bz2') as z:
+            z.extractall(staging)
+    fullpath = store.add(filename, url, digest, staging)
+    downloader.remove_partial(tmp)
+    return fullpath
+
+
+def streaming_path(url: str, filename: str, extract) -> str:
+    return downloader.download_sync(url, filename, extract, MEMBERS, log)
+
+
+def log(*args) -> None:
+    pass
+
+
+def check_installed(fullpath: str, binary_size: int = BINARY_SIZE, only_members: bool = True) -> None:
+    with open(os.path.join(fullpath, 'btop/bin/btop'), 'rb') as f:
+        assert f.read() == harness.payload(binary_size), "extracted binary differs"
+    assert len(os.listdir(os.path.join(fullpath, 'btop/share/btop/themes'))) == THEMES
+    assert os.path.exists(os.path.join(fullpath, 'btop/README.md')) != only_members
+
+
+def check_resume(server: harness.ArtifactServer, data: bytes) -> None:
+    store = downloader.get_store()
+    url = server.add('/resume.zip', data)
+
+    # a dropped connection resumes within the same attempt
+    server.requests.clear()
+    server.drop_after = len(data) // 3
+    check_installed(streaming_path(url, 'resume-drop', main.extract_zip))
+    ranges = [headers.get('Range') for _, headers in server.requests]
+    assert ranges == [None, f'bytes={len(data) // 3}-'], ranges
+    assert not os.path.exists(store.tmp_path('resume-drop'))
+
+    # an extraction that fails partway, like the plugin being restarted,
+    # leaves the .tmp for the next attempt to pick up while the archive is
+    # within the spool limit
+    def interrupted(source, fullpath, members):
+        source.read(size // 2)
+        raise ConnectionResetError("restarted")
+
+    small_size = downloader.STREAM_SPOOL_MAX // 4
+    small = archive('zip', small_size)
+    assert len(small) < downloader.STREAM_SPOOL_MAX
+    for name, payload, size, binary_size, resumed in (
+        ('resume-restart', small, len(small), small_size, True),
+        ('restart-large', data, len(data), BINARY_SIZE, False),
+    ):
+        url = server.add(f'/{name}.zip', payload)
+        server.requests.clear()
+        try:
+            streaming_path(url, name, interrupted)
+            raise AssertionError("interrupted extraction succeeded")
+        except ConnectionResetError:
+            pass
+        tmp = store.tmp_path(name)
+        partial = os.path.getsize(tmp) if os.path.exists(tmp) else 0
+        if resumed:
+            assert partial >= size // 2, partial
+        else:
+            # past the limit the archive isn't kept, the next attempt starts over
+            assert not partial and not os.path.exists(tmp + '.meta'), partial
+        check_installed(streaming_path(url, name, main.extract_zip), binary_size)
+        ranges = [headers.get('Range') for _, headers in server.requests]
+        assert ranges == [None, f'bytes={partial}-' if resumed else None], ranges
+        assert not os.path.exists(tmp)
+
+    # zips written to a pipe have data descriptors instead of sizes up front
+    url = server.add('/descriptors.zip', archive('zip', small_size, descriptors=True))
+    check_installed(streaming_path(url, 'descriptors', main.extract_zip), small_size)
+
+    # a corrupt archive fails the same way every time, so nothing is kept
+    corrupt = bytearray(data)
+    corrupt[len(data) // 2:len(data) // 2 + 4096] = bytes(4096)
+    url = server.add('/corrupt.zip', bytes(corrupt))
+    try:
+        streaming_path(url, 'corrupt', main.extract_zip)
+        raise AssertionError("corrupt archive was installed")
+    except (zipfile.BadZipFile, zlib.error):
+        pass
+    assert not os.path.exists(store.tmp_path('corrupt'))
+    assert not [entry for entry in os.listdir(store.tmp_dir) if entry.startswith('corrupt')]
+
+
+def run(args) -> dict[str, float]:
+    downloader.RETRY_DELAY = 0
+    results = {}
+    # the extractors print what they extract
+    with harness.ArtifactServer(RATE) as server, contextlib.redirect_stdout(io.StringIO()):
+        for format, extract in (('zip', main.extract_zip), ('tbz', main.extract_tbz)):
+            data = archive(format)
+            url = server.add(f'/btop.{format}', data)
+            if format == 'zip':
+                check_resume(server, data)
+                # the store dedupes by digest, the runs below install again
+                harness.remove_store()
+            for path, install in (('old', old_path), ('streaming', streaming_path)):
+                seconds = []
+                peaks = []
+                for i in range(RUNS):
+                    with DiskSampler() as disk:
+                        started = time.perf_counter()
+                        fullpath = install(url, f'{format}-{path}-{i}', extract)
+                        seconds.append(time.perf_counter() - started)
+                    peaks.append(disk.peak_mib())
+                    check_installed(fullpath, only_members=path == 'streaming')
+                    # every run starts from an empty store
+                    harness.remove_store()
+                results[f'{format}_{path}_seconds'] = min(seconds)
+                results[f'{format}_{path}_peak_mib'] = max(peaks)
+            assert results[f'{format}_streaming_peak_mib'] < results[f'{format}_old_peak_mib'], f"{format}: streaming used as much disk as downloading first"
+    return results
+
+
+if __name__ == '__main__':
+    harness.main('streaming_download', METRICS, run)
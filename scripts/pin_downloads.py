@@ -0,0 +1,61 @@
+import argparse
+import hashlib
+import os
+import re
+import sys
+import urllib.request
+
+# Pins the sha256 of every release archive in main.py's DOWNLOADS, so a
+# replaced or tampered release asset fails the checksum instead of being
+# installed. Run it after changing a url; --check only verifies the pins.
+
+MAIN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src', 'main.py')
+URL = re.compile(r'^(?P<indent>[ \t]*)"url": "(?P<url>[^"]+)",\n(?P<pin>[ \t]*"sha256": "(?P<sha256>[0-9a-f]*)",\n)?', re.MULTILINE)
+
+
+def digest(url: str) -> str:
+    hasher = hashlib.sha256()
+    with urllib.request.urlopen(url, timeout=60) as response:
+        while True:
+            data = response.read(1024 * 1024)
+            if not data:
+                break
+            hasher.update(data)
+    return hasher.hexdigest()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--check', action='store_true', help="fail if a pin is missing or wrong instead of writing them")
+    args = parser.parse_args()
+
+    with open(MAIN) as f:
+        source = f.read()
+    start = source.index('DOWNLOADS = {')
+    end = source.index('\n}\n', start)
+    downloads = source[start:end]
+
+    digests = {}
+    for match in URL.finditer(downloads):
+        url = match.group('url')
+        if url not in digests:
+            print("Hashing", url)
+            digests[url] = digest(url)
+
+    if args.check:
+        wrong = [m.group('url') for m in URL.finditer(downloads) if m.group('sha256') != digests[m.group('url')]]
+        for url in wrong:
+            print("Missing or wrong sha256:", url)
+        sys.exit(1 if wrong else 0)
+
+    def pin(match: re.Match) -> str:
+        indent = match.group('indent')
+        return f'{indent}"url": "{match.group("url")}",\n{indent}"sha256": "{digests[match.group("url")]}",\n'
+
+    with open(MAIN, 'w') as f:
+        f.write(source[:start] + URL.sub(pin, downloads) + source[end:])
+    print("Pinned", len(digests), "archive(s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+import asyncio
+import hashlib
+import os
+import re
+import stat
+from typing import Any, Callable
+
+import downloader
+from artifact_store import remove_path
+
+
+READ_SIZE = 512 * 1024
+READS_IN_FLIGHT = 4
+DIGEST = re.compile(r'[0-9a-f]{64}')
+
+
+def object_manifest(root: str) -> list[dict]:
+    # every file in a store object with its size, mode and digest, a plain
+    # file artifact is a single entry with an empty path
+    if os.path.isfile(root):
+        return [file_entry(root, '')]
+    entries = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(dirnames + filenames):
+            full = os.path.join(dirpath, name)
+            path = os.path.relpath(full, root)
+            if os.path.islink(full):
+                entries.append({'path': path, 'link': os.readlink(full)})
+            elif os.path.isdir(full):
+                entries.append({'path': path, 'dir': True})
+            elif name in filenames:
+                entries.append(file_entry(full, path))
+    return entries
+
+
+def file_entry(full: str, path: str) -> dict:
+    hasher = hashlib.sha256()
+    downloader.hash_file(full, hasher)
+    info = os.stat(full)
+    return {
+        'path': path,
+        'size': info.st_size,
+        'mode': stat.S_IMODE(info.st_mode),
+        'sha256': hasher.hexdigest(),
+    }
+
+
+def read_object(root: str, path: str, offset: int, length: int) -> bytes:
+    full = os.path.realpath(os.path.join(root, path)) if path else root
+    if full != root and not full.startswith(root + os.sep):
+        raise Exception(f"Path {path} is outside of the artifact")
+    with open(full, 'rb') as f:
+        f.seek(offset)
+        return f.read(min(length, READ_SIZE * 4))
+
+
+class ArtifactSource:
+    # Served by the plugin on the server node and handed to forked workers,
+    # which fetch artifacts the server already has instead of going back to
+    # github for each worker.
+
+    def __init__(self) -> None:
+        self.manifests: dict[str, list[dict]] = {}
+        self.served = 0
+
+    async def describe(self, name: str, url: str) -> dict | None:
+        store = downloader.get_store()
+        artifact = store.artifact(name, url)
+        if not artifact:
+            return None
+        digest = artifact['digest']
+        manifest = self.manifests.get(digest, None)
+        if manifest is None:
+            # objects are immutable, so each is only hashed once
+            loop = asyncio.get_running_loop()
+            manifest = self.manifests[digest] = await loop.run_in_executor(downloader.executor, object_manifest, store.object_path(digest))
+        return {
+            'digest': digest,
+            'files': manifest,
+        }
+
+    async def read(self, digest: str, path: str, offset: int, length: int) -> bytes:
+        # the arguments come from another process, only files listed in
+        # the manifest of an object the store knows about are served
+        if not isinstance(digest, str) or not DIGEST.fullmatch(digest):
+            raise Exception(f"Invalid artifact digest {digest!r}")
+        store = downloader.get_store()
+        with store.lock:
+            known = digest in store.manifest['objects']
+        manifest = self.manifests.get(digest, None)
+        if not known or manifest is None:
+            raise Exception(f"Unknown artifact {digest}")
+        if not any(entry['path'] == path and 'sha256' in entry for entry in manifest):
+            raise Exception(f"{path} is not a file in artifact {digest}")
+        root = os.path.realpath(store.object_path(digest))
+        loop = asyncio.get_running_loop()
+        data = await loop.run_in_executor(downloader.executor, read_object, root, path, offset, length)
+        self.served += len(data)
+        return data
+
+
+async def fetch_file(source: Any, digest: str, entry: dict, target: str) -> None:
+    size = entry['size']
+    hasher = hashlib.sha256()
+    loop = asyncio.get_running_loop()
+    with open(target, 'wb') as f:
+        offset = 0
+        while offset < size:
+            # keep a few reads in flight to hide the rpc round trip
+            offsets = range(offset, min(offset + READ_SIZE * READS_IN_FLIGHT, size), READ_SIZE)
+            chunks = await asyncio.gather(*[source.read(digest, entry['path'], o, READ_SIZE) for o in offsets])
+            for o, chunk in zip(offsets, chunks):
+                expected = min(READ_SIZE, size - o)
+                if len(chunk) != expected:
+                    raise downloader.ChecksumError(f"Short read of {entry['path'] or digest} at {o}")
+                hasher.update(chunk)
+                await loop.run_in_executor(downloader.executor, f.write, chunk)
+            offset = offsets[-1] + READ_SIZE
+    if hasher.hexdigest() != entry['sha256']:
+        raise downloader.ChecksumError(f"Checksum mismatch for {entry['path'] or digest} from the server")
+    os.chmod(target, entry['mode'])
+
+
+async def fetch_from_source(source: Any, name: str, url: str, sha256: str = None, log: Callable[..., None] = print) -> str | None:
+    # returns None when the server doesn't have the artifact either
+    described = await source.describe(name, url)
+    if not described:
+        return None
+    digest = described['digest']
+    if sha256 and digest != sha256.lower():
+        return None
+    store = downloader.get_store()
+    loop = asyncio.get_running_loop()
+    local = store.artifact(name, url)
+    if (local and local['digest'] == digest) or os.path.exists(store.object_path(digest)):
+        return await loop.run_in_executor(downloader.executor, store.commit, name, url, digest)
+
+    files = described['files']
+    staging = store.staging_path(name)
+    try:
+        if len(files) == 1 and not files[0]['path']:
+            await fetch_file(source, digest, files[0], staging)
+        else:
+            os.makedirs(staging)
+            for entry in files:
+                target = os.path.join(staging, entry['path'])
+                if entry.get('dir'):
+                    os.makedirs(target, exist_ok=True)
+                elif 'link' in entry:
+                    os.symlink(entry['link'], target)
+                else:
+                    await fetch_file(source, digest, entry, target)
+    except:
+        remove_path(staging)
+        raise
+    log("Fetched", name, f"from the server ({sum(entry.get('size', 0) for entry in files)} bytes)")
+    return await loop.run_in_executor(downloader.executor, store.add, name, url, digest, staging)
+
+
+# set on forked workers to the server's ArtifactSource
+server: Any = None
+
+
+async def fetch(name: str, url: str, sha256: str = None, log: Callable[..., None] = print) -> str | None:
+    # try the server's copy first, None means fall back to the upstream url
+    if not server:
+        return None
+    try:
+        fullpath = await fetch_from_source(server, name, url, sha256, log)
+        if not fullpath:
+            log("Server does not have", name, "falling back to", url)
+        return fullpath
+    except:
+        log("Fetching", name, "from the server failed, falling back to", url)
+        import traceback
+        traceback.print_exc()
+        return None
@@ -0,0 +1,233 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from typing import Callable
+
+
+STORE_MAX_BYTES = 256 * 1024 * 1024
+FICLONE = 0x40049409
+
+
+def path_size(path: str) -> int:
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        for file in files:
+            try:
+                total += os.path.getsize(os.path.join(root, file))
+            except OSError:
+                pass
+    return total
+
+
+def remove_path(path: str) -> None:
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except PermissionError:
+            # store objects are read only, which windows refuses to delete
+            os.chmod(path, 0o644)
+            os.remove(path)
+
+
+def reflink(src: str, dst: str) -> None:
+    import fcntl
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
+
+def file_digest(path: str) -> str:
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(1024 * 1024)
+            if not data:
+                break
+            hasher.update(data)
+    return hasher.hexdigest()
+
+
+def same_contents(src: str, target: str) -> bool:
+    # a copy (or a clone) of the stored bytes is just as current as a link
+    try:
+        if os.path.samefile(src, target):
+            return True
+        if os.path.getsize(src) != os.path.getsize(target):
+            return False
+        return file_digest(src) == file_digest(target)
+    except OSError:
+        return False
+
+
+def install_file(src: str, target: str) -> str:
+    # prefer sharing the stored bytes with the target over copying them,
+    # a copy-on-write clone first since it stays independent of the store
+    src = os.path.realpath(src)
+    if same_contents(src, target):
+        return 'unchanged'
+    tmp = target + '.tmp'
+    for method, fn in [('reflink', reflink), ('hardlink', os.link), ('copy', shutil.copyfile)]:
+        remove_path(tmp)
+        try:
+            fn(src, tmp)
+        except (OSError, ImportError):
+            continue
+        os.replace(tmp, target)
+        return method
+    raise Exception(f"Unable to install {src} to {target}")
+
+
+class ArtifactStore:
+    # Downloads are stored by the sha256 of the fetched bytes under objects/,
+    # with a manifest mapping artifact names to their current digest and
+    # current/<name> links that are switched atomically between versions.
+
+    def __init__(self, root: str, max_bytes: int = STORE_MAX_BYTES) -> None:
+        self.root = root
+        self.max_bytes = max_bytes
+        self.objects_dir = os.path.join(root, 'objects')
+        self.current_dir = os.path.join(root, 'current')
+        self.tmp_dir = os.path.join(root, 'tmp')
+        self.manifest_path = os.path.join(root, 'manifest.json')
+        self.lock = threading.RLock()
+        for d in [self.objects_dir, self.current_dir, self.tmp_dir]:
+            os.makedirs(d, exist_ok=True)
+        self.manifest = self.load_manifest()
+
+    def load_manifest(self) -> dict:
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+        except:
+            manifest = {}
+        manifest.setdefault('artifacts', {})
+        manifest.setdefault('objects', {})
+        return manifest
+
+    def save_manifest(self) -> None:
+        tmp = self.manifest_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(tmp, self.manifest_path)
+
+    def object_path(self, digest: str) -> str:
+        return os.path.join(self.objects_dir, digest)
+
+    def tmp_path(self, name: str) -> str:
+        return os.path.join(self.tmp_dir, name + '.tmp')
+
+    def artifact(self, name: str, url: str) -> dict | None:
+        with self.lock:
+            artifact = self.manifest['artifacts'].get(name, None)
+            if not artifact or artifact.get('url') != url:
+                return None
+            if not os.path.exists(self.object_path(artifact['digest'])):
+                return None
+            return dict(artifact)
+
+    def lookup(self, name: str, url: str, sha256: str = None) -> str | None:
+        with self.lock:
+            artifact = self.manifest['artifacts'].get(name, None)
+            digest = None
+            if sha256:
+                digest = sha256.lower()
+            elif artifact and artifact.get('url') == url:
+                digest = artifact.get('digest')
+            if not digest or not os.path.exists(self.object_path(digest)):
+                return None
+            return self.commit(name, url, digest, artifact.get('validators') if artifact else None)
+
+    def staging_path(self, name: str) -> str:
+        staging = os.path.join(self.tmp_dir, f'{name}.{os.getpid()}.{threading.get_ident()}')
+        remove_path(staging)
+        return staging
+
+    def add(self, name: str, url: str, digest: str, staging: str, validators: dict = None) -> str:
+        target = self.object_path(digest)
+        if os.path.exists(target):
+            remove_path(staging)
+        else:
+            if os.path.isfile(staging):
+                # objects may be hardlinked into place, keep them immutable
+                os.chmod(staging, 0o444)
+            try:
+                os.rename(staging, target)
+            except OSError:
+                # another download of the same content won the race
+                remove_path(staging)
+        with self.lock:
+            self.manifest['objects'][digest] = {
+                'size': path_size(target),
+                'accessed': time.time(),
+            }
+            return self.commit(name, url, digest, validators)
+
+    def commit(self, name: str, url: str, digest: str, validators: dict = None) -> str:
+        with self.lock:
+            self.manifest['artifacts'][name] = {
+                'url': url,
+                'digest': digest,
+            }
+            if validators:
+                self.manifest['artifacts'][name]['validators'] = validators
+            object = self.manifest['objects'].setdefault(digest, {
+                'size': path_size(self.object_path(digest)),
+            })
+            object['accessed'] = time.time()
+            self.save_manifest()
+            return self.switch(name, digest)
+
+    def switch(self, name: str, digest: str) -> str:
+        target = self.object_path(digest)
+        link = os.path.join(self.current_dir, name)
+        tmp = link + '.tmp'
+        try:
+            remove_path(tmp)
+            os.symlink(os.path.relpath(target, self.current_dir), tmp)
+            os.replace(tmp, link)
+            return link
+        except OSError:
+            # symlinks may be unavailable (windows without developer mode),
+            # the manifest alone is the switch in that case
+            return target
+
+    def gc(self, log: Callable[..., None] = print) -> None:
+        with self.lock:
+            # staging directories left behind by an interrupted extraction,
+            # partial downloads are kept so they can be resumed
+            for entry in os.listdir(self.tmp_dir):
+                if not entry.endswith('.tmp') and not entry.endswith('.tmp.meta'):
+                    remove_path(os.path.join(self.tmp_dir, entry))
+
+            referenced = set(a['digest'] for a in self.manifest['artifacts'].values())
+            objects = self.manifest['objects']
+            for digest in os.listdir(self.objects_dir):
+                if digest not in objects:
+                    objects[digest] = {
+                        'size': path_size(self.object_path(digest)),
+                        'accessed': 0,
+                    }
+            for digest in list(objects):
+                if not os.path.exists(self.object_path(digest)):
+                    del objects[digest]
+
+            total = sum(o['size'] for o in objects.values())
+            unreferenced = sorted(
+                [d for d in objects if d not in referenced],
+                key=lambda d: objects[d].get('accessed', 0),
+            )
+            for digest in unreferenced:
+                if total <= self.max_bytes:
+                    break
+                log("Removing unused artifact", digest)
+                remove_path(self.object_path(digest))
+                total -= objects.pop(digest)['size']
+            self.save_manifest()
@@ -0,0 +1,150 @@
+import os
+import time
+import procfs
+
+
+UNATTRIBUTED = '(unattributed)'
+MIN_WINDOW = 1
+
+
+def plugin_from_volume(volume: str, plugin_ids: set[str]) -> str | None:
+    # plugin volumes live at <scrypted volume>/plugins/<plugin id>, where
+    # the id may be scoped, e.g. .../plugins/@scrypted/btop
+    _, found, rest = volume.rstrip('/').rpartition('/plugins/')
+    if not found:
+        return None
+    parts = rest.split('/')
+    for length in (2, 1):
+        candidate = '/'.join(parts[:length])
+        if candidate in plugin_ids:
+            return candidate
+    return '/'.join(parts[:2]) if rest.startswith('@') else parts[0]
+
+
+def plugin_from_cmdline(cmdline: list[str], plugin_ids: set[str]) -> str | None:
+    for arg in cmdline:
+        if arg in plugin_ids:
+            return arg
+        if '/plugins/' in arg:
+            plugin = plugin_from_volume(arg, plugin_ids)
+            if plugin in plugin_ids:
+                return plugin
+    return None
+
+
+class Process:
+    def __init__(self, pid: int, start: float, ppid: int, marker: str | None) -> None:
+        self.pid = pid
+        self.start = start
+        self.ppid = ppid
+        self.marker = marker
+        self.cpu = 0.0
+        self.rss = 0
+        self.io = 0
+        self.last_cpu = None
+        self.last_io = None
+
+
+class Attribution:
+    # Keeps a pid -> plugin map over /proc. A process's environment and
+    # command line are only read the first time its pid is seen, later
+    # refreshes just read stat and io for cpu, memory and disk usage.
+    # Processes without a marker of their own (ffmpeg, shells, ...) belong
+    # to the nearest ancestor that has one.
+
+    def __init__(self) -> None:
+        self.processes: dict[int, Process] = {}
+        self.last_refresh = None
+        self.usage: dict[str, dict] = {}
+        self.scanned = 0
+        self.refresh_time = 0
+        volume = os.environ.get('SCRYPTED_PLUGIN_VOLUME', None)
+        self.own_plugin_id = plugin_from_volume(volume, set()) if volume else None
+
+    def identify(self, pid: int, plugin_ids: set[str]) -> str | None:
+        # the marker wins wherever it is in the environment, a btop launched
+        # with env SCRYPTED_BTOP_SESSION=... inherits the volume of the
+        # process that spawned it, and that comes first
+        environ = {}
+        for entry in procfs.read_environ(pid):
+            key, _, value = entry.partition(b'=')
+            environ.setdefault(key, value)
+        # btop spawned by the terminal service runs under @scrypted/core
+        # but is tagged with the session that asked for it
+        if b'SCRYPTED_BTOP_SESSION' in environ and self.own_plugin_id:
+            return self.own_plugin_id
+        volume = environ.get(b'SCRYPTED_PLUGIN_VOLUME', None)
+        if volume:
+            plugin = plugin_from_volume(volume.decode(errors='replace'), plugin_ids)
+            if plugin:
+                return plugin
+        return plugin_from_cmdline(procfs.read_cmdline(pid), plugin_ids)
+
+    def owner(self, process: Process, owners: dict[int, str]) -> str:
+        chain = []
+        owner = UNATTRIBUTED
+        while process:
+            if process.pid in owners:
+                owner = owners[process.pid]
+                break
+            chain.append(process.pid)
+            if process.marker:
+                owner = process.marker
+                break
+            process = self.processes.get(process.ppid, None)
+        for pid in chain:
+            owners[pid] = owner
+        return owner
+
+    def refresh(self, plugin_ids: set[str]) -> dict[str, dict]:
+        now = time.monotonic()
+        if self.last_refresh is not None and now - self.last_refresh < MIN_WINDOW:
+            return self.usage
+        started = time.perf_counter()
+        elapsed = now - self.last_refresh if self.last_refresh is not None else None
+        self.last_refresh = now
+        uptime = procfs.uptime()
+
+        live = set()
+        for pid in procfs.pids():
+            stats = procfs.process_usage(pid)
+            if not stats:
+                continue
+            live.add(pid)
+            process = self.processes.get(pid, None)
+            if not process or process.start != stats['start']:
+                # new process, or the pid was reused since the last refresh
+                process = self.processes[pid] = Process(pid, stats['start'], stats['ppid'], self.identify(pid, plugin_ids))
+                self.scanned += 1
+            process.ppid = stats['ppid']
+
+            io = procfs.read_io(pid)
+            io = io.get('read_bytes', 0) + io.get('write_bytes', 0)
+            if process.last_cpu is not None and elapsed:
+                process.cpu = (stats['cpu'] - process.last_cpu) / elapsed
+                process.io = (io - process.last_io) / elapsed
+            else:
+                # first sighting, average over the process lifetime
+                lifetime = uptime - stats['start']
+                process.cpu = stats['cpu'] / lifetime if lifetime > 0 else 0
+                process.io = io / lifetime if lifetime > 0 else 0
+            process.last_cpu = stats['cpu']
+            process.last_io = io
+            process.rss = stats['rss']
+
+        for pid in list(self.processes):
+            if pid not in live:
+                del self.processes[pid]
+
+        owners: dict[int, str] = {}
+        usage: dict[str, dict] = {}
+        for process in self.processes.values():
+            owner = self.owner(process, owners)
+            totals = usage.setdefault(owner, {'processes': 0, 'cpu': 0.0, 'rss': 0, 'io': 0.0})
+            totals['processes'] += 1
+            totals['cpu'] += process.cpu * 100
+            totals['rss'] += process.rss
+            totals['io'] += process.io
+        self.usage = usage
+        self.refresh_time = time.perf_counter() - started
+        return usage
@@ -1,3 +1,9 @@
+import os
+import re
+import tempfile
+from typing import Any
+
+
 BTOP_CONFIG = """
 #? Config file for btop v. 1.2.2
 
@@ -207,4 +213,107 @@ log_level = "DEBUG"
 #* an http server can be run on the host to provide the data. Run https://github.com/bjia56/intel-gpu-exporter
 #* on the host and set its url here.
 intel_gpu_exporter = ""
-""".strip()
\ No newline at end of file
+""".strip()
+
+LINE = re.compile(r'^\s*([A-Za-z_][A-Za-z0-9_]*)\s*=\s*(.*?)\s*$')
+
+
+def parse_value(raw: str) -> Any:
+    # btop writes booleans as True/False, numbers bare and everything else
+    # in double quotes
+    if len(raw) >= 2 and raw.startswith('"') and raw.endswith('"'):
+        return raw[1:-1]
+    if raw in ('True', 'False'):
+        return raw == 'True'
+    if re.fullmatch(r'-?[0-9]+', raw):
+        return int(raw)
+    return raw
+
+
+def parse(text: str) -> dict[str, Any]:
+    # comments, blank lines, spacing and order don't matter to btop, only
+    # the values do, the last one wins like in btop
+    values = {}
+    for line in text.splitlines():
+        if line.lstrip().startswith('#'):
+            continue
+        match = LINE.match(line)
+        if match:
+            values[match.group(1)] = parse_value(match.group(2))
+    return values
+
+
+# the documented keys and their types, taken from the default config
+OPTIONS = parse(BTOP_CONFIG)
+
+
+def validate(values: dict[str, Any]) -> tuple[list[str], list[str]]:
+    # returns errors for values btop would reject and the keys it doesn't
+    # document, which newer btop versions may still understand
+    errors = []
+    unknown = []
+    for key, value in values.items():
+        if key not in OPTIONS:
+            unknown.append(key)
+            continue
+        expected = type(OPTIONS[key])
+        if expected is bool and not isinstance(value, bool):
+            errors.append(f"{key} must be True or False")
+        elif expected is int and (isinstance(value, bool) or not isinstance(value, int)):
+            errors.append(f"{key} must be a whole number")
+    return errors, unknown
+
+
+def diff(old: dict[str, Any], new: dict[str, Any]) -> dict[str, tuple[Any, Any]]:
+    # a key that goes missing falls back to btop's built in default, which
+    # isn't necessarily the one in BTOP_CONFIG, so that counts as a change
+    return {
+        key: (old.get(key, None), new.get(key, None))
+        for key in sorted(old.keys() | new.keys())
+        if key not in old or key not in new or old[key] != new[key] or type(old[key]) != type(new[key])
+    }
+
+
+def describe_changes(changes: dict[str, tuple[Any, Any]]) -> str:
+    return ', '.join(f"{key}: {old!r} -> {new!r}" for key, (old, new) in changes.items())
+
+
+def read_config(path: str) -> str | None:
+    try:
+        with open(path) as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def write_config(path: str, data: str) -> bool:
+    # returns whether the file changed, writes go through a temp file and
+    # rename so btop never reads a partially written config
+    try:
+        with open(path) as f:
+            if f.read() == data:
+                return False
+    except FileNotFoundError:
+        if not data:
+            return False
+
+    if not data:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        return True
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # sessions sharing a profile may write its config at the same time, each
+    # gets a temp file of its own
+    fd, tmp = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp', dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(data)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except:
+        os.remove(tmp)
+        raise
+    return True
@@ -0,0 +1,211 @@
+import glob
+import os
+import time
+from typing import Any
+
+
+SAMPLE_INTERVAL = 10
+VIRTUAL_BLOCK_DEVICES = ('loop', 'ram', 'zram', 'dm-', 'md', 'sr', 'fd')
+SECTOR_SIZE = 512
+CLK_TCK = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+
+class ProcFile:
+    # /proc and /sys files regenerate their contents on each read from the
+    # start, so keep them open and seek back instead of reopening per sample
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.file = None
+
+    def read(self) -> bytes | None:
+        try:
+            if not self.file:
+                self.file = open(self.path, 'rb', buffering=0)
+            self.file.seek(0)
+            return self.file.read(65536)
+        except OSError:
+            self.close()
+            return None
+
+    def close(self) -> None:
+        if self.file:
+            try:
+                self.file.close()
+            except:
+                pass
+            self.file = None
+
+
+def block_devices() -> list[str]:
+    # whole disks only, partitions and virtual devices would double count
+    try:
+        return sorted(name for name in os.listdir('/sys/block') if not name.startswith(VIRTUAL_BLOCK_DEVICES))
+    except OSError:
+        return []
+
+
+def thermal_zone() -> str | None:
+    # prefer a zone that looks like the cpu package, otherwise the first one
+    zones = sorted(glob.glob('/sys/class/thermal/thermal_zone*'))
+    for zone in zones:
+        try:
+            with open(os.path.join(zone, 'type')) as f:
+                kind = f.read().strip().lower()
+        except OSError:
+            continue
+        if 'cpu' in kind or 'pkg' in kind or 'soc' in kind:
+            return os.path.join(zone, 'temp')
+    return os.path.join(zones[0], 'temp') if zones else None
+
+
+class Collector:
+    # Samples host cpu, memory, network and disk usage. Counters are kept
+    # between samples so rates cover the time since the previous one.
+
+    def __init__(self, disk_path: str = '/') -> None:
+        self.disk_path = disk_path
+        self.stat = ProcFile('/proc/stat')
+        self.meminfo = ProcFile('/proc/meminfo')
+        self.loadavg = ProcFile('/proc/loadavg')
+        self.netdev = ProcFile('/proc/net/dev')
+        self.diskstats = ProcFile('/proc/diskstats')
+        self.disks = set(block_devices())
+        zone = thermal_zone()
+        self.temperature = ProcFile(zone) if zone else None
+        self.previous: dict[str, Any] = {}
+        self.samples = 0
+        self.sample_time = 0
+        self.last_sample = None
+
+    def available(self) -> bool:
+        return self.stat.read() is not None
+
+    def cpu(self) -> dict[str, Any]:
+        data = self.stat.read()
+        if not data:
+            return {}
+        # user nice system idle iowait irq softirq steal
+        fields = [int(field) for field in data[:data.index(b'\n')].split()[1:9]]
+        idle = fields[3] + fields[4]
+        total = sum(fields)
+        previous = self.previous.get('cpu', None)
+        self.previous['cpu'] = (idle, total)
+        if not previous or total == previous[1]:
+            return {}
+        return {'cpu': 100 * (1 - (idle - previous[0]) / (total - previous[1]))}
+
+    def memory(self) -> dict[str, Any]:
+        data = self.meminfo.read()
+        if not data:
+            return {}
+        info = {}
+        for line in data.split(b'\n'):
+            key, _, value = line.partition(b':')
+            if key in (b'MemTotal', b'MemAvailable', b'SwapTotal', b'SwapFree'):
+                info[key] = int(value.split()[0]) * 1024
+        if not info.get(b'MemTotal'):
+            return {}
+        used = info[b'MemTotal'] - info.get(b'MemAvailable', 0)
+        metrics = {
+            'memory': 100 * used / info[b'MemTotal'],
+            'memory_used': used,
+        }
+        if info.get(b'SwapTotal'):
+            metrics['swap'] = 100 * (info[b'SwapTotal'] - info.get(b'SwapFree', 0)) / info[b'SwapTotal']
+        return metrics
+
+    def load(self) -> dict[str, Any]:
+        data = self.loadavg.read()
+        if not data:
+            return {}
+        return {'load': float(data.split()[0])}
+
+    def rates(self, key: str, counters: tuple[int, int], now: float) -> tuple[float, float] | None:
+        previous = self.previous.get(key, None)
+        self.previous[key] = (*counters, now)
+        if not previous or now <= previous[2]:
+            return None
+        elapsed = now - previous[2]
+        # counters reset when an interface or disk goes away and comes back
+        return tuple(max(counter - last, 0) / elapsed for counter, last in zip(counters, previous[:2]))
+
+    def network(self, now: float) -> dict[str, Any]:
+        data = self.netdev.read()
+        if not data:
+            return {}
+        rx = tx = 0
+        for line in data.split(b'\n')[2:]:
+            name, _, fields = line.partition(b':')
+            name = name.strip()
+            if not fields or name == b'lo':
+                continue
+            fields = fields.split()
+            rx += int(fields[0])
+            tx += int(fields[8])
+        rates = self.rates('network', (rx, tx), now)
+        if not rates:
+            return {}
+        return {'network_rx': rates[0], 'network_tx': rates[1]}
+
+    def disk(self, now: float) -> dict[str, Any]:
+        metrics = {}
+        try:
+            stat = os.statvfs(self.disk_path)
+            if stat.f_blocks:
+                metrics['disk'] = 100 * (1 - stat.f_bavail / stat.f_blocks)
+        except OSError:
+            pass
+        data = self.diskstats.read()
+        if not data:
+            return metrics
+        read = written = 0
+        for line in data.split(b'\n'):
+            fields = line.split()
+            if len(fields) < 10 or fields[2].decode() not in self.disks:
+                continue
+            read += int(fields[5])
+            written += int(fields[9])
+        rates = self.rates('disk', (read * SECTOR_SIZE, written * SECTOR_SIZE), now)
+        if rates:
+            metrics['disk_read'], metrics['disk_write'] = rates
+        return metrics
+
+    def thermal(self) -> dict[str, Any]:
+        data = self.temperature.read() if self.temperature else None
+        if not data:
+            return {}
+        return {'temperature': int(data) / 1000}
+
+    def sample(self) -> dict[str, Any]:
+        started = time.perf_counter()
+        now = time.monotonic()
+        metrics = {
+            **self.cpu(),
+            **self.memory(),
+            **self.load(),
+            **self.network(now),
+            **self.disk(now),
+            **self.thermal(),
+        }
+        self.samples += 1
+        self.sample_time += time.perf_counter() - started
+        self.last_sample = now
+        return metrics
+
+    def counters(self) -> dict[str, float]:
+        # running totals as of the last sample
+        counters = {}
+        if 'cpu' in self.previous:
+            idle, total = self.previous['cpu']
+            counters['cpu_idle_seconds'] = idle / CLK_TCK
+            counters['cpu_busy_seconds'] = (total - idle) / CLK_TCK
+        if 'network' in self.previous:
+            counters['network_rx_bytes'], counters['network_tx_bytes'] = self.previous['network'][:2]
+        if 'disk' in self.previous:
+            counters['disk_read_bytes'], counters['disk_write_bytes'] = self.previous['disk'][:2]
+        return counters
+
+    def overhead(self) -> str:
+        if not self.samples:
+            return "no samples yet"
+        return f"{self.sample_time * 1e6 / self.samples:.0f} µs per sample over {self.samples} samples"
@@ -0,0 +1,113 @@
+from typing import Any
+
+from scrypted_sdk import ScryptedInterface
+
+import tracing
+
+
+INDEXED_PROPERTIES = ('name', 'pluginId', 'interfaces')
+
+
+def state_value(state: dict, key: str) -> Any:
+    prop = state.get(key, None)
+    if not prop:
+        return None
+    return prop.get('value', None)
+
+
+class DeviceIndex:
+    # Maintains name -> id and pluginId -> id lookups over systemState so
+    # getDeviceByName does not need to walk every device on each call.
+
+    def __init__(self, systemState: dict) -> None:
+        self.systemState = systemState
+        self.by_name: dict[str, str] = {}
+        self.by_plugin_id: dict[str, str] = {}
+        self.keys: dict[str, tuple[str | None, str | None]] = {}
+        self.dirty = True
+        self.indexed_count = 0
+
+    def keys_for(self, id: str) -> tuple[str | None, str | None]:
+        state = self.systemState.get(id, None)
+        if not state:
+            return None, None
+        pluginId = None
+        interfaces = state_value(state, 'interfaces') or []
+        if ScryptedInterface.ScryptedPlugin.value in interfaces:
+            pluginId = state_value(state, 'pluginId')
+        return state_value(state, 'name'), pluginId
+
+    def unindex(self, id: str) -> None:
+        name, pluginId = self.keys.pop(id, (None, None))
+        if name is not None and self.by_name.get(name) == id:
+            del self.by_name[name]
+        if pluginId is not None and self.by_plugin_id.get(pluginId) == id:
+            del self.by_plugin_id[pluginId]
+
+    def index(self, id: str) -> None:
+        self.unindex(id)
+        name, pluginId = self.keys_for(id)
+        if name is None and pluginId is None:
+            return
+        self.keys[id] = (name, pluginId)
+        # first device wins, matching the iteration order of the linear scan
+        if name is not None:
+            self.by_name.setdefault(name, id)
+        if pluginId is not None:
+            self.by_plugin_id.setdefault(pluginId, id)
+
+    def rebuild(self) -> None:
+        with tracing.span('device.index_rebuild', devices=len(self.systemState)):
+            self.by_name = {}
+            self.by_plugin_id = {}
+            self.keys = {}
+            for id in self.systemState:
+                self.index(id)
+            self.indexed_count = len(self.systemState)
+            self.dirty = False
+
+    def on_event(self, eventSource: Any, eventDetails: Any, eventData: Any = None) -> None:
+        property = None
+        if isinstance(eventDetails, dict):
+            property = eventDetails.get('property', None)
+        if property and property not in INDEXED_PROPERTIES:
+            return
+
+        id = getattr(eventSource, 'id', None)
+        if not id or self.dirty:
+            self.dirty = True
+            return
+
+        # a removed or renamed device may have shadowed another device with the
+        # same key, so fall back to a full rebuild in that case
+        name, pluginId = self.keys.get(id, (None, None))
+        if (name is not None and self.by_name.get(name) == id) or \
+                (pluginId is not None and self.by_plugin_id.get(pluginId) == id):
+            if (name, pluginId) != self.keys_for(id):
+                self.dirty = True
+                return
+        self.index(id)
+        self.indexed_count = len(self.systemState)
+
+    def valid(self, id: str, name: str) -> bool:
+        state = self.systemState.get(id, None)
+        if not state:
+            return False
+        return name in self.keys_for(id)
+
+    def plugins(self) -> dict[str, str]:
+        # pluginId -> plugin name
+        if self.dirty or self.indexed_count != len(self.systemState):
+            self.rebuild()
+        return {pluginId: self.keys[id][0] or pluginId for pluginId, id in self.by_plugin_id.items()}
+
+    def lookup(self, name: str) -> str | None:
+        if self.dirty or self.indexed_count != len(self.systemState):
+            self.rebuild()
+
+        id = self.by_plugin_id.get(name, None) or self.by_name.get(name, None)
+        if id and not self.valid(id, name):
+            # the index missed an update, rebuild once and retry
+            self.rebuild()
+            id = self.by_plugin_id.get(name, None) or self.by_name.get(name, None)
+        return id
@@ -0,0 +1,524 @@
+import asyncio
+import base64
+import concurrent.futures
+import hashlib
+import http.client
+import json
+import os
+import threading
+import time
+from typing import Any, Callable
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import artifact_store
+import tracing
+from artifact_store import ArtifactStore, remove_path
+
+
+CHUNK_SIZE = 1024 * 1024
+# archives extracted while they download are only kept on disk up to here
+# for a later attempt to resume from
+STREAM_SPOOL_MAX = 4 * 1024 * 1024
+PROGRESS_INTERVAL = 5
+READ_TIMEOUT = 30
+RETRIES = 5
+RETRY_DELAY = 2
+RETRY_DELAY_MAX = 60
+MAX_REDIRECTS = 5
+
+executor = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix='btop-download')
+store: ArtifactStore = None
+store_lock = threading.Lock()
+# bytes fetched from upstream urls by this process and the time it took
+downloaded_bytes = 0
+download_time = 0
+
+
+def files_path() -> str:
+    return os.path.join(os.environ['SCRYPTED_PLUGIN_VOLUME'], 'files')
+
+
+class ProgressLogger:
+    def __init__(self, log: Callable[..., None], url: str, interval: float = PROGRESS_INTERVAL) -> None:
+        self.log = log
+        self.url = url
+        self.interval = interval
+        self.start = time.monotonic()
+        self.last = 0
+        self.finished = False
+
+    def update(self, read: int, total: int | None) -> None:
+        now = time.monotonic()
+        if now - self.last < self.interval:
+            return
+        self.last = now
+        if total:
+            self.log("Downloaded", read, "of", total, f"bytes ({read * 100 // total}%)")
+        else:
+            self.log("Downloaded", read, "bytes")
+
+    def done(self, read: int) -> None:
+        global downloaded_bytes, download_time
+        if self.finished:
+            return
+        self.finished = True
+        elapsed = max(time.monotonic() - self.start, 0.001)
+        downloaded_bytes += read
+        download_time += elapsed
+        tracing.count('download.bytes', read)
+        tracing.count('download.seconds', elapsed)
+        self.log("Downloaded", read, "bytes from", self.url, f"in {elapsed:.1f}s ({read / elapsed / 1024 / 1024:.2f} MiB/s)")
+
+
+class ChecksumError(Exception):
+    pass
+
+
+def read_meta(tmp: str) -> dict:
+    try:
+        with open(tmp + '.meta') as f:
+            return json.load(f)
+    except:
+        return {}
+
+
+def write_meta(tmp: str, meta: dict) -> None:
+    with open(tmp + '.meta', 'w') as f:
+        json.dump(meta, f)
+
+
+def remove_partial(tmp: str) -> None:
+    for path in [tmp, tmp + '.meta']:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def hash_file(path: str, hasher: Any) -> None:
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(CHUNK_SIZE)
+            if not data:
+                break
+            hasher.update(data)
+
+
+def retryable(e: Exception) -> bool:
+    if isinstance(e, urllib.error.HTTPError):
+        return e.code >= 500 or e.code in (408, 429)
+    return isinstance(e, (OSError, http.client.HTTPException))
+
+
+class ResumableReader:
+    # File-like view of an http download that hashes everything it returns
+    # and transparently reconnects with a Range request after a dropped
+    # connection, so consumers can stream from it without buffering.
+
+    def __init__(self, url: str, log: Callable[..., None], offset: int = 0, etag: str = None) -> None:
+        self.url = url
+        self.log = log
+        self.offset = offset
+        self.etag = etag
+        self.total = None
+        self.response = None
+        self.started = False
+        self.hasher = hashlib.sha256()
+        self.progress = ProgressLogger(log, url)
+
+    def connect(self) -> None:
+        request = urllib.request.Request(self.url)
+        if self.offset:
+            request.add_header('Range', f'bytes={self.offset}-')
+            if self.etag:
+                request.add_header('If-Range', self.etag)
+        try:
+            response = urllib.request.urlopen(request, timeout=READ_TIMEOUT)
+        except urllib.error.HTTPError as e:
+            if e.code == 416 and self.offset and not self.started:
+                # the partial file is not a prefix of the current entity
+                self.offset = 0
+                self.etag = None
+                return self.connect()
+            raise
+
+        code = response.getcode()
+        if code is not None and (code < 200 or code >= 300):
+            raise Exception(f"Error downloading {self.url}: HTTP {code}")
+        if self.offset and code != 206:
+            if self.started:
+                raise Exception(f"Error downloading {self.url}: content changed while resuming")
+            self.offset = 0
+        elif self.offset:
+            self.log("Resuming", self.url, "at", self.offset, "bytes")
+
+        self.etag = response.headers.get('ETag', None)
+        length = response.headers.get('Content-Length', None)
+        self.total = int(length) + self.offset if length else None
+        self.response = response
+        self.started = True
+
+    def open(self) -> 'ResumableReader':
+        self.with_retries(self.connect)
+        return self
+
+    def read_once(self, size: int) -> bytes:
+        if not self.response:
+            self.connect()
+        data = self.response.read(size)
+        if not data and self.total is not None and self.offset < self.total:
+            raise http.client.IncompleteRead(b'', self.total - self.offset)
+        return data
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = CHUNK_SIZE
+        data = self.with_retries(lambda: self.read_once(size))
+        self.offset += len(data)
+        self.hasher.update(data)
+        if data:
+            self.progress.update(self.offset, self.total)
+        else:
+            self.progress.done(self.offset)
+        return data
+
+    def with_retries(self, fn: Callable[[], Any]) -> Any:
+        delay = RETRY_DELAY
+        for attempt in range(1, RETRIES + 1):
+            try:
+                return fn()
+            except Exception as e:
+                if attempt == RETRIES or not retryable(e):
+                    raise
+                self.log("Download failed:", e, f"retrying in {delay}s")
+                self.close()
+                time.sleep(delay)
+                delay = min(delay * 2, RETRY_DELAY_MAX)
+
+    def drain(self) -> None:
+        while self.read(CHUNK_SIZE):
+            pass
+
+    def verify(self, sha256: str = None) -> str:
+        digest = self.hasher.hexdigest()
+        if sha256 and digest != sha256.lower():
+            raise ChecksumError(f"Checksum mismatch for {self.url}: expected {sha256}, got {digest}")
+        return digest
+
+    def close(self) -> None:
+        if self.response:
+            try:
+                self.response.close()
+            except:
+                pass
+        self.response = None
+
+
+class SpooledReader:
+    # A download read through a .tmp file that outlives the process: bytes
+    # a previous attempt already fetched are replayed from it first, and
+    # everything read from the network is appended to it, up to spool_max
+    # bytes after which the .tmp is dropped. Plain downloads spool all of it
+    # since the .tmp becomes the artifact. Streaming extraction keeps only a
+    # small prefix, a later attempt past it starts over while a dropped
+    # connection still resumes with a Range request.
+
+    def __init__(self, url: str, tmp: str, log: Callable[..., None], spool_max: int = None) -> None:
+        meta = read_meta(tmp)
+        offset = 0
+        if os.path.exists(tmp) and meta.get('url') == url:
+            offset = os.path.getsize(tmp)
+        self.url = url
+        self.tmp = tmp
+        self.network = ResumableReader(url, log, offset, meta.get('etag'))
+        self.spool_max = spool_max
+        self.replay = None
+        self.spool = None
+        self.hasher = hashlib.sha256()
+
+    def open(self) -> 'SpooledReader':
+        self.network.open()
+        # the offset drops to 0 when the server no longer has the same entity
+        if self.network.offset:
+            self.replay = open(self.tmp, 'rb')
+        write_meta(self.tmp, {
+            'url': self.url,
+            'etag': self.network.etag,
+        })
+        self.spool = open(self.tmp, 'ab' if self.network.offset else 'wb')
+        return self
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = CHUNK_SIZE
+        if self.replay:
+            data = self.replay.read(min(size, self.network.offset - self.replay.tell()))
+            if data:
+                self.hasher.update(data)
+                return data
+            self.replay.close()
+            self.replay = None
+        data = self.network.read(size)
+        if self.spool:
+            self.spool.write(data)
+            if self.spool_max is not None and self.network.offset > self.spool_max:
+                self.spool.close()
+                self.spool = None
+                remove_partial(self.tmp)
+        self.hasher.update(data)
+        return data
+
+    def drain(self) -> None:
+        while self.read(CHUNK_SIZE):
+            pass
+
+    def verify(self, sha256: str = None) -> str:
+        digest = self.hasher.hexdigest()
+        if sha256 and digest != sha256.lower():
+            raise ChecksumError(f"Checksum mismatch for {self.url}: expected {sha256}, got {digest}")
+        return digest
+
+    def close(self) -> None:
+        for f in (self.replay, self.spool):
+            if f:
+                f.close()
+        self.replay = self.spool = None
+        self.network.close()
+
+
+def fetch(url: str, tmp: str, log: Callable[..., None], sha256: str = None) -> str:
+    reader = SpooledReader(url, tmp, log).open()
+    try:
+        reader.drain()
+    finally:
+        reader.close()
+
+    try:
+        return reader.verify(sha256)
+    except ChecksumError:
+        remove_partial(tmp)
+        raise
+
+
+def proxy_for(scheme: str, host: str) -> urllib.parse.SplitResult | None:
+    # the same HTTP(S)_PROXY and NO_PROXY settings urllib honours
+    proxy = urllib.request.getproxies().get(scheme, None)
+    if not proxy or urllib.request.proxy_bypass(host):
+        return None
+    if '://' not in proxy:
+        proxy = 'http://' + proxy
+    return urllib.parse.urlsplit(proxy)
+
+
+def proxy_headers(proxy: urllib.parse.SplitResult) -> dict:
+    if not proxy.username:
+        return {}
+    credentials = f'{urllib.parse.unquote(proxy.username)}:{urllib.parse.unquote(proxy.password or "")}'
+    return {'Proxy-Authorization': 'Basic ' + base64.b64encode(credentials.encode()).decode()}
+
+
+class ConnectionPool:
+    # keep-alive http connections, one per host and download thread
+
+    def __init__(self) -> None:
+        self.local = threading.local()
+
+    def connection(self, scheme: str, host: str, proxy: urllib.parse.SplitResult = None, fresh: bool = False) -> http.client.HTTPConnection:
+        connections = getattr(self.local, 'connections', None)
+        if connections is None:
+            connections = self.local.connections = {}
+        key = (scheme, host, proxy)
+        conn = connections.get(key, None)
+        if fresh and conn:
+            conn.close()
+            conn = None
+        if not conn:
+            # https goes through a CONNECT tunnel, plain http is sent to
+            # the proxy with the full url
+            connect = proxy.netloc.rpartition('@')[2] if proxy else host
+            if scheme == 'https':
+                conn = http.client.HTTPSConnection(connect, timeout=READ_TIMEOUT)
+            else:
+                conn = http.client.HTTPConnection(connect, timeout=READ_TIMEOUT)
+            if proxy and scheme == 'https':
+                conn.set_tunnel(host, headers=proxy_headers(proxy))
+            connections[key] = conn
+        return conn
+
+    def get(self, url: str, headers: dict = {}) -> tuple[int, Any, bytes]:
+        for _ in range(MAX_REDIRECTS):
+            parsed = urllib.parse.urlsplit(url)
+            proxy = proxy_for(parsed.scheme, parsed.netloc)
+            path = parsed.path or '/'
+            if parsed.query:
+                path += '?' + parsed.query
+            request_headers = headers
+            if proxy and parsed.scheme == 'http':
+                path = urllib.parse.urlunsplit((parsed.scheme, parsed.netloc, path, '', ''))
+                request_headers = {**headers, **proxy_headers(proxy)}
+            for fresh in [False, True]:
+                conn = self.connection(parsed.scheme, parsed.netloc, proxy, fresh)
+                try:
+                    conn.request('GET', path, headers=request_headers)
+                    response = conn.getresponse()
+                    body = response.read()
+                    break
+                except (http.client.RemoteDisconnected, ConnectionError, http.client.CannotSendRequest, http.client.BadStatusLine):
+                    # the server closed an idle keep-alive connection
+                    if fresh:
+                        raise
+            if response.status in (301, 302, 303, 307, 308):
+                url = urllib.parse.urljoin(url, response.headers['Location'])
+                continue
+            return response.status, response.headers, body
+        raise Exception(f"Too many redirects downloading {url}")
+
+
+pool = ConnectionPool()
+
+
+def revalidate_sync(url: str, filename: str, log: Callable[..., None] = print) -> str:
+    # small files that live at unversioned urls (themes) are revalidated with
+    # the stored ETag/Last-Modified instead of trusting what is on disk
+    store = get_store()
+    artifact = store.artifact(filename, url)
+    headers = {}
+    if artifact:
+        validators = artifact.get('validators', None) or {}
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+
+    try:
+        with tracing.span('download.revalidate', file=filename) as span:
+            status, response_headers, body = pool.get(url, headers)
+            span.set(status=status, bytes=len(body or b''))
+    except Exception as e:
+        if not artifact:
+            raise
+        log("Unable to revalidate", url, e, "using cached copy")
+        return store.lookup(filename, url)
+
+    if status == 304 and artifact:
+        return store.lookup(filename, url)
+    if status < 200 or status >= 300:
+        if artifact:
+            log("Unable to revalidate", url, f"HTTP {status}", "using cached copy")
+            return store.lookup(filename, url)
+        raise Exception(f"Error downloading {url}: HTTP {status}")
+
+    log("Downloaded", len(body), "bytes from", url)
+    tracing.count('download.bytes', len(body))
+    staging = store.staging_path(filename)
+    with open(staging, 'wb') as f:
+        f.write(body)
+    return store.add(filename, url, hashlib.sha256(body).hexdigest(), staging, {
+        'etag': response_headers.get('ETag', None),
+        'last_modified': response_headers.get('Last-Modified', None),
+    })
+
+
+def get_store() -> ArtifactStore:
+    global store
+    with store_lock:
+        if not store:
+            store = ArtifactStore(os.path.join(files_path(), 'store'))
+            remove_legacy_files()
+            store.gc()
+        return store
+
+
+def remove_legacy_files() -> None:
+    # downloads used to be extracted directly into files/ and wiped
+    # whenever the cachebust marker changed
+    for entry in os.listdir(files_path()):
+        if entry != 'store':
+            remove_path(os.path.join(files_path(), entry))
+
+
+def stream_sync(url: str, filename: str, extract: Callable[[Any, str, list[str]], None], members: list[str] = None, log: Callable[..., None] = print, sha256: str = None) -> str:
+    # archives are extracted while they download into a staging path, which
+    # only enters the store once the checksum has been verified. The archive
+    # itself is never written out past a small prefix kept for resuming.
+    store = get_store()
+    staging = store.staging_path(filename)
+    tmp = store.tmp_path(filename)
+    reader = SpooledReader(url, tmp, log, STREAM_SPOOL_MAX).open()
+    try:
+        # the archive is read from the network as it is extracted, so this
+        # includes the download
+        with tracing.span('download.extract', file=filename, members=len(members or [])):
+            extract(reader, staging, members)
+        reader.drain()
+        digest = reader.verify(sha256)
+    except Exception as e:
+        remove_path(staging)
+        # keep what was downloaded after network errors, but not a corrupt
+        # archive that would fail the same way on every retry
+        if not retryable(e):
+            reader.close()
+            remove_partial(tmp)
+        raise
+    finally:
+        reader.close()
+    fullpath = store.add(filename, url, digest, staging)
+    remove_partial(tmp)
+    return fullpath
+
+
+def download_sync(url: str, filename: str, extract: Callable[[Any, str, list[str]], None] = None, members: list[str] = None, log: Callable[..., None] = print, sha256: str = None) -> str:
+    store = get_store()
+    fullpath = store.lookup(filename, url, sha256)
+    if fullpath:
+        tracing.count('download.cached')
+        return fullpath
+    log("Downloading", url)
+    with tracing.span('download', file=filename):
+        if extract:
+            return stream_sync(url, filename, extract, members, log, sha256)
+
+        tmp = store.tmp_path(filename)
+        digest = fetch(url, tmp, log, sha256)
+        fullpath = store.add(filename, url, digest, tmp)
+        remove_partial(tmp)
+        return fullpath
+
+
+async def download_file(url: str, filename: str, extract: Callable[[Any, str, list[str]], None] = None, members: list[str] = None, log: Callable[..., None] = print, sha256: str = None) -> str:
+    # the download and extraction block, so run them on the download pool and
+    # marshal progress logging back onto the event loop
+    loop = asyncio.get_running_loop()
+
+    def threadsafe_log(*args) -> None:
+        loop.call_soon_threadsafe(lambda: log(*args))
+
+    try:
+        return await loop.run_in_executor(executor, download_sync, url, filename, extract, members, threadsafe_log, sha256)
+    except:
+        log("Error downloading", url)
+        import traceback
+        traceback.print_exc()
+        raise
+
+
+async def revalidate_file(url: str, filename: str, log: Callable[..., None] = print) -> str:
+    loop = asyncio.get_running_loop()
+
+    def threadsafe_log(*args) -> None:
+        loop.call_soon_threadsafe(lambda: log(*args))
+
+    try:
+        return await loop.run_in_executor(executor, revalidate_sync, url, filename, threadsafe_log)
+    except:
+        log("Error downloading", url)
+        import traceback
+        traceback.print_exc()
+        raise
+
+
+async def install_file(src: str, target: str) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, artifact_store.install_file, src, target)
@@ -0,0 +1,89 @@
+import math
+import time
+from typing import Any, Callable
+
+from stats import LatencyHistogram
+
+
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+SNAPSHOT_TTL = 5
+
+
+def escape(value: Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Family:
+    def __init__(self, name: str, type: str, help: str) -> None:
+        self.name = name
+        self.type = type
+        self.help = help
+        self.samples: list[tuple[str, dict, float]] = []
+
+    def add(self, value: float | None, suffix: str = '', **labels: Any) -> 'Family':
+        if value is not None:
+            self.samples.append((suffix, labels, value))
+        return self
+
+    def render(self) -> str:
+        lines = [f"# TYPE {self.name} {self.type}", f"# HELP {self.name} {escape(self.help)}"]
+        for suffix, labels, value in self.samples:
+            label = ','.join(f'{key}="{escape(val)}"' for key, val in labels.items())
+            lines.append(f"{self.name}{suffix}{{{label}}} {format_value(value)}" if label else f"{self.name}{suffix} {format_value(value)}")
+        return '\n'.join(lines)
+
+
+def gauge(name: str, help: str, value: float = None, **labels: Any) -> Family:
+    return Family(name, 'gauge', help).add(value, **labels)
+
+
+def counter(name: str, help: str, value: float = None, **labels: Any) -> Family:
+    return Family(name, 'counter', help).add(value, '_total', **labels)
+
+
+def histogram(name: str, help: str, histogram: LatencyHistogram) -> Family:
+    # LatencyHistogram counts per bucket in milliseconds, the exposition
+    # format wants cumulative counts and seconds
+    family = Family(name, 'histogram', help)
+    seen = 0
+    for bound, count in zip([*histogram.buckets, math.inf], histogram.counts):
+        seen += count
+        family.add(seen, '_bucket', le=format_value(bound / 1000 if bound != math.inf else bound))
+    family.add(histogram.count, '_count')
+    family.add(histogram.sum / 1000, '_sum')
+    return family
+
+
+def render(families: list[Family]) -> bytes:
+    return ('\n'.join(family.render() for family in families if family.samples) + '\n# EOF\n').encode()
+
+
+class Snapshot:
+    # Scrapes within the ttl get the previous rendering, so frequent or
+    # concurrent scrapers don't each trigger a fresh read of /proc.
+
+    def __init__(self, build: Callable[[], bytes], ttl: float = SNAPSHOT_TTL) -> None:
+        self.build = build
+        self.ttl = ttl
+        self.body = None
+        self.built = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self) -> bytes:
+        now = time.monotonic()
+        if self.body is None or now - self.built >= self.ttl:
+            self.body = self.build()
+            self.built = now
+            self.misses += 1
+        else:
+            self.hits += 1
+        return self.body
@@ -0,0 +1,148 @@
+import math
+import mmap
+import os
+import struct
+import time
+
+
+MAGIC = b'BTOPHIST'
+VERSION = 1
+# seconds per bucket and number of buckets kept, coarser tiers hold the
+# mean of every sample that fell in their bucket
+TIERS = ((1, 3600), (60, 1440), (900, 2976))
+FLUSH_INTERVAL = 60
+SPARKS = '▁▂▃▄▅▆▇█'
+
+
+class Tier:
+    # Fixed size ring of buckets. Each slot holds its bucket number, so a
+    # slot left over from a previous lap of the ring is recognised as stale
+    # without ever having to clear it.
+
+    def __init__(self, buffer: memoryview, resolution: int, size: int, metrics: int) -> None:
+        self.resolution = resolution
+        self.size = size
+        self.metrics = metrics
+        self.buckets = buffer[:size * 8].cast('q')
+        values = buffer[size * 8:size * 8 + size * metrics * 16].cast('d')
+        self.means = values[:size * metrics]
+        self.counts = values[size * metrics:]
+
+    @staticmethod
+    def nbytes(size: int, metrics: int) -> int:
+        return size * 8 + size * metrics * 16
+
+    def record(self, timestamp: float, values: list[float | None]) -> None:
+        bucket = int(timestamp // self.resolution)
+        slot = bucket % self.size
+        base = slot * self.metrics
+        if self.buckets[slot] != bucket:
+            self.buckets[slot] = bucket
+            for i in range(self.metrics):
+                self.means[base + i] = math.nan
+                self.counts[base + i] = 0
+        for i, value in enumerate(values):
+            if value is None:
+                continue
+            count = self.counts[base + i] + 1
+            mean = self.means[base + i]
+            self.means[base + i] = value if count == 1 else mean + (value - mean) / count
+            self.counts[base + i] = count
+
+    def span(self) -> int:
+        return self.resolution * self.size
+
+    def query(self, index: int, start: float, end: float) -> list[tuple[int, float]]:
+        first = max(int(start // self.resolution), int(end // self.resolution) - self.size + 1)
+        last = int(end // self.resolution)
+        points = []
+        for bucket in range(first, last + 1):
+            slot = bucket % self.size
+            if self.buckets[slot] != bucket:
+                continue
+            value = self.means[slot * self.metrics + index]
+            if not math.isnan(value):
+                points.append((bucket * self.resolution, value))
+        return points
+
+
+class History:
+    # Metrics history kept in a memory mapped file, so it survives plugin
+    # restarts and its size is fixed by the tiers no matter how long the
+    # plugin runs.
+
+    def __init__(self, path: str, metrics: list[str], tiers: tuple = TIERS) -> None:
+        self.path = path
+        self.metrics = list(metrics)
+        self.index = {name: i for i, name in enumerate(self.metrics)}
+        self.tiers_spec = tiers
+        self.last_flush = time.monotonic()
+
+        header = self.header()
+        size = len(header) + sum(Tier.nbytes(n, len(self.metrics)) for _, n in tiers)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            existing = os.read(fd, len(header))
+            fresh = existing != header or os.fstat(fd).st_size != size
+            if fresh:
+                # new file, or a layout from a different metric list or tier
+                # setup, start over rather than misreading it
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+                os.pwrite(fd, header, 0)
+            self.mmap = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+        buffer = memoryview(self.mmap)
+        offset = len(header)
+        self.tiers = []
+        for resolution, n in tiers:
+            nbytes = Tier.nbytes(n, len(self.metrics))
+            tier = Tier(buffer[offset:offset + nbytes], resolution, n, len(self.metrics))
+            if fresh:
+                # bucket -1 never matches a real timestamp
+                for i in range(n):
+                    tier.buckets[i] = -1
+            self.tiers.append(tier)
+            offset += nbytes
+
+    def header(self) -> bytes:
+        layout = ','.join(self.metrics) + ';' + ','.join(f'{r}x{n}' for r, n in self.tiers_spec)
+        encoded = layout.encode()
+        return MAGIC + struct.pack('<II', VERSION, len(encoded)) + encoded
+
+    def record(self, timestamp: float, metrics: dict[str, float]) -> None:
+        values = [metrics.get(name, None) for name in self.metrics]
+        for tier in self.tiers:
+            tier.record(timestamp, values)
+        if time.monotonic() - self.last_flush > FLUSH_INTERVAL:
+            self.flush()
+
+    def query(self, metric: str, start: float, end: float = None, resolution: int = None) -> list[tuple[int, float]]:
+        # uses the finest tier that still holds start, unless a minimum
+        # resolution is asked for. A tier only reaches back span() seconds
+        # from now, however short the queried range is.
+        now = time.time()
+        end = now if end is None else end
+        index = self.index[metric]
+        for tier in self.tiers:
+            if resolution and tier.resolution < resolution:
+                continue
+            if start >= now - tier.span() or tier is self.tiers[-1]:
+                return tier.query(index, start, end)
+        return []
+
+    def sparkline(self, metric: str, seconds: int = 3600, resolution: int = 60) -> str:
+        points = self.query(metric, time.time() - seconds, resolution=resolution)
+        if not points:
+            return ''
+        values = [value for _, value in points]
+        low, high = min(values), max(values)
+        scale = (len(SPARKS) - 1) / (high - low) if high > low else 0
+        return ''.join(SPARKS[round((value - low) * scale)] for value in values)
+
+    def flush(self) -> None:
+        self.last_flush = time.monotonic()
+        self.mmap.flush()
@@ -1,59 +1,87 @@
 import asyncio
+import functools
 import json
 import os
 import platform
-import shutil
 import tarfile
+import time
 import types
-from typing import Any, AsyncGenerator, Callable
-import urllib.request
-import zipfile
+import urllib.parse
+from typing import Any, AsyncGenerator, Awaitable, Callable
 
 import scrypted_sdk
-from scrypted_sdk import ScryptedDeviceBase, DeviceProvider, StreamService, Settings, Setting, ScryptedInterface, ScryptedDeviceType, Scriptable, ScriptSource, Readme, TTYSettings
+from scrypted_sdk import ScryptedDeviceBase, DeviceProvider, StreamService, Settings, Setting, ScryptedInterface, ScryptedDeviceType, Scriptable, ScriptSource, Readme, TTYSettings, Sensors, HttpRequestHandler, HttpRequest, HttpResponse
 
+import artifact_source
+import attribution
 import btop_config
+import collector
+import downloader
+import exporter
+import history
+import profiles
+import pty_process
+import recorder
+import snapshot
+import stream_stage
+import theme_index
+import tracing
+import zipstream
+from device_index import DeviceIndex
+from sessions import IDLE_TIMEOUT, BtopSession, SessionRegistry
+from shared_sessions import SharedSessionHub
+from startup import StartupGraph
+from terminal_service import TerminalServiceClient
 
 
 # patch SystemManager.getDeviceByName
 def getDeviceByName(self, name: str) -> scrypted_sdk.ScryptedDevice:
-    for check in self.systemState:
-        state = self.systemState.get(check, None)
-        if not state:
-            continue
-        checkInterfaces = state.get('interfaces', None)
-        if not checkInterfaces:
-            continue
-        interfaces = checkInterfaces.get('value', [])
-        if ScryptedInterface.ScryptedPlugin.value in interfaces:
-            checkPluginId = state.get('pluginId', None)
-            if not checkPluginId:
-                continue
-            pluginId = checkPluginId.get('value', None)
-            if not pluginId:
-                continue
-            if pluginId == name:
-                return self.getDeviceById(check)
-        checkName = state.get('name', None)
-        if not checkName:
-            continue
-        if checkName.get('value', None) == name:
-            return self.getDeviceById(check)
+    with tracing.span('device.lookup', name=name) as span:
+        id = device_index.lookup(name)
+        span.set(found=bool(id))
+    if not id:
+        return None
+    return self.getDeviceById(id)
+device_index = DeviceIndex(scrypted_sdk.systemManager.systemState)
+scrypted_sdk.systemManager.listen(device_index.on_event)
 scrypted_sdk.systemManager.getDeviceByName = types.MethodType(getDeviceByName, scrypted_sdk.systemManager)
 
 
-def extract_zip(tmp, fullpath):
-    print("Extracting", tmp, "to", fullpath)
-    with zipfile.ZipFile(tmp, 'r') as z:
-        z.extractall(fullpath)
+CLUSTER_TIMEOUT = 3
 
 
-def extract_tbz(tmp, fullpath):
-    print("Extracting", tmp, "to", fullpath)
-    with tarfile.open(tmp, 'r:bz2') as z:
-        z.extractall(fullpath)
+def ensure_storage(device: ScryptedDeviceBase) -> None:
+    # devices created before discovery completes have no storage yet, they
+    # wait on the discovered_devices stage and pick it up here
+    if device.storage is None:
+        device.storage = scrypted_sdk.deviceManager.getDeviceStorage(device.nativeId)
 
 
+def wanted(name: str, members: list[str] | None) -> bool:
+    if not members:
+        return True
+    name = name.rstrip('/')
+    return any(name == m.rstrip('/') or name.startswith(m.rstrip('/') + '/') for m in members)
+
+
+def extract_zip(source, fullpath, members=None):
+    # read front to back as it downloads, pulling out only the members the
+    # plugin uses. each member's CRC is checked, a corrupt archive raises
+    # and the staging directory is discarded
+    print("Extracting", source.url, "to", fullpath)
+    zipstream.extract(source, fullpath, lambda name: wanted(name, members))
+
+
+def extract_tbz(source, fullpath, members=None):
+    print("Extracting", source.url, "to", fullpath)
+    with tarfile.open(fileobj=source, mode='r|bz2') as z:
+        for member in z:
+            if wanted(member.name, members):
+                z.extract(member, fullpath)
+
+
+# each entry should pin the archive's "sha256", which is verified while
+# streaming. scripts/pin_downloads.py fills them in after a url changes.
 DOWNLOADS = {
     "windows": {
         "amd64": {
@@ -66,11 +94,13 @@ DOWNLOADS = {
         "x86_64": {
             "url": "https://github.com/bjia56/btop-builder/releases/download/v1.3.2-4/btop-linux-x86_64.zip",
             "exe": "btop/bin/btop",
+            "members": ["btop/bin/btop", "btop/share/btop/themes"],
             "extract": extract_zip,
         },
         "aarch64": {
             "url": "https://github.com/bjia56/btop-builder/releases/download/v1.3.2-4/btop-linux-aarch64.zip",
             "exe": "btop/bin/btop",
+            "members": ["btop/bin/btop", "btop/share/btop/themes"],
             "extract": extract_zip,
         },
     },
@@ -78,47 +108,74 @@ DOWNLOADS = {
         "x86_64": {
             "url": "https://github.com/bjia56/btop-builder/releases/download/v1.3.2-4/btop-darwin-universal.zip",
             "exe": "btop/bin/btop",
+            "members": ["btop/bin/btop", "btop/share/btop/themes"],
             "extract": extract_zip,
         },
         "arm64": {
             "url": "https://github.com/bjia56/btop-builder/releases/download/v1.3.2-4/btop-darwin-universal.zip",
             "exe": "btop/bin/btop",
+            "members": ["btop/bin/btop", "btop/share/btop/themes"],
             "extract": extract_zip,
         },
     },
 }
-DOWNLOAD_CACHE_BUST = "20240806-0"
 
 
-class BtopPlugin(ScryptedDeviceBase, StreamService, DeviceProvider, Settings, TTYSettings):
+async def download_artifact(url: str, filename: str, extract: Callable[[Any, str, list[str]], None] = None, members: list[str] = None, sha256: str = None, log: Callable[..., None] = print) -> str:
+    # workers take the server's copy when it has one
+    fullpath = await artifact_source.fetch(filename, url, sha256, log)
+    if fullpath:
+        return fullpath
+    return await downloader.download_file(url, filename, extract, members, log, sha256=sha256)
+
+
+async def download_btop(downloadFile: Callable[..., Awaitable[str]]) -> tuple[str, str]:
+    download = DOWNLOADS.get(platform.system().lower(), {}).get(platform.machine().lower())
+    if not download:
+        raise Exception(f"Unsupported platform {platform.system()} {platform.machine()}")
+
+    install = await downloadFile(download['url'], f'btop-{platform.system()}-{platform.machine()}', download['extract'], download.get('members'), download.get('sha256'))
+    exe = os.path.realpath(os.path.join(install, download['exe']))
+
+    if platform.system() != 'Windows':
+        try:
+            os.chmod(exe, 0o755)
+        except:
+            # maybe this is fine? allows the plugin to start up,
+            # but the user can't chmod the executable so it's probably owned by someone else
+            pass
+    return install, exe
+
+
+class BtopPlugin(ScryptedDeviceBase, StreamService, DeviceProvider, Settings, TTYSettings, HttpRequestHandler):
 
     def __init__(self, nativeId: str = None) -> None:
         super().__init__(nativeId)
         self.config = None
         self.thememanager = None
-        self.downloaded = asyncio.ensure_future(self.do_download())
-        self.discovered_devices = asyncio.ensure_future(self.do_device_discovery())
+        self.hostmetrics = None
+        self.tracing = None
+        self.apply_tracing()
+        self.terminal_service = TerminalServiceClient(self.print)
+        self.artifact_source = artifact_source.ArtifactSource()
+        self.workers: dict[str, asyncio.Future] = {}
+        self.snapshot = snapshot.SnapshotCache(self.render_snapshot, self.snapshot_ttl)
+        self.sessions = SessionRegistry(self.print)
+        self.sessions.frame_interval = self.frame_interval
+        self.sessions.max_sessions = self.max_sessions
+        self.sessions.idle_timeout = self.idle_timeout
+        self.sessions.recorder = recorder.Recorder(os.path.join(os.environ['SCRYPTED_PLUGIN_VOLUME'], 'recordings'), self.recordings_max_bytes, self.print)
+        self.sessions.record_all = self.record_sessions
+        self.reaper = asyncio.ensure_future(self.sessions.reap_idle())
+        self.shared_sessions = SharedSessionHub(self.sessions, self.spawn_btop, self.max_shared_sessions)
+        self.startup = StartupGraph()
+        self.downloaded = self.startup.add('downloaded', self.do_download)
+        self.discovered_devices = self.startup.add('discovered_devices', self.do_device_discovery, 'downloaded')
+        self.startup.add('terminal_service', self.terminal_service.prewarm)
 
     async def do_download(self) -> None:
         try:
-            download = DOWNLOADS.get(platform.system().lower(), {}).get(platform.machine().lower())
-            if not download:
-                raise Exception(f"Unsupported platform {platform.system()} {platform.machine()}")
-
-            if self.should_force_download():
-                shutil.rmtree(os.path.join(os.environ['SCRYPTED_PLUGIN_VOLUME'], 'files'), ignore_errors=True)
-
-            self.install = self.downloadFile(download['url'], f'btop-{platform.system()}-{platform.machine()}', download['extract'])
-            self.exe = os.path.realpath(os.path.join(self.install, download['exe']))
-
-            if platform.system() != 'Windows':
-                try:
-                    os.chmod(self.exe, 0o755)
-                except:
-                    # maybe this is fine? allows the plugin to start up,
-                    # but the user can't chmod the executable so it's probably owned by someone else
-                    pass
-
+            self.install, self.exe = await download_btop(self.downloadFile)
             print("btop executable:", self.exe)
 
             await self.restart_btop_camera()
@@ -129,7 +186,6 @@ class BtopPlugin(ScryptedDeviceBase, StreamService, DeviceProvider, Settings, TT
             await asyncio.sleep(3600)
 
     async def do_device_discovery(self) -> None:
-        await self.downloaded
         await scrypted_sdk.deviceManager.onDeviceDiscovered({
             "nativeId": "config",
             "name": "btop Configuration",
@@ -149,6 +205,36 @@ class BtopPlugin(ScryptedDeviceBase, StreamService, DeviceProvider, Settings, TT
             ],
         })
 
+        await scrypted_sdk.deviceManager.onDeviceDiscovered({
+            "nativeId": "tracing",
+            "name": "btop Tracing",
+            "type": ScryptedDeviceType.API.value,
+            "interfaces": [
+                ScryptedInterface.Readme.value,
+                ScryptedInterface.Settings.value,
+                ScryptedInterface.HttpRequestHandler.value,
+            ],
+        })
+
+        if platform.system() == 'Linux':
+            await scrypted_sdk.deviceManager.onDeviceDiscovered({
+                "nativeId": "hostmetrics",
+                "name": "Host Metrics",
+                "type": ScryptedDeviceType.Sensor.value,
+                "interfaces": [
+                    ScryptedInterface.Sensors.value,
+                    ScryptedInterface.Settings.value,
+                    ScryptedInterface.Readme.value,
+                    ScryptedInterface.HttpRequestHandler.value,
+                ],
+            })
+
+        # register the devices' startup stages now rather than on first use
+        await self.getDevice("config")
+        await self.getDevice("thememanager")
+        if platform.system() == 'Linux':
+            await self.getDevice("hostmetrics")
+
     async def get_btop_camera(self) -> Any:
         return scrypted_sdk.systemManager.getDeviceByName("@scrypted/btop-camera")
 
@@ -167,69 +253,289 @@ class BtopPlugin(ScryptedDeviceBase, StreamService, DeviceProvider, Settings, TT
             if not self.thememanager:
                 self.thememanager = BtopThemeManager(nativeId, self)
             return self.thememanager
+        if nativeId == "hostmetrics":
+            if not self.hostmetrics:
+                self.hostmetrics = BtopHostMetrics(nativeId, self)
+            return self.hostmetrics
+        if nativeId == "tracing":
+            if not self.tracing:
+                self.tracing = BtopTracing(nativeId, self)
+            return self.tracing
 
         # Management ui v2's PtyComponent expects the plugin device to implement
         # DeviceProvider and return the StreamService device via getDevice.
         return self
 
-    def should_force_download(self) -> bool:
+    async def downloadFile(self, url: str, filename: str, extract: Callable[[Any, str, list[str]], None] = None, members: list[str] = None, sha256: str = None) -> str:
+        return await download_artifact(url, filename, extract, members, sha256)
+
+    async def fork_worker(self, clusterWorkerId: str = None) -> tuple[Any, Any]:
+        # nothing is installed yet, a fork that only answers metrics never
+        # needs btop
+        forked = scrypted_sdk.fork({ "clusterWorkerId": clusterWorkerId } if clusterWorkerId else None)
+        worker = await forked.result
+        return forked, worker
+
+    async def prepare_worker(self, worker: Any) -> None:
+        # the worker gets btop and the themes from this process's store
+        # rather than each worker downloading them from github
+        await self.downloaded
+        thememanager = await self.getDevice("thememanager")
+        await thememanager.themes_loaded
+        await worker.prepare(self.artifact_source, thememanager.theme_urls)
+
+    def worker(self, clusterWorkerId: str) -> asyncio.Future:
+        # one fork per cluster worker, shared by every session on it
+        worker = self.workers.get(clusterWorkerId, None)
+        if not worker or (worker.done() and (worker.cancelled() or worker.exception())):
+            worker = self.workers[clusterWorkerId] = asyncio.ensure_future(self.fork_worker(clusterWorkerId))
+        return worker
+
+    async def cluster_workers(self) -> tuple[dict[str, Any], str | None]:
+        # all cluster workers and the id of the one this plugin runs on,
+        # empty when scrypted isn't running as a cluster
+        try:
+            clusterManager = scrypted_sdk.clusterManager
+            if not clusterManager or clusterManager.getClusterMode() is None:
+                return {}, None
+            return await clusterManager.getClusterWorkers(), clusterManager.getClusterWorkerId()
+        except:
+            return {}, None
+
+    async def resolve_worker(self, target: str) -> str | None:
+        # accepts a cluster worker id or name, None means this node
+        workers, local = await self.cluster_workers()
+        for id, worker in workers.items():
+            if target in (id, worker.get('name', None)):
+                return None if id == local else id
+        raise Exception(f"Unknown cluster worker {target}")
+
+    async def spawn_on_worker(self, input: AsyncGenerator[Any, Any], session: BtopSession = None, profile: profiles.Profile = None, clusterWorkerId: str = None) -> Any:
+        config = await self.getDevice("config")
+        options = {
+            "profile": profile.name,
+            "flags": profile.flags,
+            "config": profile.config,
+            "btop_config": config.config,
+            "marker": session.marker if session else None,
+        }
+        _, worker = await asyncio.shield(self.worker(clusterWorkerId))
         try:
-            filesPath = os.path.join(os.environ['SCRYPTED_PLUGIN_VOLUME'], 'files')
-            cachebustPath = os.path.join(filesPath, f'cachebust-{platform.system()}-{platform.machine()}')
-            if not os.path.exists(cachebustPath):
-                return True
-            with open(cachebustPath) as f:
-                return f.read() != DOWNLOAD_CACHE_BUST
+            await self.prepare_worker(worker)
+            return await worker.connectStream(input, options)
         except:
-            return True
+            # the fork may have gone away, start a new one next time
+            self.workers.pop(clusterWorkerId, None)
+            raise
+
+    async def cluster_metrics(self) -> dict[str, Any]:
+        workers, local = await self.cluster_workers()
+        hostmetrics = self.hostmetrics
+
+        async def metrics(id: str) -> dict:
+            if id == local:
+                return dict(hostmetrics.metrics) if hostmetrics else {}
+            _, worker = await asyncio.shield(self.worker(id))
+            return await worker.metrics()
 
-    def downloadFile(self, url: str, filename: str, extract: Callable[[str, str], None] = None) -> str:
+        ids = list(workers)
+        results = await asyncio.gather(*[asyncio.wait_for(metrics(id), CLUSTER_TIMEOUT) for id in ids], return_exceptions=True)
+        return {workers[id].get('name', None) or id: result for id, result in zip(ids, results)}
+
+    def apply_tracing(self) -> None:
+        if not self.storage:
+            return
         try:
-            filesPath = os.path.join(os.environ['SCRYPTED_PLUGIN_VOLUME'], 'files')
-            fullpath = os.path.join(filesPath, filename)
-            if os.path.exists(fullpath):
-                return fullpath
-            tmp = fullpath + '.tmp'
-            print("Creating directory for", tmp)
-            os.makedirs(os.path.dirname(fullpath), exist_ok=True)
-            print("Downloading", url)
-            response = urllib.request.urlopen(url)
-            if response.getcode() < 200 or response.getcode() >= 300:
-                raise Exception(f"Error downloading")
-            read = 0
-            with open(tmp, "wb") as f:
-                while True:
-                    data = response.read(1024 * 1024)
-                    if not data:
-                        break
-                    read += len(data)
-                    print("Downloaded", read, "bytes")
-                    f.write(data)
-            if extract:
-                extract(tmp, fullpath)
-            else:
-                os.rename(tmp, fullpath)
-            cachebustPath = os.path.join(filesPath, f'cachebust-{platform.system()}-{platform.machine()}')
-            with open(cachebustPath, 'w') as f:
-                f.write(DOWNLOAD_CACHE_BUST)
-            return fullpath
+            capacity = int(self.storage.getItem('tracing_capacity'))
+        except:
+            capacity = tracing.CAPACITY
+        tracing.enable(self.storage.getItem('tracing') == 'true', capacity)
+
+    async def reload(self, started: float) -> None:
+        # btop only reads its config and theme list at launch, so relaunch
+        # the running sessions in place rather than restarting the plugin
+        count = self.sessions.restart_all(started)
+        self.print(f"Restarting {count} btop session(s)")
+        await self.restart_btop_camera()
+
+    async def spawn_btop(self, input: AsyncGenerator[Any, Any], session: BtopSession = None, profile: profiles.Profile = None) -> Any:
+        return await self.terminal_service.connectStream(input, {
+            'cmd': await self.btop_command(session, profile)
+        })
+
+    async def btop_command(self, session: BtopSession = None, profile: profiles.Profile = None) -> list[str]:
+        profile = profile or profiles.resolve(None)
+        if platform.system() == 'Windows':
+            return [self.exe, *profile.flags]
+
+        cmd = [self.exe, '--utf-force', *profile.flags]
+        env = [session.marker] if session else []
+        if profile.config:
+            # profile settings go in a generated config of their own so the
+            # shared btop.conf is left untouched
+            config = await self.getDevice("config")
+            thememanager = await self.getDevice("thememanager")
+            themes_dir = await thememanager.themes_dir
+            root = os.path.join(os.environ['SCRYPTED_PLUGIN_VOLUME'], 'profiles')
+            loop = asyncio.get_running_loop()
+            config_home = await loop.run_in_executor(None, profiles.write_profile_config, root, profile, config.config, themes_dir)
+            env.append(f'XDG_CONFIG_HOME={config_home}')
+        if env:
+            cmd = ['env', *env, *cmd]
+        return cmd
+
+    async def render_snapshot(self) -> Any:
+        # btop runs headless on a pty of our own, the terminal service
+        # isn't needed when nobody is typing
+        await self.downloaded
+        if platform.system() == 'Windows':
+            raise Exception("Snapshots need a posix pty and are not available on Windows")
+        cmd = await self.btop_command(profile=profiles.resolve({ "update_ms": snapshot.SNAPSHOT_UPDATE_MS }))
+        return await snapshot.capture(lambda input: pty_process.connect(cmd, input))
+
+    async def onRequest(self, request: HttpRequest, response: HttpResponse) -> None:
+        url = urllib.parse.urlparse(request.get('url', ''))
+        if '/recordings' in url.path:
+            await self.serve_recording(url, response)
+            return
+        try:
+            screen = await self.snapshot.get()
+            if url.path.endswith('.txt'):
+                await response.send(screen.render_text(), {
+                    "code": 200,
+                    "headers": {
+                        "Content-Type": "text/plain; charset=utf-8",
+                    },
+                })
+                return
+            await response.send(f"<!DOCTYPE html><html><head><meta charset=\"utf-8\"><title>btop</title></head><body style=\"background:#000\">{screen.render_html()}</body></html>", {
+                "code": 200,
+                "headers": {
+                    "Content-Type": "text/html; charset=utf-8",
+                },
+            })
         except:
-            print("Error downloading", url)
             import traceback
             traceback.print_exc()
-            raise
+            await response.send("Failed to render btop snapshot", {
+                "code": 500,
+            })
 
-    async def connectStream(self, input: AsyncGenerator[Any, Any] = None, options: Any = None) -> Any:
-        core = scrypted_sdk.systemManager.getDeviceByName("@scrypted/core")
-        termsvc = await core.getDevice("terminalservice")
-        termsvc_direct = await scrypted_sdk.sdk.connectRPCObject(termsvc)
-        if platform.system() == 'Windows':
-            return await termsvc_direct.connectStream(input, {
-                'cmd': [self.exe]
+    async def serve_recording(self, url: urllib.parse.ParseResult, response: HttpResponse) -> None:
+        # /recordings lists recordings, /recordings/<name>.cast?start=<seconds>
+        # plays one back from the closest minute at or before start
+        root = self.sessions.recorder.root
+        name = url.path.split('/recordings', 1)[1].strip('/')
+        try:
+            if not name:
+                await response.send(json.dumps(self.sessions.recorder.list()), {
+                    "code": 200,
+                    "headers": {
+                        "Content-Type": "application/json",
+                    },
+                })
+                return
+            name = name.removesuffix('.cast')
+            if not os.path.exists(os.path.join(root, recorder.safe_name(name) + '.cast.gz')):
+                await response.send("Recording not found", {
+                    "code": 404,
+                })
+                return
+            start = float(urllib.parse.parse_qs(url.query).get('start', ['0'])[0])
+            loop = asyncio.get_running_loop()
+            cast = await loop.run_in_executor(None, recorder.read_recording, root, name, start)
+            await response.send(cast, {
+                "code": 200,
+                "headers": {
+                    "Content-Type": "application/x-asciicast",
+                },
             })
-        return await termsvc_direct.connectStream(input, {
-            'cmd': [self.exe, '--utf-force']
-        })
+        except:
+            import traceback
+            traceback.print_exc()
+            await response.send("Failed to read recording", {
+                "code": 500,
+            })
+
+    async def recordings_path(self) -> str | None:
+        try:
+            path = await scrypted_sdk.endpointManager.getAuthenticatedPath(self.nativeId)
+            return path.rstrip('/') + '/recordings'
+        except:
+            return None
+
+    async def snapshot_path(self) -> str | None:
+        try:
+            path = await scrypted_sdk.endpointManager.getAuthenticatedPath(self.nativeId)
+            return path.rstrip('/') + '/snapshot'
+        except:
+            return None
+
+    async def connectStream(self, input: AsyncGenerator[Any, Any] = None, options: Any = None) -> Any:
+        profile = profiles.resolve(options)
+        # clients that can inflate raw deflate frames may ask for them
+        compress = (options or {}).get('compress', None) == 'deflate'
+        # callers may pick the cluster worker btop runs on, by id or name
+        target = (options or {}).get('cluster_worker', None)
+        # record this session even when recording isn't on for all of them
+        record = True if (options or {}).get('record', None) else None
+        clusterWorkerId = await self.resolve_worker(target) if target else None
+        if clusterWorkerId:
+            spawn = functools.partial(self.spawn_on_worker, profile=profile, clusterWorkerId=clusterWorkerId)
+            return self.sessions.open(spawn, input, f"{profile.name}@{target}", compress, record)
+        if self.shared_sessions_enabled:
+            return self.shared_sessions.open(input, profile, compress)
+        return self.sessions.open(functools.partial(self.spawn_btop, profile=profile), input, profile.name, compress, record)
+
+    @property
+    def shared_sessions_enabled(self) -> bool:
+        return self.storage.getItem('shared_sessions') == 'true' if self.storage else False
+
+    @property
+    def frame_interval(self) -> float:
+        try:
+            return max(int(self.storage.getItem('frame_interval_ms')), 0) / 1000
+        except:
+            return stream_stage.FRAME_INTERVAL
+
+    @property
+    def snapshot_ttl(self) -> float:
+        try:
+            return max(float(self.storage.getItem('snapshot_ttl')), 0)
+        except:
+            return snapshot.SNAPSHOT_TTL
+
+    @property
+    def max_sessions(self) -> int:
+        try:
+            return max(int(self.storage.getItem('max_sessions')), 0)
+        except:
+            return 0
+
+    @property
+    def idle_timeout(self) -> float:
+        try:
+            return max(float(self.storage.getItem('idle_timeout_minutes')), 0) * 60
+        except:
+            return IDLE_TIMEOUT
+
+    @property
+    def record_sessions(self) -> bool:
+        return self.storage.getItem('record_sessions') == 'true' if self.storage else False
+
+    @property
+    def recordings_max_bytes(self) -> int:
+        try:
+            return max(int(self.storage.getItem('recordings_max_mb')), 1) * 1024 * 1024
+        except:
+            return recorder.RECORDINGS_MAX_BYTES
+
+    @property
+    def max_shared_sessions(self) -> int:
+        try:
+            return max(int(self.storage.getItem('max_shared_sessions')), 1)
+        except:
+            return 4
 
     async def getSettings(self) -> list[Setting]:
         await self.downloaded
@@ -237,6 +543,8 @@ class BtopPlugin(ScryptedDeviceBase, StreamService, DeviceProvider, Settings, TT
         config = await self.getDevice("config")
         await config.config_reconciled
 
+        live_sessions = await self.sessions.describe()
+
         return [
             {
                 "key": "btop_executable",
@@ -244,7 +552,145 @@ class BtopPlugin(ScryptedDeviceBase, StreamService, DeviceProvider, Settings, TT
                 "description": "Path to the downloaded btop executable.",
                 "value": self.exe,
                 "readonly": True,
-            }
+            },
+            {
+                "group": "Sessions",
+                "key": "shared_sessions",
+                "title": "Shared Sessions",
+                "description": "Viewers with the same terminal size share one view-only btop process instead of each starting their own.",
+                "type": "boolean",
+                "value": self.shared_sessions_enabled,
+            },
+            {
+                "group": "Sessions",
+                "key": "max_sessions",
+                "title": "Maximum Sessions",
+                "description": "Maximum number of btop processes running at once, 0 for no limit. Once reached, the least recently used session is closed to make room.",
+                "type": "number",
+                "value": self.max_sessions,
+            },
+            {
+                "group": "Sessions",
+                "key": "idle_timeout_minutes",
+                "title": "Idle Timeout",
+                "description": "Minutes without input after which a session whose client is hidden or no longer reading is closed. 0 keeps idle sessions running.",
+                "type": "number",
+                "value": round(self.idle_timeout / 60),
+            },
+            {
+                "group": "Sessions",
+                "key": "max_shared_sessions",
+                "title": "Maximum Shared Sessions",
+                "description": "Maximum number of distinct shared btop processes. Once reached, new viewers join the session closest to their terminal size.",
+                "type": "number",
+                "value": self.max_shared_sessions,
+            },
+            {
+                "group": "Sessions",
+                "key": "frame_interval_ms",
+                "title": "Frame Interval",
+                "description": "Milliseconds of btop output gathered into one message to the client. 0 sends each write as it arrives.",
+                "type": "number",
+                "value": round(self.frame_interval * 1000),
+            },
+            {
+                "group": "Sessions",
+                "key": "stream_frames",
+                "title": "Output Coalescing",
+                "value": self.sessions.stream.summary(),
+                "readonly": True,
+            },
+            {
+                "group": "Sessions",
+                "key": "first_byte_latency",
+                "title": "Connect to First Byte",
+                "description": "Time from opening a btop session to its first output.",
+                "value": self.sessions.first_byte.summary(),
+                "readonly": True,
+            },
+            {
+                "group": "Sessions",
+                "key": "live_sessions",
+                "title": "Live Sessions",
+                "value": f"{len(live_sessions)} running, {self.sessions.reaped} closed while idle, {self.sessions.evicted} closed to make room",
+                "readonly": True,
+            },
+            *[
+                {
+                    "group": "Sessions",
+                    "key": f"session_{id}",
+                    "title": f"Session {id}",
+                    "value": description,
+                    "readonly": True,
+                }
+                for id, description in live_sessions.items()
+            ],
+            *[
+                {
+                    "group": "Sessions",
+                    "key": f"output_rate_{label}",
+                    "title": f"Stream Output ({label})",
+                    "description": "Average btop output per session for this profile.",
+                    "value": rate,
+                    "readonly": True,
+                }
+                for label, rate in self.sessions.output_rates().items()
+            ],
+            {
+                "group": "Snapshot",
+                "key": "snapshot_path",
+                "title": "Snapshot Page",
+                "description": "A rendered btop screen for a quick look without opening a terminal. Add .txt for plain text.",
+                "value": await self.snapshot_path(),
+                "readonly": True,
+            },
+            {
+                "group": "Snapshot",
+                "key": "snapshot_ttl",
+                "title": "Snapshot TTL",
+                "description": "Seconds a rendered snapshot is reused before btop is run again.",
+                "type": "number",
+                "value": self.snapshot_ttl,
+            },
+            {
+                "group": "Snapshot",
+                "key": "snapshot_renders",
+                "title": "Snapshot Renders",
+                "value": self.snapshot.summary(),
+                "readonly": True,
+            },
+            {
+                "group": "Recordings",
+                "key": "record_sessions",
+                "title": "Record Sessions",
+                "description": "Record the output of every btop session as compressed asciicast. Single sessions can also ask for it with the record option.",
+                "type": "boolean",
+                "value": self.record_sessions,
+            },
+            {
+                "group": "Recordings",
+                "key": "recordings_max_mb",
+                "title": "Recordings Size Limit (MiB)",
+                "description": "The oldest recordings are deleted once recordings take more space than this.",
+                "type": "number",
+                "value": self.recordings_max_bytes // 1024 // 1024,
+            },
+            {
+                "group": "Recordings",
+                "key": "recordings_path",
+                "title": "Recordings",
+                "description": "Lists recordings, add /<name>.cast?start=<seconds> to play one back from that point.",
+                "value": await self.recordings_path(),
+                "readonly": True,
+            },
+            {
+                "group": "Recordings",
+                "key": "recordings_usage",
+                "title": "Recordings Usage",
+                "value": self.sessions.recorder.summary(),
+                "readonly": True,
+            },
+            *self.startup.settings(),
         ]
 
     async def putSetting(self, key: str, value: str) -> None:
@@ -259,6 +705,37 @@ class BtopPlugin(ScryptedDeviceBase, StreamService, DeviceProvider, Settings, TT
                 thememanager = await self.getDevice("thememanager")
                 await thememanager.putSetting("theme_urls", value)
                 self.storage.setItem('btop_theme_urls_migrated', '1')
+        elif key == "shared_sessions":
+            self.storage.setItem(key, 'true' if value in (True, 'true') else 'false')
+            await self.onDeviceEvent(ScryptedInterface.Settings.value, None)
+        elif key == "frame_interval_ms":
+            self.storage.setItem(key, str(value))
+            self.sessions.frame_interval = self.frame_interval
+            await self.onDeviceEvent(ScryptedInterface.Settings.value, None)
+        elif key == "max_sessions":
+            self.storage.setItem(key, str(value))
+            self.sessions.max_sessions = self.max_sessions
+            await self.onDeviceEvent(ScryptedInterface.Settings.value, None)
+        elif key == "idle_timeout_minutes":
+            self.storage.setItem(key, str(value))
+            self.sessions.idle_timeout = self.idle_timeout
+            await self.onDeviceEvent(ScryptedInterface.Settings.value, None)
+        elif key == "snapshot_ttl":
+            self.storage.setItem(key, str(value))
+            self.snapshot.ttl = self.snapshot_ttl
+            await self.onDeviceEvent(ScryptedInterface.Settings.value, None)
+        elif key == "record_sessions":
+            self.storage.setItem(key, 'true' if value in (True, 'true') else 'false')
+            self.sessions.record_all = self.record_sessions
+            await self.onDeviceEvent(ScryptedInterface.Settings.value, None)
+        elif key == "recordings_max_mb":
+            self.storage.setItem(key, str(value))
+            self.sessions.recorder.max_bytes = self.recordings_max_bytes
+            await self.onDeviceEvent(ScryptedInterface.Settings.value, None)
+        elif key == "max_shared_sessions":
+            self.storage.setItem(key, str(value))
+            self.shared_sessions.max_sessions = self.max_shared_sessions
+            await self.onDeviceEvent(ScryptedInterface.Settings.value, None)
 
     async def getTTYSettings(self) -> Any:
         await self.downloaded
@@ -275,12 +752,13 @@ class BtopConfig(ScryptedDeviceBase, Scriptable, Readme):
     def __init__(self, nativeId: str, parent: BtopPlugin) -> None:
         super().__init__(nativeId)
         self.parent = parent
-        self.config_path = asyncio.ensure_future(self.find_config())
-        self.config_reconciled = asyncio.ensure_future(self.reconcile_from_disk())
         self.themes = []
+        self.theme_index: theme_index.ThemeIndex = None
+        self.config_path = parent.startup.add('config_path', self.find_config, 'downloaded')
+        self.config_written = parent.startup.add('config_written', self.write_config, 'config_path', 'discovered_devices')
+        self.config_reconciled = parent.startup.add('config_reconciled', self.reconcile_from_disk, 'config_written', 'themes_loaded')
 
     async def find_config(self) -> str:
-        await self.parent.downloaded
         btop = self.parent.exe
         assert btop is not None
 
@@ -290,70 +768,58 @@ class BtopConfig(ScryptedDeviceBase, Scriptable, Readme):
         else:
             return BtopConfig.CONFIG
 
-    async def reconcile_from_disk(self) -> None:
-        await self.parent.downloaded
-
-        thememanager = await self.parent.getDevice('thememanager')
-        await thememanager.themes_loaded
-
+    async def write_config(self) -> None:
         try:
-            btop = self.parent.exe
-            assert btop is not None
-
             config = await self.config_path
+            loop = asyncio.get_running_loop()
 
-            if not os.path.exists(config):
-                os.makedirs(os.path.dirname(config), exist_ok=True)
-                with open(config, 'w') as f:
-                    f.write(BtopConfig.DEFAULT_CONFIG)
+            with tracing.span('config.read'):
+                data = await loop.run_in_executor(None, btop_config.read_config, config)
+            if data is None:
+                data = BtopConfig.DEFAULT_CONFIG
+                await loop.run_in_executor(None, btop_config.write_config, config, data)
             self.print(f"Using config file: {config}")
 
-            with open(config) as f:
-                data = f.read()
+            ensure_storage(self)
 
-            while self.storage is None:
-                await asyncio.sleep(1)
-
-            if self.storage.getItem('config') and data != self.config:
-                with open(config, 'w') as f:
-                    f.write(self.config)
-
-            if not self.storage.getItem('config'):
+            if self.storage.getItem('config'):
+                await loop.run_in_executor(None, btop_config.write_config, config, self.config)
+            else:
                 self.storage.setItem('config', data)
+        except:
+            import traceback
+            traceback.print_exc()
+
+    async def reconcile_from_disk(self) -> None:
+        try:
+            btop = self.parent.exe
+            assert btop is not None
 
             bin_dir = os.path.dirname(btop)
             if platform.system() == 'Windows':
-                theme_dir = os.path.realpath(os.path.join(bin_dir, 'themes'))
-                self.print(f"Using themes dir: {theme_dir}")
-                if os.path.exists(theme_dir):
-                    self.themes = [
-                        theme.removesuffix('.theme')
-                        for theme in os.listdir(theme_dir)
-                        if theme.endswith('.theme')
-                    ]
+                dirs = [os.path.realpath(os.path.join(bin_dir, 'themes'))]
             else:
-                config_dir = os.path.realpath(os.path.join(os.path.dirname(bin_dir), 'share', 'btop', 'themes'))
-                self.print(f"Using themes dir: {config_dir}, {BtopConfig.HOME_THEMES_DIR}")
-                if os.path.exists(config_dir):
-                    self.themes = [
-                        theme.removesuffix('.theme')
-                        for theme in os.listdir(config_dir)
-                        if theme.endswith('.theme')
-                    ]
-                if os.path.exists(BtopConfig.HOME_THEMES_DIR):
-                    self.themes.extend([
-                        theme.removesuffix('.theme')
-                        for theme in os.listdir(BtopConfig.HOME_THEMES_DIR)
-                        if theme.endswith('.theme')
-                    ])
-            self.themes.sort()
-
-            await self.onDeviceEvent(ScryptedInterface.Readme.value, None)
-            await self.onDeviceEvent(ScryptedInterface.Scriptable.value, None)
+                dirs = [os.path.realpath(os.path.join(os.path.dirname(bin_dir), 'share', 'btop', 'themes')), BtopConfig.HOME_THEMES_DIR]
+            self.print(f"Using themes dir: {', '.join(dirs)}")
+            with tracing.span('config.reconcile') as span:
+                self.theme_index = theme_index.ThemeIndex(dirs, self.themes_changed, self.print)
+                await self.theme_index.refresh(force=True)
+                self.theme_index.start()
+                span.set(themes=len(self.themes), files_read=self.theme_index.loads)
         except:
             import traceback
             traceback.print_exc()
 
+    async def themes_changed(self, themes: list[str]) -> None:
+        self.themes = themes
+        await self.onDeviceEvent(ScryptedInterface.Readme.value, None)
+        await self.onDeviceEvent(ScryptedInterface.Scriptable.value, None)
+
+    async def refresh_themes(self) -> bool:
+        if not self.theme_index:
+            return False
+        return await self.theme_index.refresh()
+
     @property
     def config(self) -> str:
         if self.storage:
@@ -377,24 +843,32 @@ class BtopConfig(ScryptedDeviceBase, Scriptable, Readme):
     async def saveScript(self, script: ScriptSource) -> None:
         await self.config_reconciled
         config = await self.config_path
+        started = time.monotonic()
+
+        with tracing.span('config.parse'):
+            values = btop_config.parse(script['script'])
+            errors, unknown = btop_config.validate(values)
+        if errors:
+            raise Exception(f"Invalid btop configuration: {'; '.join(errors)}")
+        if unknown:
+            self.print("Keys not documented for this btop version:", ', '.join(unknown))
+        theme = values.get('color_theme', None)
+        if isinstance(theme, str) and theme not in ('Default', 'TTY') and not os.path.isabs(theme) and theme.removesuffix('.theme') not in self.themes:
+            self.print(f"color_theme {theme} is not one of the installed themes")
+        changes = btop_config.diff(btop_config.parse(self.config), values)
+        tracing.count('config.saves')
+        tracing.count('config.changes', len(changes))
 
         self.storage.setItem('config', script['script'])
         await self.onDeviceEvent(ScryptedInterface.Scriptable.value, None)
 
-        updated = False
-        with open(config) as f:
-            if f.read() != script['script']:
-                updated = True
-
-        if updated:
-            if not script['script']:
-                os.remove(config)
-            else:
-                with open(config, 'w') as f:
-                    f.write(script['script'])
-
-            self.print("Configuration updated, will restart...")
-            await scrypted_sdk.deviceManager.requestRestart()
+        # the file is kept identical to what was saved, but only changed
+        # values are worth restarting btop for
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, btop_config.write_config, config, script['script'])
+        if changes:
+            self.print(f"Configuration updated ({btop_config.describe_changes(changes)}), reloading btop sessions...")
+            await self.parent.reload(started)
 
     async def getReadmeMarkdown(self) -> str:
         await self.config_reconciled
@@ -411,48 +885,24 @@ class DownloaderBase(ScryptedDeviceBase):
     def __init__(self, nativeId: str | None = None):
         super().__init__(nativeId)
 
-    def downloadFile(self, url: str, filename: str):
-        try:
-            filesPath = os.path.join(os.environ['SCRYPTED_PLUGIN_VOLUME'], 'files')
-            fullpath = os.path.join(filesPath, filename)
-            if os.path.isfile(fullpath):
-                return fullpath
-            tmp = fullpath + '.tmp'
-            self.print("Creating directory for", tmp)
-            os.makedirs(os.path.dirname(fullpath), exist_ok=True)
-            self.print("Downloading", url)
-            response = urllib.request.urlopen(url)
-            if response.getcode() is not None and response.getcode() < 200 or response.getcode() >= 300:
-                raise Exception(f"Error downloading")
-            read = 0
-            with open(tmp, "wb") as f:
-                while True:
-                    data = response.read(1024 * 1024)
-                    if not data:
-                        break
-                    read += len(data)
-                    self.print("Downloaded", read, "bytes")
-                    f.write(data)
-            os.rename(tmp, fullpath)
+    async def downloadFile(self, url: str, filename: str) -> str:
+        fullpath = await artifact_source.fetch(filename, url, log=self.print)
+        if fullpath:
             return fullpath
-        except:
-            self.print("Error downloading", url)
-            import traceback
-            traceback.print_exc()
-            raise
+        return await downloader.revalidate_file(url, filename, log=self.print)
 
 
 class BtopThemeManager(DownloaderBase, Settings, Readme):
     LOCAL_THEME_DIR = os.path.expanduser(f'~/.config/btop/themes')
+    DOWNLOAD_CONCURRENCY = 4
 
     def __init__(self, nativeId: str, parent: BtopPlugin) -> None:
         super().__init__(nativeId)
         self.parent = parent
-        self.themes_dir = asyncio.ensure_future(self.find_themes_dir())
-        self.themes_loaded = asyncio.ensure_future(self.load_themes())
+        self.themes_dir = parent.startup.add('themes_dir', self.find_themes_dir, 'downloaded')
+        self.themes_loaded = parent.startup.add('themes_loaded', self.load_themes, 'themes_dir', 'discovered_devices')
 
     async def find_themes_dir(self) -> str:
-        await self.parent.downloaded
         btop = self.parent.exe
         assert btop is not None
 
@@ -462,21 +912,33 @@ class BtopThemeManager(DownloaderBase, Settings, Readme):
         else:
             return BtopThemeManager.LOCAL_THEME_DIR
 
-    async def load_themes(self) -> None:
+    async def load_themes(self) -> int:
+        ensure_storage(self)
         themes_dir = await self.themes_dir
         self.print("Using themes dir:", themes_dir)
         os.makedirs(themes_dir, exist_ok=True)
-        try:
-            urls = self.theme_urls
-            for url in urls:
-                filename = url.split('/')[-1]
-                fullpath = self.downloadFile(url, filename)
-                target = os.path.join(themes_dir, filename)
-                shutil.copyfile(fullpath, target)
-                self.print("Installed", target)
-        except:
-            import traceback
-            traceback.print_exc()
+        semaphore = asyncio.Semaphore(BtopThemeManager.DOWNLOAD_CONCURRENCY)
+
+        async def install(url: str) -> bool:
+            async with semaphore:
+                try:
+                    filename = url.split('/')[-1]
+                    with tracing.span('theme.install', theme=filename) as span:
+                        fullpath = await self.downloadFile(url, filename)
+                        target = os.path.join(themes_dir, filename)
+                        method = await downloader.install_file(fullpath, target)
+                        span.set(method=method)
+                    if method == 'unchanged':
+                        return False
+                    self.print("Installed", target, f"({method})")
+                    return True
+                except:
+                    import traceback
+                    traceback.print_exc()
+                    return False
+
+        installed = await asyncio.gather(*[install(url) for url in self.theme_urls])
+        return sum(installed)
 
     @property
     def theme_urls(self) -> list[str]:
@@ -488,6 +950,7 @@ class BtopThemeManager(DownloaderBase, Settings, Readme):
 
     async def getSettings(self) -> list[Setting]:
         theme_dir = await self.themes_dir
+        config = await self.parent.getDevice("config")
         return [
             {
                 "key": "theme_urls",
@@ -496,14 +959,26 @@ class BtopThemeManager(DownloaderBase, Settings, Readme):
                 "value": self.theme_urls,
                 "multiple": True,
             },
+            {
+                "key": "theme_index",
+                "title": "Theme Index",
+                "description": "Themes found across the theme directories and how they are kept up to date.",
+                "value": config.theme_index.summary() if config.theme_index else "not loaded yet",
+                "readonly": True,
+            },
         ]
 
     async def putSetting(self, key: str, value: str, forward=True) -> None:
         self.storage.setItem(key, json.dumps(value))
         await self.onDeviceEvent(ScryptedInterface.Settings.value, None)
+        started = time.monotonic()
 
-        self.print("Themes updated, will restart...")
-        await scrypted_sdk.deviceManager.requestRestart()
+        installed = await self.load_themes()
+        config = await self.parent.getDevice("config")
+        changed = await config.refresh_themes()
+        if installed or changed:
+            self.print("Themes updated, reloading btop sessions...")
+            await self.parent.reload(started)
 
     async def getReadmeMarkdown(self) -> str:
         themes_dir = await self.themes_dir
@@ -514,5 +989,400 @@ List themes to download and install in the local theme directory. Themes will be
 """
 
 
+class BtopHostMetrics(ScryptedDeviceBase, Sensors, Settings, Readme, HttpRequestHandler):
+    # name, unit and display scale of each collected metric
+    SENSORS = {
+        "cpu": ("CPU Usage", "%", 1),
+        "load": ("Load Average", None, 1),
+        "memory": ("Memory Usage", "%", 1),
+        "memory_used": ("Memory Used", "MiB", 1024 * 1024),
+        "swap": ("Swap Usage", "%", 1),
+        "network_rx": ("Network Received", "KiB/s", 1024),
+        "network_tx": ("Network Sent", "KiB/s", 1024),
+        "disk": ("Disk Usage", "%", 1),
+        "disk_read": ("Disk Read", "KiB/s", 1024),
+        "disk_write": ("Disk Written", "KiB/s", 1024),
+        "temperature": ("Temperature", "°C", 1),
+    }
+
+    def __init__(self, nativeId: str, parent: BtopPlugin) -> None:
+        super().__init__(nativeId)
+        self.parent = parent
+        self.collector = collector.Collector(os.environ.get('SCRYPTED_PLUGIN_VOLUME', '/'))
+        self.metrics = {}
+        self.history = None
+        self.attribution = attribution.Attribution()
+        self.task = None
+        self.snapshot = exporter.Snapshot(self.render_metrics, self.snapshot_ttl)
+        self.collecting = parent.startup.add('host_metrics', self.start_collecting, 'discovered_devices')
+
+    async def start_collecting(self) -> None:
+        ensure_storage(self)
+        self.snapshot.ttl = self.snapshot_ttl
+        if not self.collector.available():
+            self.print("/proc is not readable, host metrics are unavailable")
+            return
+        try:
+            path = os.path.join(os.environ['SCRYPTED_PLUGIN_VOLUME'], 'history', 'host.bin')
+            loop = asyncio.get_running_loop()
+            self.history = await loop.run_in_executor(None, history.History, path, list(BtopHostMetrics.SENSORS))
+        except:
+            import traceback
+            traceback.print_exc()
+        self.task = asyncio.ensure_future(self.collect())
+
+    async def collect(self) -> None:
+        while True:
+            try:
+                self.sample()
+                self.sensors = {
+                    key: {
+                        "name": name,
+                        "value": round(self.metrics[key] / scale, 1),
+                        **({"unit": unit} if unit else {}),
+                    }
+                    for key, (name, unit, scale) in BtopHostMetrics.SENSORS.items()
+                    if self.metrics.get(key) is not None
+                }
+            except:
+                import traceback
+                traceback.print_exc()
+            await asyncio.sleep(self.sample_interval)
+
+    def sample(self) -> None:
+        # a sample is a handful of small reads from already open /proc
+        # files, cheap enough to do on the event loop
+        self.metrics = self.collector.sample()
+        if self.history:
+            self.history.record(time.time(), self.metrics)
+
+    def render_metrics(self) -> bytes:
+        last = self.collector.last_sample
+        if last is None or time.monotonic() - last >= self.snapshot.ttl:
+            self.sample()
+        metrics = self.metrics
+        counters = self.collector.counters()
+        parent = self.parent
+        prefix = 'scrypted_btop'
+
+        def host(key: str, scale: float = 1) -> float | None:
+            value = metrics.get(key, None)
+            return value * scale if value is not None else None
+
+        cpu = exporter.counter(f'{prefix}_host_cpu_seconds', "Host cpu time across all cores.")
+        cpu.add(counters.get('cpu_busy_seconds'), '_total', mode='busy')
+        cpu.add(counters.get('cpu_idle_seconds'), '_total', mode='idle')
+        startup = exporter.Family(f'{prefix}_startup_stage_seconds', 'gauge', "Time each plugin startup stage took to run.")
+        for name, timing in parent.startup.timings.items():
+            startup.add(timing['ran'], stage=name)
+        stream = parent.sessions.stream
+
+        return exporter.render([
+            cpu,
+            exporter.gauge(f'{prefix}_host_cpu_usage_ratio', "Host cpu usage over the last sample interval.", host('cpu', 0.01)),
+            exporter.gauge(f'{prefix}_host_load1', "Host one minute load average.", host('load')),
+            exporter.gauge(f'{prefix}_host_memory_used_bytes', "Host memory in use, excluding reclaimable cache.", host('memory_used')),
+            exporter.gauge(f'{prefix}_host_memory_usage_ratio', "Host memory in use as a fraction of total.", host('memory', 0.01)),
+            exporter.gauge(f'{prefix}_host_swap_usage_ratio', "Host swap in use as a fraction of total.", host('swap', 0.01)),
+            exporter.gauge(f'{prefix}_host_disk_usage_ratio', "Used fraction of the filesystem holding the plugin volume.", host('disk', 0.01)),
+            exporter.counter(f'{prefix}_host_network_receive_bytes', "Bytes received on all interfaces except loopback.", counters.get('network_rx_bytes')),
+            exporter.counter(f'{prefix}_host_network_transmit_bytes', "Bytes sent on all interfaces except loopback.", counters.get('network_tx_bytes')),
+            exporter.counter(f'{prefix}_host_disk_read_bytes', "Bytes read from physical disks.", counters.get('disk_read_bytes')),
+            exporter.counter(f'{prefix}_host_disk_written_bytes', "Bytes written to physical disks.", counters.get('disk_write_bytes')),
+            exporter.gauge(f'{prefix}_host_temperature_celsius', "Temperature of the cpu thermal zone.", host('temperature')),
+            startup,
+            exporter.histogram(f'{prefix}_session_first_byte_seconds', "Time from opening a btop session to its first output.", parent.sessions.first_byte),
+            exporter.gauge(f'{prefix}_sessions', "Live btop sessions.", len(parent.sessions.sessions)),
+            exporter.counter(f'{prefix}_sessions_reaped', "Sessions closed after being idle.", parent.sessions.reaped),
+            exporter.counter(f'{prefix}_sessions_evicted', "Sessions closed to stay under the session limit.", parent.sessions.evicted),
+            exporter.counter(f'{prefix}_stream_writes', "btop output writes received.", stream.writes),
+            exporter.counter(f'{prefix}_stream_frames', "Frames sent to clients after coalescing.", stream.frames),
+            exporter.counter(f'{prefix}_stream_bytes', "Bytes sent to clients before compression.", stream.bytes),
+            exporter.counter(f'{prefix}_collector_samples', "Host metric samples taken.", self.collector.samples),
+            exporter.counter(f'{prefix}_collector_sample_seconds', "Time spent taking host metric samples.", self.collector.sample_time),
+            exporter.counter(f'{prefix}_scrapes_cached', "Scrapes answered from the cached snapshot.", self.snapshot.hits),
+        ])
+
+    async def onRequest(self, request: HttpRequest, response: HttpResponse) -> None:
+        try:
+            body = self.snapshot.get()
+            await response.send(body, {
+                "code": 200,
+                "headers": {
+                    "Content-Type": exporter.CONTENT_TYPE,
+                },
+            })
+        except:
+            import traceback
+            traceback.print_exc()
+            await response.send("Failed to collect metrics", {
+                "code": 500,
+            })
+
+    async def plugin_usage(self) -> str:
+        plugins = device_index.plugins()
+        loop = asyncio.get_running_loop()
+        usage = await loop.run_in_executor(None, self.attribution.refresh, set(plugins))
+        rows = "\n".join(
+            f"| {plugins.get(plugin, plugin)} | {totals['processes']} | {totals['cpu']:.1f}% | {totals['rss'] / 1024 / 1024:.0f} MiB | {totals['io'] / 1024:.1f} KiB/s |"
+            for plugin, totals in sorted(usage.items(), key=lambda u: -u[1]['cpu'])
+        )
+        return f"""
+## Plugins
+
+Processes are matched to plugins by their plugin volume or command line, child processes count towards their parent's plugin. CPU and disk IO cover the time since this page was last viewed.
+
+| Plugin | Processes | CPU | Memory | Disk IO |
+| --- | --- | --- | --- | --- |
+{rows}
+
+Refreshed in {self.attribution.refresh_time * 1000:.1f} ms.
+"""
+
+    async def cluster_usage(self) -> str:
+        nodes = await self.parent.cluster_metrics()
+        if not nodes:
+            return ""
+
+        def row(node: str, metrics: Any) -> str:
+            if isinstance(metrics, asyncio.TimeoutError):
+                return f"| {node} | timed out | | | | |"
+            if isinstance(metrics, BaseException):
+                return f"| {node} | {type(metrics).__name__} | | | | |"
+
+            def value(key: str, format: str, scale: float = 1) -> str:
+                return format.format(metrics[key] / scale) if metrics.get(key) is not None else ''
+
+            return f"| {node} | ok | {value('cpu', '{:.1f}%')} | {value('memory', '{:.1f}%')} | {value('load', '{:.2f}')} | {value('network_rx', '{:.1f} / ', 1024)}{value('network_tx', '{:.1f} KiB/s', 1024)} |"
+
+        # hottest node first, unreachable ones last
+        ordered = sorted(nodes.items(), key=lambda n: -n[1].get('cpu', 0) if isinstance(n[1], dict) else 1)
+        rows = "\n".join(row(node, metrics) for node, metrics in ordered)
+        return f"""
+## Cluster
+
+Gathered from every cluster worker in parallel, nodes that don't answer within {CLUSTER_TIMEOUT} seconds are marked as timed out. Open btop on a node with the `cluster_worker` connectStream option.
+
+| Node | Status | CPU | Memory | Load | Network In / Out |
+| --- | --- | --- | --- | --- | --- |
+{rows}
+"""
+
+    async def metrics_endpoint(self) -> str | None:
+        try:
+            endpoint = await scrypted_sdk.endpointManager.getInsecurePublicLocalEndpoint(self.nativeId)
+            return endpoint.rstrip('/') + '/metrics'
+        except:
+            return None
+
+    @property
+    def snapshot_ttl(self) -> float:
+        try:
+            return max(float(self.storage.getItem('snapshot_ttl')), 0)
+        except:
+            return exporter.SNAPSHOT_TTL
+
+    @property
+    def sample_interval(self) -> float:
+        try:
+            return max(float(self.storage.getItem('sample_interval')), 1)
+        except:
+            return collector.SAMPLE_INTERVAL
+
+    async def getSettings(self) -> list[Setting]:
+        return [
+            {
+                "key": "sample_interval",
+                "title": "Sample Interval",
+                "description": "Seconds between host metric samples.",
+                "type": "number",
+                "value": self.sample_interval,
+            },
+            {
+                "key": "snapshot_ttl",
+                "title": "Metrics Snapshot TTL",
+                "description": "Seconds a rendered OpenMetrics snapshot is reused between scrapes.",
+                "type": "number",
+                "value": self.snapshot_ttl,
+            },
+            {
+                "key": "metrics_endpoint",
+                "title": "Metrics Endpoint",
+                "description": "OpenMetrics endpoint for Prometheus to scrape.",
+                "value": await self.metrics_endpoint(),
+                "readonly": True,
+            },
+            {
+                "key": "collector_overhead",
+                "title": "Collector Overhead",
+                "value": self.collector.overhead(),
+                "readonly": True,
+            },
+        ]
+
+    async def putSetting(self, key: str, value: str) -> None:
+        if key == "sample_interval":
+            self.storage.setItem(key, str(value))
+            await self.onDeviceEvent(ScryptedInterface.Settings.value, None)
+        elif key == "snapshot_ttl":
+            self.storage.setItem(key, str(value))
+            self.snapshot.ttl = self.snapshot_ttl
+            await self.onDeviceEvent(ScryptedInterface.Settings.value, None)
+
+    async def getReadmeMarkdown(self) -> str:
+        rows = "\n".join(
+            f"| {name} | {round(self.metrics[key] / scale, 1)} {unit or ''} | {self.history.sparkline(key) if self.history else ''} |"
+            for key, (name, unit, scale) in BtopHostMetrics.SENSORS.items()
+            if self.metrics.get(key) is not None
+        )
+        return f"""
+# Host Metrics
+
+Host cpu, memory, network and disk usage sampled every {self.sample_interval:g} seconds without running btop. Automations can use these sensors to react to load.
+
+| Sensor | Value | Last Hour |
+| --- | --- | --- |
+{rows}
+{await self.cluster_usage()}{await self.plugin_usage()}"""
+
+
+class BtopTracing(ScryptedDeviceBase, Settings, Readme, HttpRequestHandler):
+    # the switch lives in the plugin's storage so tracing can already be on
+    # while the plugin starts up, before this device exists
+
+    def __init__(self, nativeId: str, parent: BtopPlugin) -> None:
+        super().__init__(nativeId)
+        self.parent = parent
+
+    async def export_path(self) -> str | None:
+        try:
+            path = await scrypted_sdk.endpointManager.getAuthenticatedPath(self.nativeId)
+            return path.rstrip('/') + '/trace.json'
+        except:
+            return None
+
+    async def onRequest(self, request: HttpRequest, response: HttpResponse) -> None:
+        await response.send(tracing.export(), {
+            "code": 200,
+            "headers": {
+                "Content-Type": "application/json",
+                "Content-Disposition": "attachment; filename=\"btop-trace.json\"",
+            },
+        })
+
+    async def getSettings(self) -> list[Setting]:
+        return [
+            {
+                "key": "tracing",
+                "title": "Tracing",
+                "description": "Record spans and counters for downloads, theme installs, config changes, device lookups, startup and sessions.",
+                "type": "boolean",
+                "value": tracing.enabled,
+            },
+            {
+                "key": "tracing_capacity",
+                "title": "Buffer Size",
+                "description": "Number of spans kept, older ones are dropped.",
+                "type": "number",
+                "value": tracing.spans.maxlen,
+            },
+            {
+                "key": "trace_export",
+                "title": "JSON Export",
+                "description": "Chrome trace event format, opens in Perfetto or chrome://tracing.",
+                "value": await self.export_path(),
+                "readonly": True,
+            },
+            {
+                "key": "clear_traces",
+                "title": "Clear",
+                "type": "button",
+            },
+        ]
+
+    async def putSetting(self, key: str, value: str) -> None:
+        storage = self.parent.storage
+        if key == "tracing":
+            storage.setItem('tracing', 'true' if value in (True, 'true') else 'false')
+        elif key == "tracing_capacity":
+            storage.setItem('tracing_capacity', str(max(int(value), 1)))
+        elif key == "clear_traces":
+            tracing.clear()
+        self.parent.apply_tracing()
+        await self.onDeviceEvent(ScryptedInterface.Settings.value, None)
+        await self.onDeviceEvent(ScryptedInterface.Readme.value, None)
+
+    async def getReadmeMarkdown(self) -> str:
+        export = await self.export_path()
+        return f"""
+# Tracing
+
+Spans and counters from the plugin's hot paths. Download everything buffered from [{export}]({export}).
+
+{tracing.markdown()}
+"""
+
+
+class BtopWorker:
+    # Runs in a forked process, possibly on another cluster worker.
+
+    def __init__(self) -> None:
+        self.install = None
+        self.exe = None
+        self.themes_dir = None
+        self.collector = None
+        self.preparing: asyncio.Future = None
+
+    async def prepare(self, source: Any, theme_urls: list[str]) -> str:
+        # runs before every session on this node, only the first one (or the
+        # first after a failure) installs anything
+        preparing = self.preparing
+        if not preparing or (preparing.done() and (preparing.cancelled() or preparing.exception())):
+            preparing = self.preparing = asyncio.ensure_future(self.install_btop(source, theme_urls))
+        return await asyncio.shield(preparing)
+
+    async def install_btop(self, source: Any, theme_urls: list[str]) -> str:
+        artifact_source.server = source
+        self.install, self.exe = await download_btop(download_artifact)
+        if platform.system() == 'Windows':
+            themes_dir = os.path.join(os.path.dirname(self.exe), 'themes')
+        else:
+            themes_dir = BtopThemeManager.LOCAL_THEME_DIR
+        self.themes_dir = themes_dir
+        os.makedirs(themes_dir, exist_ok=True)
+        for url in theme_urls:
+            try:
+                filename = url.split('/')[-1]
+                fullpath = await artifact_source.fetch(filename, url) or await downloader.revalidate_file(url, filename)
+                await downloader.install_file(fullpath, os.path.join(themes_dir, filename))
+            except:
+                import traceback
+                traceback.print_exc()
+        return self.exe
+
+    async def connectStream(self, input: AsyncGenerator[Any, Any], options: Any) -> Any:
+        # btop runs on this node's own pty, with the server's btop.conf and
+        # the profile's overrides written to a config directory here
+        profile = profiles.Profile(options['profile'], options['flags'], options['config'])
+        root = os.path.join(os.environ['SCRYPTED_PLUGIN_VOLUME'], 'profiles')
+        loop = asyncio.get_running_loop()
+        config_home = await loop.run_in_executor(None, profiles.write_profile_config, root, profile, options['btop_config'], self.themes_dir)
+        env = dict(os.environ)
+        env['XDG_CONFIG_HOME'] = config_home
+        if options.get('marker'):
+            key, value = options['marker'].split('=', 1)
+            env[key] = value
+        return await pty_process.connect([self.exe, '--utf-force', *profile.flags], input, env)
+
+    async def metrics(self) -> dict:
+        if not self.collector:
+            self.collector = collector.Collector(os.environ.get('SCRYPTED_PLUGIN_VOLUME', '/'))
+        return self.collector.sample()
+
+
 def create_scrypted_plugin():
-    return BtopPlugin()
\ No newline at end of file
+    return BtopPlugin()
+
+
+async def fork():
+    return BtopWorker()
\ No newline at end of file
@@ -0,0 +1,103 @@
+import os
+from typing import Any
+
+
+PROC = '/proc'
+CLK_TCK = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def available() -> bool:
+    return os.path.isdir(os.path.join(PROC, 'self'))
+
+
+def pids() -> list[int]:
+    return [int(entry) for entry in os.listdir(PROC) if entry.isdigit()]
+
+
+def read_stat(pid: int) -> list[str] | None:
+    # fields after the command name, which may itself contain spaces and
+    # parentheses, so split after the last ')'. index 0 is the state field.
+    try:
+        with open(os.path.join(PROC, str(pid), 'stat'), 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    return data[data.rindex(b')') + 2:].decode().split()
+
+
+def read_environ(pid: int) -> list[bytes]:
+    try:
+        with open(os.path.join(PROC, str(pid), 'environ'), 'rb') as f:
+            return f.read().split(b'\0')
+    except OSError:
+        return []
+
+
+def read_cmdline(pid: int) -> list[str]:
+    try:
+        with open(os.path.join(PROC, str(pid), 'cmdline'), 'rb') as f:
+            return [arg.decode(errors='replace') for arg in f.read().split(b'\0') if arg]
+    except OSError:
+        return []
+
+
+def uptime() -> float:
+    with open(os.path.join(PROC, 'uptime')) as f:
+        return float(f.read().split()[0])
+
+
+def process_usage(pid: int) -> dict | None:
+    stat = read_stat(pid)
+    if not stat:
+        return None
+    return {
+        'ppid': int(stat[1]),
+        'cpu': (int(stat[11]) + int(stat[12])) / CLK_TCK,
+        'start': int(stat[19]) / CLK_TCK,
+        'rss': int(stat[21]) * PAGE_SIZE,
+    }
+
+
+def sample_usage(markers: dict[Any, str], cached: dict[Any, int]) -> dict[Any, dict]:
+    # finds the process tagged with each marker in its environment, trying
+    # the pid found last time before scanning the whole process table
+    found = {}
+    missing = {}
+    for key, marker in markers.items():
+        pid = cached.get(key, None)
+        if pid and marker.encode() in read_environ(pid):
+            found[key] = pid
+        else:
+            missing[marker.encode()] = key
+    if missing:
+        for pid in pids():
+            for entry in read_environ(pid):
+                key = missing.pop(entry, None)
+                if key is not None:
+                    found[key] = pid
+            if not missing:
+                break
+
+    now = uptime()
+    usage = {}
+    for key, pid in found.items():
+        stats = process_usage(pid)
+        if stats:
+            usage[key] = {'pid': pid, 'uptime': now, **stats}
+    return usage
+
+
+def read_io(pid: int) -> dict[str, int]:
+    # only readable for processes of the same user, empty otherwise
+    try:
+        with open(os.path.join(PROC, str(pid), 'io'), 'rb') as f:
+            data = f.read()
+    except OSError:
+        return {}
+    io = {}
+    for line in data.split(b'\n'):
+        key, _, value = line.partition(b':')
+        if key in (b'read_bytes', b'write_bytes'):
+            io[key.decode()] = int(value)
+    return io
@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+import re
+from typing import Any
+
+import btop_config
+
+
+# command line flags apply to any btop build, config overrides need a per
+# profile config directory (XDG_CONFIG_HOME) and are skipped on windows
+PROFILES = {
+    "default": {
+        "flags": [],
+        "config": {},
+    },
+    "low-bandwidth": {
+        "flags": ["--low-color"],
+        "config": {
+            "update_ms": 5000,
+            "truecolor": False,
+            "graph_symbol": "block",
+            "shown_boxes": "cpu mem net",
+        },
+    },
+    "minimal": {
+        "flags": ["--low-color"],
+        "config": {
+            "update_ms": 5000,
+            "truecolor": False,
+            "graph_symbol": "tty",
+            "shown_boxes": "cpu",
+        },
+    },
+    "tty": {
+        "flags": ["--tty_on"],
+        "config": {
+            "update_ms": 3000,
+        },
+    },
+}
+
+BOXES = {"cpu", "mem", "net", "proc", "gpu0", "gpu1", "gpu2", "gpu3", "gpu4", "gpu5"}
+
+
+class Profile:
+    def __init__(self, name: str, flags: list[str], config: dict[str, Any]) -> None:
+        self.name = name
+        self.flags = flags
+        self.config = config
+
+    def key(self) -> str:
+        return json.dumps([self.flags, self.config], sort_keys=True)
+
+
+def resolve(options: Any) -> Profile:
+    # options may name a profile and/or override individual settings, e.g.
+    # { "profile": "low-bandwidth", "update_ms": 10000, "boxes": "cpu" }
+    options = options or {}
+    name = options.get('profile', None) or 'default'
+    if name not in PROFILES:
+        raise Exception(f"Unknown btop profile {name}, expected one of {', '.join(PROFILES)}")
+    base = PROFILES[name]
+    flags = list(base['flags'])
+    config = dict(base['config'])
+    custom = False
+
+    if options.get('update_ms') is not None:
+        config['update_ms'] = max(int(options['update_ms']), 100)
+        custom = True
+    if options.get('boxes') is not None:
+        boxes = options['boxes'].split() if isinstance(options['boxes'], str) else list(options['boxes'])
+        unknown = [b for b in boxes if b not in BOXES]
+        if unknown:
+            raise Exception(f"Unknown btop boxes {', '.join(unknown)}")
+        config['shown_boxes'] = ' '.join(boxes)
+        custom = True
+    if options.get('preset') is not None:
+        flags += ['--preset', str(int(options['preset']))]
+        custom = True
+    if options.get('low_color'):
+        if '--low-color' not in flags:
+            flags.append('--low-color')
+        custom = True
+    if options.get('tty'):
+        if '--tty_on' not in flags:
+            flags.append('--tty_on')
+        custom = True
+
+    profile = Profile(name, flags, config)
+    if custom:
+        profile.name = f"{name}-{hashlib.sha256(profile.key().encode()).hexdigest()[:8]}"
+    return profile
+
+
+def format_value(value: Any) -> str:
+    if isinstance(value, bool):
+        return 'True' if value else 'False'
+    if isinstance(value, int):
+        return str(value)
+    return json.dumps(str(value))
+
+
+def apply_overrides(config: str, overrides: dict[str, Any]) -> str:
+    for key, value in overrides.items():
+        line = f"{key} = {format_value(value)}"
+        config, count = re.subn(rf'^{re.escape(key)}\s*=.*$', lambda _: line, config, flags=re.MULTILINE)
+        if not count:
+            config = config.rstrip('\n') + '\n' + line + '\n'
+    return config
+
+
+def write_profile_config(root: str, profile: Profile, config: str, themes_dir: str) -> str:
+    # returns the directory to use as XDG_CONFIG_HOME for this profile
+    config_home = os.path.join(root, profile.name)
+    btop_dir = os.path.join(config_home, 'btop')
+    os.makedirs(btop_dir, exist_ok=True)
+    btop_config.write_config(os.path.join(btop_dir, 'btop.conf'), apply_overrides(config, profile.config))
+
+    themes = os.path.join(btop_dir, 'themes')
+    if not os.path.lexists(themes) and os.path.isdir(themes_dir):
+        try:
+            os.symlink(themes_dir, themes)
+        except FileExistsError:
+            # another session of this profile linked it first
+            pass
+    return config_home
@@ -0,0 +1,109 @@
+import asyncio
+import os
+import signal
+import struct
+import subprocess
+from typing import Any, AsyncGenerator
+
+from sessions import parse_control
+
+try:
+    import fcntl
+    import termios
+except ImportError:
+    # windows has no posix pty
+    fcntl = termios = None
+
+
+READ_SIZE = 65536
+KILL_TIMEOUT = 2
+
+
+def set_size(fd: int, cols: int, rows: int) -> None:
+    fcntl.ioctl(fd, termios.TIOCSWINSZ, struct.pack('HHHH', rows, cols, 0, 0))
+
+
+def controlling_tty() -> None:
+    # runs in the child before exec, stdin is the pty slave
+    fcntl.ioctl(0, termios.TIOCSCTTY, 0)
+
+
+async def connect(cmd: list[str], input: AsyncGenerator[Any, None], env: dict[str, str] = None) -> AsyncGenerator[bytes, None]:
+    # Runs cmd on a local pty with the same stream protocol as the terminal
+    # service: bytes in are keystrokes, json strings are control messages
+    # like { "dim": { "cols": 80, "rows": 24 } }. Used on cluster workers,
+    # which may not have a terminal service of their own.
+    master, slave = os.openpty()
+    set_size(master, 80, 24)
+    try:
+        process = subprocess.Popen(cmd, stdin=slave, stdout=slave, stderr=slave, env={**(env or os.environ), 'TERM': 'xterm-256color'}, start_new_session=True, preexec_fn=controlling_tty)
+    except:
+        os.close(master)
+        raise
+    finally:
+        os.close(slave)
+    return output(process, master, input)
+
+
+async def output(process: subprocess.Popen, master: int, input: AsyncGenerator[Any, None]) -> AsyncGenerator[bytes, None]:
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+
+    def readable() -> None:
+        try:
+            data = os.read(master, READ_SIZE)
+        except OSError:
+            # EIO once the child has exited and the slave is closed
+            data = b''
+        if not data:
+            loop.remove_reader(master)
+        queue.put_nowait(data)
+
+    async def pump() -> None:
+        try:
+            async for message in input:
+                control = parse_control(message)
+                if control is not None:
+                    dim = control.get('dim', None)
+                    if dim:
+                        set_size(master, dim['cols'], dim['rows'])
+                    continue
+                os.write(master, message if isinstance(message, (bytes, bytearray)) else message.encode())
+        except:
+            pass
+        # the input ending means the client is done with the process
+        terminate(process)
+
+    loop.add_reader(master, readable)
+    pumping = asyncio.ensure_future(pump())
+    try:
+        while True:
+            data = await queue.get()
+            if not data:
+                break
+            yield data
+    finally:
+        pumping.cancel()
+        loop.remove_reader(master)
+        terminate(process)
+        os.close(master)
+        await loop.run_in_executor(None, reap, process)
+
+
+def terminate(process: subprocess.Popen) -> None:
+    if process.poll() is None:
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+        except OSError:
+            pass
+
+
+def reap(process: subprocess.Popen) -> None:
+    try:
+        process.wait(KILL_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        process.wait()
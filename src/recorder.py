@@ -0,0 +1,252 @@
+import asyncio
+import codecs
+import concurrent.futures
+import gzip
+import json
+import os
+import re
+import time
+from typing import Any, Callable
+
+
+RECORDINGS_MAX_BYTES = 256 * 1024 * 1024
+FLUSH_INTERVAL = 5
+FLUSH_BYTES = 256 * 1024
+# a chunk, index entry and full repaint start every INDEX_INTERVAL seconds,
+# so playback can start at any minute without reading what came before
+INDEX_INTERVAL = 60
+DEFAULT_DIM = (80, 24)
+
+writer = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='btop-recorder')
+
+
+def safe_name(name: str) -> str:
+    return re.sub(r'[^A-Za-z0-9._-]', '_', name)
+
+
+def write_chunk(path: str, events: list[str], index: float | None) -> int:
+    # each chunk is its own gzip member, so the .cast.gz as a whole is still
+    # a plain gzip file (zcat gives a normal asciicast v2 recording) while
+    # the index can point a reader at any member
+    data = gzip.compress(''.join(events).encode(), compresslevel=6)
+    with open(path, 'ab') as f:
+        offset = f.tell()
+        f.write(data)
+    if index is not None:
+        with open(path[:-len('.cast.gz')] + '.idx', 'a') as f:
+            f.write(f"{index:.3f} {offset}\n")
+    return len(data)
+
+
+class Recording:
+    def __init__(self, recorder: 'Recorder', name: str, redraw: Callable[[], None] = None) -> None:
+        self.recorder = recorder
+        self.name = name
+        self.path = os.path.join(recorder.root, name + '.cast.gz')
+        self.redraw = redraw
+        self.started = time.monotonic()
+        self.timestamp = time.time()
+        self.dim = DEFAULT_DIM
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.events: list[str] = []
+        self.pending_bytes = 0
+        self.header_written = False
+        self.chunk_start: float = None
+        self.index_next = 0
+        self.closed = False
+
+    def event(self, kind: str, data: str) -> None:
+        elapsed = time.monotonic() - self.started
+        if elapsed >= self.index_next:
+            # start a new indexed chunk and have btop repaint everything so
+            # the chunk can be played on its own
+            self.flush()
+            self.chunk_start = elapsed
+            self.index_next = (elapsed // INDEX_INTERVAL + 1) * INDEX_INTERVAL
+            if self.redraw:
+                self.redraw()
+        line = json.dumps([round(elapsed, 6), kind, data]) + '\n'
+        self.events.append(line)
+        self.pending_bytes += len(line)
+        if self.pending_bytes >= FLUSH_BYTES:
+            self.flush()
+
+    def output(self, data: Any) -> None:
+        if self.closed:
+            return
+        if not isinstance(data, str):
+            data = self.decoder.decode(bytes(data))
+        if data:
+            self.event('o', data)
+
+    def resize(self, cols: int, rows: int) -> None:
+        if self.closed:
+            return
+        self.dim = (cols, rows)
+        if self.header_written or self.events:
+            self.event('r', f"{cols}x{rows}")
+
+    def flush(self) -> None:
+        # hands the batch to the writer thread, the live stream never waits
+        # on compression or disk
+        if not self.events:
+            return
+        events = self.events
+        if not self.header_written:
+            cols, rows = self.dim
+            events.insert(0, json.dumps({
+                'version': 2,
+                'width': cols,
+                'height': rows,
+                'timestamp': int(self.timestamp),
+                'title': self.name,
+            }) + '\n')
+            self.header_written = True
+        self.events = []
+        self.pending_bytes = 0
+        self.recorder.write(self.path, events, self.chunk_start)
+        self.chunk_start = None
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.flush()
+        self.closed = True
+        self.recorder.recordings.discard(self)
+
+
+class Recorder:
+    # Opt-in recording of btop session output as gzip compressed asciicast
+    # v2 with a sparse seek index. Recordings beyond max_bytes are removed
+    # oldest first.
+
+    def __init__(self, root: str, max_bytes: int = RECORDINGS_MAX_BYTES, log: Callable[..., None] = print) -> None:
+        self.root = root
+        self.max_bytes = max_bytes
+        self.log = log
+        self.recordings: set[Recording] = set()
+        self.task = None
+        self.sizes: dict[str, int] = None
+        self.writes = 0
+        self.write_time = 0
+
+    def start(self, name: str, redraw: Callable[[], None] = None) -> Recording:
+        os.makedirs(self.root, exist_ok=True)
+        recording = Recording(self, safe_name(name), redraw)
+        self.recordings.add(recording)
+        if not self.task:
+            self.task = asyncio.ensure_future(self.flush_periodically())
+        return recording
+
+    def write(self, path: str, events: list[str], index: float | None) -> None:
+        loop = asyncio.get_event_loop()
+        # the writer thread must not iterate recordings while this loop
+        # starts and closes them, it gets the names in use as of now
+        live = frozenset(recording.name for recording in self.recordings)
+        future = loop.run_in_executor(writer, self.write_sync, path, events, index, live)
+        future.add_done_callback(self.written)
+
+    def written(self, future: asyncio.Future) -> None:
+        if future.exception():
+            self.log("Failed to write recording:", future.exception())
+
+    def write_sync(self, path: str, events: list[str], index: float | None, live: frozenset[str]) -> None:
+        started = time.perf_counter()
+        written = write_chunk(path, events, index)
+        self.writes += 1
+        self.write_time += time.perf_counter() - started
+        if self.sizes is None:
+            self.sizes = self.scan()
+        name = os.path.basename(path)[:-len('.cast.gz')]
+        self.sizes[name] = self.sizes.get(name, 0) + written
+        self.enforce_retention(live)
+
+    def scan(self) -> dict[str, int]:
+        sizes = {}
+        for entry in os.listdir(self.root):
+            if entry.endswith('.cast.gz'):
+                sizes[entry[:-len('.cast.gz')]] = os.path.getsize(os.path.join(self.root, entry))
+        return sizes
+
+    def enforce_retention(self, live: frozenset[str]) -> None:
+        total = sum(self.sizes.values())
+        if total <= self.max_bytes:
+            return
+        # names start with the recording's start time, so they sort oldest first
+        for name in sorted(self.sizes):
+            if total <= self.max_bytes:
+                break
+            if name in live:
+                continue
+            for suffix in ('.cast.gz', '.idx'):
+                try:
+                    os.remove(os.path.join(self.root, name + suffix))
+                except OSError:
+                    pass
+            total -= self.sizes.pop(name)
+
+    async def flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            for recording in list(self.recordings):
+                recording.flush()
+
+    def list(self) -> list[dict]:
+        recordings = []
+        if not os.path.isdir(self.root):
+            return recordings
+        for entry in sorted(os.listdir(self.root)):
+            if entry.endswith('.cast.gz'):
+                path = os.path.join(self.root, entry)
+                recordings.append({
+                    'name': entry[:-len('.cast.gz')],
+                    'size': os.path.getsize(path),
+                    'modified': os.path.getmtime(path),
+                })
+        return recordings
+
+    def summary(self) -> str:
+        recordings = self.list()
+        size = sum(r['size'] for r in recordings)
+        return f"{len(recordings)} recording(s), {size / 1024 / 1024:.1f} MiB of {self.max_bytes / 1024 / 1024:.0f} MiB, {len(self.recordings)} in progress"
+
+
+def read_index(path: str) -> list[tuple[float, int]]:
+    index = []
+    try:
+        with open(path) as f:
+            for line in f:
+                seconds, offset = line.split()
+                index.append((float(seconds), int(offset)))
+    except OSError:
+        pass
+    return index
+
+
+def read_recording(root: str, name: str, start: float = 0) -> str:
+    # asciicast v2 from roughly start seconds on, found through the index
+    # instead of decompressing everything before it
+    name = safe_name(name)
+    path = os.path.join(root, name + '.cast.gz')
+    with gzip.open(path, 'rt') as f:
+        header = json.loads(f.readline())
+    offset = 0
+    base = 0
+    for seconds, chunk_offset in read_index(os.path.join(root, name + '.idx')):
+        if seconds > start:
+            break
+        offset, base = chunk_offset, seconds
+
+    lines = [json.dumps(header) + '\n']
+    with open(path, 'rb') as raw:
+        raw.seek(offset)
+        with gzip.GzipFile(fileobj=raw) as f:
+            for line in f:
+                event = json.loads(line)
+                if not isinstance(event, list):
+                    continue
+                if event[0] < base:
+                    continue
+                event[0] = round(event[0] - base, 6)
+                lines.append(json.dumps(event) + '\n')
+    return ''.join(lines)
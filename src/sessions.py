@@ -0,0 +1,328 @@
+import asyncio
+import json
+import time
+import os
+from typing import Any, AsyncGenerator, Awaitable, Callable
+
+import procfs
+import stream_stage
+import tracing
+from stats import LatencyHistogram
+
+
+REDRAW_INTERVAL = 0.5
+IDLE_TIMEOUT = 30 * 60
+REAP_INTERVAL = 60
+
+
+def dim_message(cols: int, rows: int) -> str:
+    return json.dumps({'dim': {'cols': cols, 'rows': rows}})
+
+
+def parse_control(message: Any) -> dict | None:
+    # the terminal service takes raw bytes as keyboard input and json strings
+    # as control messages, e.g. { "dim": { "cols": 80, "rows": 24 } }
+    if isinstance(message, (bytes, bytearray, memoryview)):
+        return None
+    try:
+        parsed = json.loads(message)
+    except:
+        return None
+    if isinstance(parsed, dict):
+        return parsed
+    return None
+
+
+class BtopSession:
+    # Proxies a client's terminal stream to a btop process spawned through
+    # the terminal service. The client side stays connected while the btop
+    # process behind it can be replaced, e.g. after a configuration change.
+
+    def __init__(self, registry: 'SessionRegistry', spawn: Callable[[AsyncGenerator[Any, None], 'BtopSession'], Awaitable[AsyncGenerator[Any, None]]], input: AsyncGenerator[Any, None], label: str, record: bool = False) -> None:
+        self.registry = registry
+        self.spawn = spawn
+        self.input = input
+        self.label = label
+        self.id = registry.next_id()
+        self.created = time.time()
+        self.bytes_out = 0
+        self.dim = None
+        self.upstream_input: asyncio.Queue = None
+        self.restarting = False
+        self.closed = False
+        self.reload_started = None
+        self.pump = None
+        self.redraw_pending = False
+        self.last_redraw = 0
+        self.last_input = time.monotonic()
+        self.last_delivered = time.monotonic()
+        self.visible = True
+        self.close_reason = None
+        self.pid = None
+        self.cpu_sample = None
+        self.record = record
+        self.recording = None
+
+    @property
+    def marker(self) -> str:
+        # set in the environment of the spawned btop so its process can be
+        # found again for the usage view
+        return f"SCRYPTED_BTOP_SESSION={os.getpid()}-{self.id}"
+
+    def touch(self) -> None:
+        self.last_input = time.monotonic()
+
+    def idle(self, now: float, timeout: float) -> bool:
+        # no input and nobody looking, either the client said it's hidden or
+        # it stopped taking output altogether
+        if now - self.last_input < timeout:
+            return False
+        return not self.visible or now - self.last_delivered >= timeout
+
+    async def pump_input(self) -> None:
+        if not self.input:
+            return
+        try:
+            async for message in self.input:
+                self.touch()
+                control = parse_control(message)
+                if control and 'visible' in control:
+                    # page visibility from the client, e.g. { "visible": false }
+                    # for a background tab, btop doesn't need to see it
+                    self.visible = bool(control['visible'])
+                    continue
+                if control and control.get('dim'):
+                    self.dim = message
+                    if self.recording:
+                        self.recording.resize(control['dim']['cols'], control['dim']['rows'])
+                self.upstream_input.put_nowait(message)
+        except:
+            pass
+        self.close()
+
+    async def upstream_generator(self, queue: asyncio.Queue, replay: bool) -> AsyncGenerator[Any, None]:
+        # a replacement process starts at the default size, so replay the
+        # client's last resize before anything else
+        if replay and self.dim:
+            yield self.dim
+        while True:
+            message = await queue.get()
+            if message is None:
+                return
+            yield message
+
+    async def output(self) -> AsyncGenerator[Any, None]:
+        self.pump = asyncio.ensure_future(self.pump_input())
+        connected = time.monotonic()
+        if self.record and self.registry.recorder:
+            self.recording = self.registry.recorder.start(f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(self.created))}-{self.label}-{self.id}", self.request_redraw)
+        try:
+            replay = False
+            while not self.closed:
+                self.restarting = False
+                self.upstream_input = asyncio.Queue()
+                upstream = await self.spawn(self.upstream_generator(self.upstream_input, replay), self)
+                replay = True
+                async for chunk in upstream:
+                    if connected is not None:
+                        self.registry.first_byte.record(time.monotonic() - connected)
+                        connected = None
+                    if self.reload_started is not None:
+                        self.registry.reloaded(self, time.monotonic() - self.reload_started)
+                        self.reload_started = None
+                    self.bytes_out += len(chunk)
+                    if self.recording:
+                        self.recording.output(chunk)
+                    yield chunk
+                if not self.restarting:
+                    break
+            if self.close_reason:
+                yield f"\r\n[{self.close_reason}]\r\n".encode()
+        finally:
+            self.close()
+
+    async def stream(self, compress: bool = False) -> AsyncGenerator[bytes, None]:
+        registry = self.registry
+        async for frame in stream_stage.coalesce(self.output(), registry.stream, registry.frame_interval, registry.frame_max_bytes, on_drop=self.request_redraw, compress=compress):
+            yield frame
+            self.last_delivered = time.monotonic()
+
+    def request_redraw(self) -> None:
+        # resizing the pty makes btop repaint everything, which brings late
+        # joiners and clients whose output was dropped back up to date
+        if self.redraw_pending or not self.dim:
+            return
+        self.redraw_pending = True
+        delay = max(0, self.last_redraw + REDRAW_INTERVAL - time.monotonic())
+        asyncio.get_event_loop().call_later(delay, self.redraw)
+
+    def redraw(self) -> None:
+        self.redraw_pending = False
+        self.last_redraw = time.monotonic()
+        if self.closed or not self.upstream_input:
+            return
+        dim = parse_control(self.dim)['dim']
+        self.upstream_input.put_nowait(dim_message(dim['cols'], max(dim['rows'] - 1, 1)))
+        self.upstream_input.put_nowait(self.dim)
+
+    def restart(self, reload_started: float = None) -> None:
+        if self.closed:
+            return
+        self.restarting = True
+        self.reload_started = reload_started
+        # ending the input stream tells the terminal service to stop btop
+        if self.upstream_input:
+            self.upstream_input.put_nowait(None)
+
+    def close(self, reason: str = None) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        self.close_reason = reason
+        if self.upstream_input:
+            self.upstream_input.put_nowait(None)
+        if self.pump and self.pump is not asyncio.current_task():
+            self.pump.cancel()
+        if self.recording:
+            self.recording.close()
+        tracing.add('session', self.created, time.time() - self.created, label=self.label, bytes=self.bytes_out, reason=reason or 'ended')
+        tracing.count('session.bytes', self.bytes_out)
+        self.registry.remove(self)
+
+
+class SessionRegistry:
+    def __init__(self, log: Callable[..., None] = print) -> None:
+        self.log = log
+        self.sessions: dict[int, BtopSession] = {}
+        self.last_id = 0
+        self.last_reload = None
+        self.first_byte = LatencyHistogram()
+        self.stream_stats: dict[str, list] = {}
+        self.stream = stream_stage.StreamStats()
+        self.frame_interval = stream_stage.FRAME_INTERVAL
+        self.frame_max_bytes = stream_stage.FRAME_MAX_BYTES
+        self.max_sessions = 0
+        self.idle_timeout = IDLE_TIMEOUT
+        self.reaped = 0
+        self.evicted = 0
+        # set by the plugin, sessions are only recorded when asked to
+        self.recorder = None
+        self.record_all = False
+
+    def next_id(self) -> int:
+        self.last_id += 1
+        return self.last_id
+
+    def create(self, spawn: Callable[[AsyncGenerator[Any, None], BtopSession], Awaitable[AsyncGenerator[Any, None]]], input: AsyncGenerator[Any, None], label: str = 'default', record: bool = None) -> BtopSession:
+        while self.max_sessions and len(self.sessions) >= self.max_sessions:
+            # make room by closing the session that has gone longest
+            # without input, hidden clients first
+            oldest = min(self.sessions.values(), key=lambda s: (s.visible, s.last_input))
+            self.log(f"btop session {oldest.id} ({oldest.label}) closed, maximum of {self.max_sessions} session(s) reached")
+            self.evicted += 1
+            oldest.close("session closed to make room for a newer one")
+        session = BtopSession(self, spawn, input, label, self.record_all if record is None else record)
+        self.sessions[session.id] = session
+        return session
+
+    def open(self, spawn: Callable[[AsyncGenerator[Any, None], BtopSession], Awaitable[AsyncGenerator[Any, None]]], input: AsyncGenerator[Any, None], label: str = 'default', compress: bool = False, record: bool = None) -> AsyncGenerator[bytes, None]:
+        return self.create(spawn, input, label, record).stream(compress)
+
+    def remove(self, session: BtopSession) -> None:
+        if self.sessions.pop(session.id, None):
+            stats = self.stream_stats.setdefault(session.label, [0, 0, 0])
+            stats[0] += session.bytes_out
+            stats[1] += time.time() - session.created
+            stats[2] += 1
+
+    def output_rates(self) -> dict[str, str]:
+        # average stream output per profile, finished and live sessions
+        totals = {label: list(stats) for label, stats in self.stream_stats.items()}
+        for session in self.sessions.values():
+            stats = totals.setdefault(session.label, [0, 0, 0])
+            stats[0] += session.bytes_out
+            stats[1] += time.time() - session.created
+            stats[2] += 1
+        return {
+            label: f"{bytes / max(seconds, 1) / 1024:.1f} KiB/s over {count} session(s)"
+            for label, (bytes, seconds, count) in sorted(totals.items())
+        }
+
+    def restart_all(self, reload_started: float = None) -> int:
+        sessions = list(self.sessions.values())
+        for session in sessions:
+            session.restart(reload_started)
+        return len(sessions)
+
+    def reloaded(self, session: BtopSession, elapsed: float) -> None:
+        self.last_reload = elapsed
+        self.log(f"btop session {session.id} reloaded, change visible after {elapsed * 1000:.0f} ms")
+
+    def reap(self) -> int:
+        if not self.idle_timeout:
+            return 0
+        now = time.monotonic()
+        idle = [session for session in self.sessions.values() if session.idle(now, self.idle_timeout)]
+        for session in idle:
+            self.log(f"btop session {session.id} ({session.label}) closed after {(now - session.last_input) / 60:.0f} minutes idle")
+            session.close("session closed after being idle")
+        self.reaped += len(idle)
+        return len(idle)
+
+    async def reap_idle(self) -> None:
+        while True:
+            await asyncio.sleep(REAP_INTERVAL)
+            try:
+                self.reap()
+            except:
+                import traceback
+                traceback.print_exc()
+
+    async def usage(self) -> dict[int, dict]:
+        # cpu and memory of each session's btop process, cpu is averaged
+        # since the previous call (or since the process started)
+        sessions = list(self.sessions.values())
+        if not sessions or not procfs.available():
+            return {}
+        markers = {session.id: session.marker for session in sessions}
+        cached = {session.id: session.pid for session in sessions if session.pid}
+        loop = asyncio.get_running_loop()
+        sampled = await loop.run_in_executor(None, procfs.sample_usage, markers, cached)
+
+        usage = {}
+        for session in sessions:
+            stats = sampled.get(session.id, None)
+            if not stats:
+                continue
+            previous = session.cpu_sample if session.pid == stats['pid'] else None
+            if previous:
+                cpu, elapsed = stats['cpu'] - previous[0], stats['uptime'] - previous[1]
+            else:
+                cpu, elapsed = stats['cpu'], stats['uptime'] - stats['start']
+            session.pid = stats['pid']
+            session.cpu_sample = (stats['cpu'], stats['uptime'])
+            usage[session.id] = {
+                'pid': stats['pid'],
+                'cpu': cpu * 100 / elapsed if elapsed > 0 else 0,
+                'rss': stats['rss'],
+            }
+        return usage
+
+    async def describe(self) -> dict[int, str]:
+        usage = await self.usage()
+        now = time.monotonic()
+        described = {}
+        for session in sorted(self.sessions.values(), key=lambda s: s.id):
+            parts = [
+                session.label,
+                f"up {(time.time() - session.created) / 60:.0f} min",
+                f"idle {(now - session.last_input) / 60:.0f} min",
+                'visible' if session.visible else 'hidden',
+            ]
+            stats = usage.get(session.id, None)
+            if stats:
+                parts.append(f"pid {stats['pid']}, {stats['cpu']:.1f}% cpu, {stats['rss'] / 1024 / 1024:.1f} MiB rss")
+            else:
+                parts.append("process usage unavailable")
+            described[session.id] = ', '.join(parts)
+        return described
@@ -0,0 +1,219 @@
+import asyncio
+import functools
+from typing import Any, AsyncGenerator, Awaitable, Callable
+
+import stream_stage
+from profiles import Profile
+from sessions import SessionRegistry, dim_message, parse_control
+
+
+DEFAULT_DIM = (80, 24)
+VIEWER_MAX_PENDING = 1024 * 1024
+DIM_TIMEOUT = 2
+
+
+class Viewer:
+    def __init__(self, hub: 'SharedSessionHub', profile: Profile) -> None:
+        self.hub = hub
+        self.profile = profile
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.pending = 0
+        self.held: list[Any] = []
+        self.dropped = 0
+        self.visible = True
+        self.shared: SharedSession = None
+        self.closed = False
+
+    def send(self, chunk: Any) -> None:
+        size = len(chunk)
+        if self.pending + size > VIEWER_MAX_PENDING:
+            # this viewer can't keep up, throw away what it hasn't read yet
+            # and have btop repaint the whole screen once it catches up
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.held = []
+            self.pending = 0
+            self.dropped += 1
+            self.shared.request_redraw()
+            return
+        self.pending += size
+        self.queue.put_nowait(chunk)
+
+    def end(self) -> None:
+        self.queue.put_nowait(None)
+
+    async def next(self) -> Any:
+        # anything else already queued goes out in the same message, up to
+        # the frame size limit, a chunk that doesn't fit starts the next one
+        limit = self.hub.registry.frame_max_bytes
+        chunks = self.held or [await self.queue.get()]
+        self.held = []
+        size = len(chunks[0] or b'')
+        while chunks[-1] is not None and not self.queue.empty():
+            chunk = self.queue.get_nowait()
+            if chunk is not None and size + len(chunk) > limit:
+                self.held = [chunk]
+                break
+            chunks.append(chunk)
+            size += len(chunk or b'')
+        end = chunks[-1] is None
+        chunks = [chunk for chunk in chunks if chunk is not None]
+        if not chunks:
+            return None
+        if end:
+            self.queue.put_nowait(None)
+        frame = b''.join(chunks)
+        self.pending -= len(frame)
+        return frame
+
+    def attach(self, dim: tuple) -> None:
+        # a client that already went away must not start a btop process
+        if self.closed:
+            return
+        shared = self.hub.session_for(dim, self.profile)
+        if shared is self.shared:
+            return
+        self.detach()
+        self.shared = shared
+        self.shared.add(self)
+
+    def detach(self) -> None:
+        if self.shared:
+            self.shared.remove(self)
+            self.shared = None
+
+    def close(self) -> None:
+        self.closed = True
+        self.detach()
+
+    async def pump(self, input: AsyncGenerator[Any, None]) -> None:
+        # shared sessions are view only, keystrokes from one viewer (like q)
+        # must not affect everyone else, so only resizes and visibility
+        # changes are handled
+        try:
+            async for message in input:
+                control = parse_control(message)
+                if control and 'visible' in control:
+                    self.visible = bool(control['visible'])
+                dim = control.get('dim') if control else None
+                if dim:
+                    self.attach((dim['cols'], dim['rows']))
+                if self.shared:
+                    self.shared.touch()
+        except:
+            pass
+        self.end()
+
+
+class SharedSession:
+    # One btop process per terminal size and profile, its output is
+    # broadcast to every attached viewer.
+
+    def __init__(self, hub: 'SharedSessionHub', dim: tuple, profile: Profile) -> None:
+        self.hub = hub
+        self.dim = dim
+        self.profile = profile
+        self.key = (*dim, profile.name)
+        self.viewers: set[Viewer] = set()
+        self.input: asyncio.Queue = asyncio.Queue()
+        self.session = hub.registry.create(functools.partial(hub.spawn, profile=profile), self.input_generator(), profile.name)
+        self.output = self.session.stream()
+        self.task = asyncio.ensure_future(self.broadcast())
+
+    async def input_generator(self) -> AsyncGenerator[Any, None]:
+        yield dim_message(*self.dim)
+        while True:
+            message = await self.input.get()
+            if message is None:
+                return
+            yield message
+
+    async def broadcast(self) -> None:
+        try:
+            async for chunk in self.output:
+                for viewer in list(self.viewers):
+                    viewer.send(chunk)
+        except:
+            import traceback
+            traceback.print_exc()
+        finally:
+            self.hub.remove(self)
+            for viewer in list(self.viewers):
+                viewer.end()
+
+    def write(self, message: Any) -> None:
+        self.input.put_nowait(message)
+
+    def request_redraw(self) -> None:
+        self.session.request_redraw()
+
+    def touch(self) -> None:
+        # the session counts as idle once none of its viewers are visible
+        self.session.touch()
+        self.session.visible = any(viewer.visible for viewer in self.viewers)
+
+    def add(self, viewer: Viewer) -> None:
+        self.viewers.add(viewer)
+        self.touch()
+        self.request_redraw()
+
+    def remove(self, viewer: Viewer) -> None:
+        self.viewers.discard(viewer)
+        if not self.viewers:
+            self.close()
+        else:
+            self.touch()
+
+    def close(self) -> None:
+        self.hub.remove(self)
+        self.input.put_nowait(None)
+
+
+class SharedSessionHub:
+    def __init__(self, registry: SessionRegistry, spawn: Callable[[AsyncGenerator[Any, None], Any], Awaitable[AsyncGenerator[Any, None]]], max_sessions: int = 4) -> None:
+        self.registry = registry
+        self.spawn = spawn
+        self.max_sessions = max_sessions
+        self.sessions: dict[tuple, SharedSession] = {}
+
+    def session_for(self, dim: tuple, profile: Profile) -> SharedSession:
+        key = (*dim, profile.name)
+        shared = self.sessions.get(key, None)
+        if shared:
+            return shared
+        if self.sessions and len(self.sessions) >= self.max_sessions:
+            # at the cap, share the running session closest in size,
+            # preferring one with the requested profile
+            cols, rows = dim
+            return min(self.sessions.values(), key=lambda s: (s.profile.name != profile.name, abs(s.dim[0] * s.dim[1] - cols * rows)))
+        shared = self.sessions[key] = SharedSession(self, dim, profile)
+        return shared
+
+    def remove(self, shared: SharedSession) -> None:
+        if self.sessions.get(shared.key, None) is shared:
+            del self.sessions[shared.key]
+
+    async def open(self, input: AsyncGenerator[Any, None], profile: Profile, compress: bool = False) -> AsyncGenerator[Any, None]:
+        viewer = Viewer(self, profile)
+        compressor = stream_stage.Compressor() if compress else None
+        timer = None
+        if input:
+            pump = asyncio.ensure_future(viewer.pump(input))
+            # clients normally send their size first, don't wait forever on
+            # one that doesn't
+            timer = asyncio.get_event_loop().call_later(DIM_TIMEOUT, lambda: viewer.shared or viewer.attach(DEFAULT_DIM))
+        else:
+            pump = None
+            viewer.attach(DEFAULT_DIM)
+        try:
+            while True:
+                chunk = await viewer.next()
+                if chunk is None:
+                    break
+                yield compressor.compress(chunk) if compressor else chunk
+        finally:
+            if timer:
+                timer.cancel()
+            if pump:
+                pump.cancel()
+            viewer.close()
@@ -0,0 +1,85 @@
+import asyncio
+import time
+from typing import Any, AsyncGenerator, Awaitable, Callable
+
+import vt
+from sessions import dim_message
+
+
+SNAPSHOT_COLS = 120
+SNAPSHOT_ROWS = 36
+SNAPSHOT_TTL = 10
+# btop draws its boxes right away but the graphs and process list only
+# fill in after an update or two
+SNAPSHOT_UPDATE_MS = 1000
+CAPTURE_TIME = 2.5
+
+
+async def capture(connect: Callable[[AsyncGenerator[Any, None]], Awaitable[AsyncGenerator[Any, None]]], cols: int = SNAPSHOT_COLS, rows: int = SNAPSHOT_ROWS, duration: float = CAPTURE_TIME) -> vt.Screen:
+    screen = vt.Screen(cols, rows)
+    stop = asyncio.Event()
+
+    async def input() -> AsyncGenerator[Any, None]:
+        yield dim_message(cols, rows)
+        # ending the input stops btop
+        await stop.wait()
+
+    output = await connect(input())
+
+    async def read() -> None:
+        async for chunk in output:
+            screen.feed(chunk)
+
+    reader = asyncio.ensure_future(read())
+    try:
+        await asyncio.wait_for(asyncio.shield(reader), duration)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        stop.set()
+        reader.cancel()
+    return screen
+
+
+class SnapshotCache:
+    # Renders are shared: requests within the ttl get the cached screen and
+    # requests that arrive while a render is running wait for that render
+    # rather than starting btop again.
+
+    def __init__(self, render: Callable[[], Awaitable[vt.Screen]], ttl: float = SNAPSHOT_TTL) -> None:
+        self.render = render
+        self.ttl = ttl
+        self.screen: vt.Screen = None
+        self.rendered = 0
+        self.render_time = None
+        self.pending: asyncio.Future = None
+        self.hits = 0
+        self.joined = 0
+        self.renders = 0
+
+    async def get(self) -> vt.Screen:
+        if self.screen and time.monotonic() - self.rendered < self.ttl:
+            self.hits += 1
+            return self.screen
+        if self.pending:
+            self.joined += 1
+        else:
+            self.pending = asyncio.ensure_future(self.refresh())
+        # a caller going away must not cancel the render for everyone else
+        return await asyncio.shield(self.pending)
+
+    async def refresh(self) -> vt.Screen:
+        started = time.monotonic()
+        try:
+            self.screen = await self.render()
+            self.rendered = time.monotonic()
+            self.render_time = self.rendered - started
+            self.renders += 1
+            return self.screen
+        finally:
+            self.pending = None
+
+    def summary(self) -> str:
+        if not self.renders:
+            return "not rendered yet"
+        return f"{self.renders} render(s), last took {self.render_time:.1f}s, {self.hits} served from cache, {self.joined} joined a render in progress"
@@ -0,0 +1,64 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable
+
+import tracing
+
+
+class StartupGraph:
+    # Startup stages are declared with the stages they depend on, and each
+    # one starts as soon as its dependencies resolve. Stages may depend on
+    # names that are registered later, e.g. by a lazily created device.
+
+    def __init__(self) -> None:
+        self.start = time.monotonic()
+        self.stages: dict[str, asyncio.Future] = {}
+        self.deps: dict[str, tuple[str, ...]] = {}
+        self.timings: dict[str, dict[str, float]] = {}
+
+    def stage(self, name: str) -> asyncio.Future:
+        stage = self.stages.get(name, None)
+        if not stage:
+            stage = self.stages[name] = asyncio.get_event_loop().create_future()
+        return stage
+
+    def add(self, name: str, fn: Callable[[], Awaitable[Any]], *deps: str) -> asyncio.Future:
+        if name in self.deps:
+            raise Exception(f"Startup stage {name} already registered")
+        self.deps[name] = deps
+        stage = self.stage(name)
+
+        async def run() -> None:
+            queued = time.monotonic()
+            started = None
+            try:
+                for dep in deps:
+                    await self.stage(dep)
+                started = time.monotonic()
+                stage.set_result(await fn())
+            except Exception as e:
+                stage.set_exception(e)
+            finished = time.monotonic()
+            self.timings[name] = {
+                'waited': (started or finished) - queued,
+                'ran': finished - started if started else 0,
+                'finished': finished - self.start,
+            }
+            tracing.add(f'startup.{name}', time.time() - (finished - (started or finished)), self.timings[name]['ran'], waited=round(self.timings[name]['waited'] * 1000, 1))
+
+        asyncio.ensure_future(run())
+        return stage
+
+    def settings(self) -> list[dict]:
+        settings = []
+        for name, timing in sorted(self.timings.items(), key=lambda t: t[1]['finished']):
+            deps = ', '.join(self.deps.get(name, ())) or 'none'
+            settings.append({
+                "group": "Startup",
+                "key": f"startup_{name}",
+                "title": name,
+                "description": f"Depends on: {deps}.",
+                "value": f"{timing['ran'] * 1000:.0f} ms (waited {timing['waited'] * 1000:.0f} ms, done at {timing['finished'] * 1000:.0f} ms)",
+                "readonly": True,
+            })
+        return settings
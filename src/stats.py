@@ -0,0 +1,40 @@
+import bisect
+
+
+LATENCY_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+
+class LatencyHistogram:
+    def __init__(self, buckets: list[float] = LATENCY_BUCKETS_MS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def record(self, seconds: float) -> None:
+        ms = seconds * 1000
+        self.counts[bisect.bisect_left(self.buckets, ms)] += 1
+        self.count += 1
+        self.sum += ms
+
+    def percentile(self, p: float) -> float | None:
+        # upper bound of the bucket holding the p-th percentile
+        if not self.count:
+            return None
+        target = self.count * p
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return self.buckets[i] if i < len(self.buckets) else float('inf')
+        return float('inf')
+
+    def summary(self) -> str:
+        if not self.count:
+            return "no samples"
+
+        def fmt(p: float) -> str:
+            value = self.percentile(p)
+            return f"<={value:.0f} ms" if value != float('inf') else f">{self.buckets[-1]} ms"
+
+        return f"p50 {fmt(0.5)}, p90 {fmt(0.9)}, p99 {fmt(0.99)}, mean {self.sum / self.count:.0f} ms, n={self.count}"
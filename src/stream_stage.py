@@ -0,0 +1,98 @@
+import asyncio
+import zlib
+from typing import Any, AsyncGenerator, Callable
+
+
+FRAME_INTERVAL = 0.02
+FRAME_MAX_BYTES = 64 * 1024
+MAX_PENDING = 1024 * 1024
+
+
+class StreamStats:
+    def __init__(self) -> None:
+        self.writes = 0
+        self.frames = 0
+        self.bytes = 0
+        self.dropped = 0
+
+    def summary(self) -> str:
+        if not self.writes:
+            return "no output yet"
+        saved = 100 - self.frames * 100 / self.writes
+        return f"{self.writes} writes sent as {self.frames} frames ({saved:.0f}% fewer messages), {self.dropped} dropped"
+
+
+class Compressor:
+    # raw deflate with a sync flush per frame, the dictionary carries over
+    # between frames so repeated redraws compress well
+    def __init__(self) -> None:
+        self.compressor = zlib.compressobj(wbits=-15)
+
+    def compress(self, frame: bytes) -> bytes:
+        return self.compressor.compress(frame) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+async def coalesce(source: AsyncGenerator[Any, None], stats: StreamStats, interval: float = FRAME_INTERVAL, max_bytes: int = FRAME_MAX_BYTES, max_pending: int = MAX_PENDING, on_drop: Callable[[], None] = None, compress: bool = False) -> AsyncGenerator[bytes, None]:
+    # btop paints a screen in many small writes, gather them into one frame
+    # per interval (or max_bytes) so each crosses the rpc boundary once
+    loop = asyncio.get_running_loop()
+    buffer = bytearray()
+    ready = asyncio.Event()
+    done = False
+
+    async def read() -> None:
+        nonlocal done
+        try:
+            async for chunk in source:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode()
+                stats.writes += 1
+                if len(buffer) + len(chunk) > max_pending:
+                    # the client isn't keeping up, frames it hasn't taken
+                    # yet are stale, drop them and ask for a full repaint
+                    buffer.clear()
+                    stats.dropped += 1
+                    if on_drop:
+                        on_drop()
+                buffer.extend(chunk)
+                ready.set()
+        finally:
+            done = True
+            ready.set()
+
+    reader = asyncio.ensure_future(read())
+    compressor = Compressor() if compress else None
+    try:
+        while True:
+            if not buffer and not done:
+                await ready.wait()
+            if buffer and not done:
+                deadline = loop.time() + interval
+                while len(buffer) < max_bytes and not done:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    ready.clear()
+                    try:
+                        await asyncio.wait_for(ready.wait(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+            ready.clear()
+            if not buffer:
+                if done:
+                    break
+                continue
+            pending = bytes(buffer)
+            buffer.clear()
+            # a burst bigger than max_bytes goes out as several frames
+            # right away rather than one oversized message
+            for offset in range(0, len(pending), max_bytes):
+                frame = pending[offset:offset + max_bytes]
+                stats.frames += 1
+                stats.bytes += len(frame)
+                if compressor:
+                    frame = compressor.compress(frame)
+                yield frame
+    finally:
+        # cancelling the reader unwinds the source generator as well
+        reader.cancel()
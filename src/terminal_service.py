@@ -0,0 +1,112 @@
+import asyncio
+import time
+from typing import Any, AsyncGenerator
+
+import scrypted_sdk
+
+
+CONNECT_TIMEOUT = 10
+HANDLE_MAX_AGE = 600
+# how a dropped rpc connection shows up, as opposed to an error raised by
+# the terminal service itself
+PEER_ERRORS = ('peer was killed', 'peer is closed', 'connection closed', 'rpc closed')
+
+
+def is_connection_error(e: Exception) -> bool:
+    if isinstance(e, (ConnectionError, EOFError)):
+        return True
+    message = str(e).lower()
+    return any(error in message for error in PEER_ERRORS)
+
+
+def guard_input(input: AsyncGenerator[Any, Any], started: list[bool]) -> AsyncGenerator[Any, Any]:
+    # records whether the remote side ever read from input, a retry is only
+    # safe while nothing has been consumed
+    if input is None:
+        return None
+
+    async def guarded() -> AsyncGenerator[Any, Any]:
+        started[0] = True
+        async for message in input:
+            yield message
+    return guarded()
+
+
+class TerminalServiceClient:
+    # Caches the direct RPC connection to @scrypted/core's terminal service,
+    # which otherwise costs several round trips on every connectStream.
+
+    def __init__(self, log=print) -> None:
+        self.log = log
+        self.direct = None
+        self.connected_at = 0
+        self.connecting: asyncio.Future = None
+        self.refreshing = False
+        self.reconnects = 0
+
+    async def connect(self) -> Any:
+        core = scrypted_sdk.systemManager.getDeviceByName("@scrypted/core")
+        if not core:
+            raise Exception("@scrypted/core is not installed")
+        termsvc = await core.getDevice("terminalservice")
+        direct = await scrypted_sdk.sdk.connectRPCObject(termsvc)
+        self.direct = direct
+        self.connected_at = time.monotonic()
+        return direct
+
+    async def get(self) -> Any:
+        if self.direct:
+            if time.monotonic() - self.connected_at > HANDLE_MAX_AGE:
+                self.refresh()
+            return self.direct
+        # single flight, concurrent callers share one connection attempt
+        if not self.connecting:
+            self.connecting = asyncio.ensure_future(asyncio.wait_for(self.connect(), CONNECT_TIMEOUT))
+            self.connecting.add_done_callback(lambda _: setattr(self, 'connecting', None))
+        return await asyncio.shield(self.connecting)
+
+    def refresh(self) -> None:
+        # replace an old handle in the background, the current one keeps
+        # serving until the new one is ready. the terminal service has no
+        # ping, so this is only an age based refresh and a dead handle is
+        # found by the next call failing.
+        if self.refreshing:
+            return
+        self.refreshing = True
+
+        async def refresh() -> None:
+            try:
+                await asyncio.wait_for(self.connect(), CONNECT_TIMEOUT)
+            except Exception as e:
+                self.log("Terminal service refresh failed:", e)
+                self.invalidate()
+            finally:
+                self.refreshing = False
+
+        asyncio.ensure_future(refresh())
+
+    def invalidate(self) -> None:
+        self.direct = None
+
+    async def prewarm(self) -> None:
+        try:
+            await self.get()
+        except Exception as e:
+            self.log("Unable to connect to the terminal service:", e)
+
+    async def connectStream(self, input: AsyncGenerator[Any, Any], options: Any) -> Any:
+        direct = await self.get()
+        started = [False]
+        try:
+            return await direct.connectStream(guard_input(input, started), options)
+        except Exception as e:
+            # the cached handle is stale (core restarted, connection dropped),
+            # reconnect once before giving up. errors from the service itself
+            # or after it began reading input are not retried.
+            if not is_connection_error(e) or started[0]:
+                raise
+            self.log("Terminal service connection lost, reconnecting:", e)
+            self.invalidate()
+            self.reconnects += 1
+            direct = await self.get()
+            return await direct.connectStream(guard_input(input, started), options)
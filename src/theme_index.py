@@ -0,0 +1,223 @@
+import asyncio
+import ctypes
+import ctypes.util
+import hashlib
+import os
+import platform
+import re
+import struct
+from typing import Awaitable, Callable
+
+
+POLL_INTERVAL = 30
+# downloads land as a temp file that is renamed into place, wait for the
+# burst of events to settle before rescanning
+SETTLE_TIME = 0.25
+THEME_KEY = re.compile(rb'^\s*theme\[([a-z0-9_]+)\]\s*=', re.MULTILINE)
+
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ONLYDIR = 0x1000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR
+EVENT = struct.Struct('iIII')
+
+
+class Theme:
+    def __init__(self, path: str, mtime: int, size: int, sha256: str, colors: int, description: str) -> None:
+        self.name = os.path.basename(path).removesuffix('.theme')
+        self.path = path
+        self.mtime = mtime
+        self.size = size
+        self.sha256 = sha256
+        self.colors = colors
+        self.description = description
+
+
+def load_theme(path: str, info: os.stat_result) -> Theme:
+    with open(path, 'rb') as f:
+        data = f.read()
+    description = ''
+    for line in data.splitlines():
+        line = line.strip()
+        if line.startswith(b'#') and line.strip(b'# '):
+            description = line.strip(b'# ').decode(errors='replace')
+            break
+    return Theme(path, info.st_mtime_ns, info.st_size, hashlib.sha256(data).hexdigest(), len(set(THEME_KEY.findall(data))), description)
+
+
+class Inotify:
+    # just enough of inotify(7) through libc, None from create() when it
+    # isn't available, e.g. on windows, macos or an old libc
+    def __init__(self, libc: ctypes.CDLL, fd: int) -> None:
+        self.libc = libc
+        self.fd = fd
+        self.watches: dict[int, str] = {}
+
+    @staticmethod
+    def create() -> 'Inotify':
+        if platform.system() != 'Linux':
+            return None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        if fd < 0:
+            return None
+        return Inotify(libc, fd)
+
+    def watch(self, path: str) -> bool:
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            return False
+        self.watches[wd] = path
+        return True
+
+    def read(self) -> list[tuple[str, int, str]]:
+        # (directory, mask, file name) for each pending event, a None
+        # directory means the queue overflowed and events were lost
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset + EVENT.size <= len(data):
+            wd, mask, _, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                events.append((None, mask, ''))
+                continue
+            path = self.watches.get(wd, None)
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+            if path:
+                events.append((path, mask, name))
+        return events
+
+
+class ThemeIndex:
+    # Themes across the btop theme directories, kept up to date from inotify
+    # where available and from mtime polling otherwise. Only files whose
+    # mtime or size changed are read and hashed again, and on_change only
+    # runs when the set of theme names changes.
+
+    def __init__(self, dirs: list[str], on_change: Callable[[list[str]], Awaitable[None]], log: Callable[..., None] = print) -> None:
+        self.dirs = dirs
+        self.on_change = on_change
+        self.log = log
+        self.themes: dict[str, Theme] = {}
+        self.names: list[str] = None
+        self.lock = asyncio.Lock()
+        self.inotify: Inotify = None
+        self.watched: set[str] = set()
+        self.pending: dict[str, set[str] | None] = {}
+        self.settle = None
+        self.poller = None
+        self.scans = 0
+        self.loads = 0
+
+    def update(self, themes: dict[str, Theme], path: str) -> None:
+        try:
+            info = os.stat(path)
+        except FileNotFoundError:
+            themes.pop(path, None)
+            return
+        theme = themes.get(path, None)
+        if theme and theme.mtime == info.st_mtime_ns and theme.size == info.st_size:
+            return
+        themes[path] = load_theme(path, info)
+        self.loads += 1
+
+    def scan(self, pending: dict[str, set[str] | None]) -> dict[str, Theme]:
+        # runs in an executor on a copy, names limits a directory to the
+        # files inotify told us about, None means list the directory
+        themes = dict(self.themes)
+        for dir, names in pending.items():
+            self.scans += 1
+            if names is None:
+                try:
+                    names = set(entry for entry in os.listdir(dir) if entry.endswith('.theme'))
+                except FileNotFoundError:
+                    names = set()
+                names |= set(os.path.basename(path) for path in themes if os.path.dirname(path) == dir)
+            for name in names:
+                if name.endswith('.theme'):
+                    self.update(themes, os.path.join(dir, name))
+        return themes
+
+    async def refresh(self, pending: dict[str, set[str] | None] = None, force: bool = False) -> bool:
+        async with self.lock:
+            loop = asyncio.get_running_loop()
+            self.themes = await loop.run_in_executor(None, self.scan, pending or {dir: None for dir in self.dirs})
+            names = sorted(set(theme.name for theme in self.themes.values()))
+            changed = names != self.names
+            self.names = names
+            if changed or force:
+                await self.on_change(names)
+            return changed
+
+    def start(self) -> None:
+        self.inotify = Inotify.create()
+        if self.inotify:
+            asyncio.get_event_loop().add_reader(self.inotify.fd, self.readable)
+            self.watch()
+        self.poller = asyncio.ensure_future(self.poll())
+
+    def watch(self) -> None:
+        for dir in self.dirs:
+            if dir not in self.watched and os.path.isdir(dir) and self.inotify.watch(dir):
+                self.watched.add(dir)
+
+    def readable(self) -> None:
+        for dir, mask, name in self.inotify.read():
+            if dir is None:
+                # lost events, look at everything again
+                self.pending = {dir: None for dir in self.dirs}
+            elif mask & (IN_DELETE_SELF | IN_IGNORED):
+                # the directory itself went away, polling picks it up
+                # again if it comes back
+                self.watched.discard(dir)
+                self.pending[dir] = None
+            elif self.pending.get(dir, set()) is not None:
+                self.pending.setdefault(dir, set()).add(name)
+        if self.pending and not self.settle:
+            self.settle = asyncio.get_event_loop().call_later(SETTLE_TIME, self.settled)
+
+    def settled(self) -> None:
+        self.settle = None
+        pending, self.pending = self.pending, {}
+        asyncio.ensure_future(self.refresh_safely(pending))
+
+    async def refresh_safely(self, pending: dict[str, set[str] | None]) -> None:
+        try:
+            if await self.refresh(pending):
+                self.log("Themes changed:", len(self.names), "theme(s) available")
+        except:
+            import traceback
+            traceback.print_exc()
+
+    async def poll(self) -> None:
+        # directories inotify isn't watching, because there is no inotify
+        # or because they don't exist (yet)
+        while True:
+            await asyncio.sleep(POLL_INTERVAL)
+            # scan newly watched directories too, files may have appeared
+            # before the watch did
+            unwatched = [dir for dir in self.dirs if dir not in self.watched]
+            if self.inotify:
+                self.watch()
+            if unwatched:
+                await self.refresh_safely({dir: None for dir in unwatched})
+
+    def summary(self) -> str:
+        mode = f"watching {len(self.watched)} of {len(self.dirs)} dir(s)" if self.inotify else f"polling every {POLL_INTERVAL}s"
+        return f"{len(self.names or [])} theme(s), {mode}, {self.scans} scan(s), {self.loads} file(s) read"
@@ -0,0 +1,184 @@
+import collections
+import contextvars
+import itertools
+import json
+import os
+import threading
+import time
+from typing import Any
+
+
+CAPACITY = 4096
+RECENT = 20
+
+# Spans and counters for the plugin's hot paths, kept in a bounded ring
+# buffer. Everything is a no-op until enable() is called, span() then
+# returns a shared object whose __enter__ and __exit__ do nothing.
+enabled = False
+spans: collections.deque = collections.deque(maxlen=CAPACITY)
+counters: dict[str, float] = {}
+recorded = 0
+started = time.time()
+ids = itertools.count(1)
+current: contextvars.ContextVar = contextvars.ContextVar('btop_span', default=None)
+lock = threading.Lock()
+
+
+class NoSpan:
+    def __enter__(self) -> 'NoSpan':
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        pass
+
+    def set(self, **attrs: Any) -> None:
+        pass
+
+
+NO_SPAN = NoSpan()
+
+
+class Span:
+    def __init__(self, name: str, attrs: dict) -> None:
+        self.name = name
+        self.attrs = attrs
+        self.id = next(ids)
+        self.parent = None
+        self.token = None
+
+    def __enter__(self) -> 'Span':
+        self.parent = current.get()
+        self.token = current.set(self.id)
+        self.start = time.time()
+        self.clock = time.perf_counter()
+        return self
+
+    def __exit__(self, kind: Any, error: Any, tb: Any) -> None:
+        duration = time.perf_counter() - self.clock
+        try:
+            current.reset(self.token)
+        except ValueError:
+            # exited in another context, e.g. an async generator closed
+            # from a different task
+            pass
+        if error is not None:
+            self.attrs['error'] = repr(error)
+        record(self.id, self.parent, self.name, self.start, duration, self.attrs)
+
+    def set(self, **attrs: Any) -> None:
+        self.attrs.update(attrs)
+
+
+def span(name: str, /, **attrs: Any) -> Span | NoSpan:
+    if not enabled:
+        return NO_SPAN
+    return Span(name, attrs)
+
+
+def count(name: str, value: float = 1) -> None:
+    if not enabled:
+        return
+    with lock:
+        counters[name] = counters.get(name, 0) + value
+
+
+def add(name: str, start: float, duration: float, /, **attrs: Any) -> None:
+    # a span timed elsewhere, e.g. a whole session or a startup stage
+    if not enabled:
+        return
+    record(next(ids), current.get(), name, start, duration, attrs)
+
+
+def record(id: int, parent: int | None, name: str, start: float, duration: float, attrs: dict) -> None:
+    global recorded
+    spans.append((id, parent, name, start, duration, threading.get_ident(), attrs))
+    recorded += 1
+
+
+def enable(on: bool, capacity: int = None) -> None:
+    global enabled, spans
+    enabled = on
+    if capacity and capacity != spans.maxlen:
+        spans = collections.deque(spans, maxlen=capacity)
+
+
+def clear() -> None:
+    global recorded, started
+    spans.clear()
+    with lock:
+        counters.clear()
+    recorded = 0
+    started = time.time()
+
+
+def dropped() -> int:
+    return max(recorded - len(spans), 0)
+
+
+def stats() -> dict[str, dict[str, float]]:
+    # per span name: count, total, mean and max duration in ms
+    by_name = {}
+    for _, _, name, _, duration, _, _ in list(spans):
+        stat = by_name.setdefault(name, {'count': 0, 'total': 0, 'max': 0})
+        stat['count'] += 1
+        stat['total'] += duration * 1000
+        stat['max'] = max(stat['max'], duration * 1000)
+    for stat in by_name.values():
+        stat['mean'] = stat['total'] / stat['count']
+    return by_name
+
+
+def export() -> str:
+    # chrome trace event format, loads in perfetto or chrome://tracing
+    pid = os.getpid()
+    events = [
+        {
+            'name': name,
+            'ph': 'X',
+            'ts': start * 1000000,
+            'dur': duration * 1000000,
+            'pid': pid,
+            'tid': thread,
+            'args': {'id': id, 'parent': parent, **attrs},
+        }
+        for id, parent, name, start, duration, thread, attrs in list(spans)
+    ]
+    return json.dumps({
+        'traceEvents': events,
+        'displayTimeUnit': 'ms',
+        'otherData': {
+            'started': started,
+            'exported': time.time(),
+            'capacity': spans.maxlen,
+            'dropped': dropped(),
+            'counters': dict(counters),
+        },
+    }, default=str)
+
+
+def markdown() -> str:
+    lines = []
+    if not enabled:
+        lines.append("Tracing is off, turn it on in this device's settings.\n")
+    lines.append(f"{len(spans)} span(s) buffered, capacity {spans.maxlen}, {dropped()} dropped since {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(started))}.\n")
+
+    stat = stats()
+    if stat:
+        lines += ["## Spans", "", "| Span | Count | Total | Mean | Max |", "| --- | ---: | ---: | ---: | ---: |"]
+        for name, s in sorted(stat.items(), key=lambda item: -item[1]['total']):
+            lines.append(f"| {name} | {s['count']} | {s['total']:.1f} ms | {s['mean']:.2f} ms | {s['max']:.1f} ms |")
+        lines.append("")
+
+    if counters:
+        lines += ["## Counters", "", "| Counter | Value |", "| --- | ---: |"]
+        for name, value in sorted(dict(counters).items()):
+            lines.append(f"| {name} | {value:g} |")
+        lines.append("")
+
+    recent = list(spans)[-RECENT:]
+    if recent:
+        lines += ["## Recent", "", "| Time | Span | Duration | Details |", "| --- | --- | ---: | --- |"]
+        for _, _, name, start, duration, _, attrs in reversed(recent):
+            details = ', '.join(f"{key}={value}" for key, value in attrs.items()).replace('|', '\\|')
+            lines.append(f"| {time.strftime('%H:%M:%S', time.localtime(start))} | {name} | {duration * 1000:.1f} ms | {details} |")
+    return '\n'.join(lines)
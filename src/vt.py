@@ -0,0 +1,296 @@
+import codecs
+import html
+import re
+import unicodedata
+
+
+# 16 color palette (xterm defaults), 256 colors are derived from it
+PALETTE = [
+    '#000000', '#cd0000', '#00cd00', '#cdcd00', '#0000ee', '#cd00cd', '#00cdcd', '#e5e5e5',
+    '#7f7f7f', '#ff0000', '#00ff00', '#ffff00', '#5c5cff', '#ff00ff', '#00ffff', '#ffffff',
+]
+DEFAULT_STYLE = (None, None, False, False, False, False)
+
+CSI = re.compile(r'\x1b\[([?>=!]?)([0-9;:]*)([ -/]*)([@-~])')
+OSC = re.compile(r'\x1b\][^\x07\x1b]*(?:\x07|\x1b\\)')
+ESCAPE = re.compile(r'\x1b([()*+][0-9A-Za-z]|[=>78cDEHM])')
+TEXT = re.compile(r'[^\x00-\x1f\x7f\x1b]+')
+
+
+def color_256(n: int) -> str:
+    if n < 16:
+        return PALETTE[n]
+    if n < 232:
+        n -= 16
+        levels = [0, 95, 135, 175, 215, 255]
+        return f'#{levels[n // 36]:02x}{levels[n // 6 % 6]:02x}{levels[n % 6]:02x}'
+    gray = 8 + (n - 232) * 10
+    return f'#{gray:02x}{gray:02x}{gray:02x}'
+
+
+def char_width(char: str) -> int:
+    if unicodedata.combining(char):
+        return 0
+    return 2 if unicodedata.east_asian_width(char) in ('W', 'F') else 1
+
+
+class Screen:
+    # Just enough of a vt100/xterm emulator to capture what btop draws:
+    # cursor movement, erase, sgr colors (16, 256 and truecolor) and the
+    # alternate screen. Anything else is parsed and ignored.
+
+    def __init__(self, cols: int, rows: int) -> None:
+        self.cols = cols
+        self.rows = rows
+        self.pending = ''
+        # pty reads split multi-byte characters
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.reset()
+
+    def reset(self) -> None:
+        self.cells = [[(' ', DEFAULT_STYLE) for _ in range(self.cols)] for _ in range(self.rows)]
+        self.x = 0
+        self.y = 0
+        self.saved = (0, 0)
+        self.fg = None
+        self.bg = None
+        self.bold = False
+        self.dim = False
+        self.italic = False
+        self.underline = False
+        self.reverse = False
+
+    @property
+    def style(self) -> tuple:
+        fg, bg = (self.bg, self.fg) if self.reverse else (self.fg, self.bg)
+        return (fg, bg, self.bold, self.dim, self.italic, self.underline)
+
+    def feed(self, data: bytes | str) -> None:
+        if isinstance(data, bytes):
+            data = self.decoder.decode(data)
+        data = self.pending + data
+        self.pending = ''
+        i = 0
+        length = len(data)
+        while i < length:
+            char = data[i]
+            if char == '\x1b':
+                match = CSI.match(data, i) or OSC.match(data, i) or ESCAPE.match(data, i)
+                if not match:
+                    if length - i < 64 and '\x1b' not in data[i + 1:]:
+                        # an escape sequence split across writes
+                        self.pending = data[i:]
+                        return
+                    i += 1
+                    continue
+                if match.re is CSI:
+                    self.csi(match.group(1), match.group(2), match.group(4))
+                elif match.re is ESCAPE:
+                    self.escape(match.group(1))
+                i = match.end()
+            elif char == '\r':
+                self.x = 0
+                i += 1
+            elif char == '\n':
+                self.linefeed()
+                i += 1
+            elif char == '\b':
+                self.x = max(self.x - 1, 0)
+                i += 1
+            elif char == '\t':
+                self.x = min((self.x // 8 + 1) * 8, self.cols - 1)
+                i += 1
+            elif char < ' ' or char == '\x7f':
+                i += 1
+            else:
+                match = TEXT.match(data, i)
+                self.text(match.group(0))
+                i = match.end()
+
+    def linefeed(self) -> None:
+        if self.y == self.rows - 1:
+            self.cells.pop(0)
+            self.cells.append([(' ', DEFAULT_STYLE) for _ in range(self.cols)])
+        else:
+            self.y += 1
+
+    def text(self, text: str) -> None:
+        style = self.style
+        for char in text:
+            width = char_width(char)
+            if not width:
+                continue
+            if self.x + width > self.cols:
+                self.x = 0
+                self.linefeed()
+            self.cells[self.y][self.x] = (char, style)
+            if width == 2 and self.x + 1 < self.cols:
+                self.cells[self.y][self.x + 1] = ('', style)
+            self.x += width
+
+    def escape(self, code: str) -> None:
+        if code == '7':
+            self.saved = (self.x, self.y)
+        elif code == '8':
+            self.x, self.y = self.saved
+        elif code == 'c':
+            self.reset()
+        elif code == 'M':
+            self.y = max(self.y - 1, 0)
+
+    def csi(self, private: str, params: str, final: str) -> None:
+        args = [int(p) if p.isdigit() else 0 for p in params.replace(':', ';').split(';')] if params else []
+
+        def arg(index: int, default: int = 1) -> int:
+            return args[index] if len(args) > index and args[index] else default
+
+        if private:
+            # alternate screen and other modes, the alternate screen starts clear
+            if final in 'hl' and any(a in (47, 1047, 1049) for a in args):
+                self.erase_display(2)
+            return
+        if final in 'Hf':
+            self.y = min(arg(0), self.rows) - 1
+            self.x = min(arg(1), self.cols) - 1
+        elif final == 'A':
+            self.y = max(self.y - arg(0), 0)
+        elif final in 'Be':
+            self.y = min(self.y + arg(0), self.rows - 1)
+        elif final in 'Ca':
+            self.x = min(self.x + arg(0), self.cols - 1)
+        elif final == 'D':
+            self.x = max(self.x - arg(0), 0)
+        elif final in 'G`':
+            self.x = min(arg(0), self.cols) - 1
+        elif final == 'd':
+            self.y = min(arg(0), self.rows) - 1
+        elif final == 'J':
+            self.erase_display(arg(0, 0))
+        elif final == 'K':
+            self.erase_line(arg(0, 0))
+        elif final == 'X':
+            row = self.cells[self.y]
+            for x in range(self.x, min(self.x + arg(0), self.cols)):
+                row[x] = (' ', self.style)
+        elif final == 'm':
+            self.sgr(args or [0])
+        elif final == 's':
+            self.saved = (self.x, self.y)
+        elif final == 'u':
+            self.x, self.y = self.saved
+
+    def erase_line(self, mode: int, y: int = None) -> None:
+        y = self.y if y is None else y
+        start, end = {0: (self.x, self.cols), 1: (0, self.x + 1)}.get(mode, (0, self.cols))
+        blank = (' ', self.style)
+        row = self.cells[y]
+        for x in range(start, end):
+            row[x] = blank
+
+    def erase_display(self, mode: int) -> None:
+        if mode == 0:
+            self.erase_line(0)
+            rows = range(self.y + 1, self.rows)
+        elif mode == 1:
+            self.erase_line(1)
+            rows = range(0, self.y)
+        else:
+            rows = range(self.rows)
+        for y in rows:
+            self.erase_line(2, y)
+
+    def sgr(self, args: list[int]) -> None:
+        i = 0
+        while i < len(args):
+            a = args[i]
+            if a == 0:
+                self.fg = self.bg = None
+                self.bold = self.dim = self.italic = self.underline = self.reverse = False
+            elif a == 1:
+                self.bold = True
+            elif a == 2:
+                self.dim = True
+            elif a == 3:
+                self.italic = True
+            elif a == 4:
+                self.underline = True
+            elif a == 7:
+                self.reverse = True
+            elif a == 22:
+                self.bold = self.dim = False
+            elif a == 23:
+                self.italic = False
+            elif a == 24:
+                self.underline = False
+            elif a == 27:
+                self.reverse = False
+            elif 30 <= a <= 37:
+                self.fg = PALETTE[a - 30]
+            elif 90 <= a <= 97:
+                self.fg = PALETTE[a - 90 + 8]
+            elif 40 <= a <= 47:
+                self.bg = PALETTE[a - 40]
+            elif 100 <= a <= 107:
+                self.bg = PALETTE[a - 100 + 8]
+            elif a == 39:
+                self.fg = None
+            elif a == 49:
+                self.bg = None
+            elif a in (38, 48):
+                color = None
+                if i + 2 < len(args) and args[i + 1] == 5:
+                    color = color_256(args[i + 2] % 256)
+                    i += 2
+                elif i + 4 < len(args) and args[i + 1] == 2:
+                    color = '#{:02x}{:02x}{:02x}'.format(*(min(c, 255) for c in args[i + 2:i + 5]))
+                    i += 4
+                if a == 38:
+                    self.fg = color
+                else:
+                    self.bg = color
+            i += 1
+
+    def text_lines(self) -> list[str]:
+        return [''.join(char for char, _ in row).rstrip() for row in self.cells]
+
+    def render_text(self) -> str:
+        return '\n'.join(self.text_lines()).rstrip('\n') + '\n'
+
+    def render_html(self) -> str:
+        lines = []
+        for row in self.cells:
+            runs = []
+            current = None
+            text = []
+            for char, style in row:
+                if style != current:
+                    if text:
+                        runs.append(span(current, ''.join(text)))
+                    current = style
+                    text = []
+                text.append(char)
+            if text:
+                runs.append(span(current, ''.join(text)))
+            lines.append(''.join(runs))
+        return '<pre style="background:#000;color:#ccc;line-height:1.1;font-family:monospace">' + '\n'.join(lines) + '</pre>'
+
+
+def span(style: tuple, text: str) -> str:
+    text = html.escape(text)
+    if style == DEFAULT_STYLE:
+        return text
+    fg, bg, bold, dim, italic, underline = style
+    css = []
+    if fg:
+        css.append(f'color:{fg}')
+    if bg:
+        css.append(f'background:{bg}')
+    if bold:
+        css.append('font-weight:bold')
+    if dim:
+        css.append('opacity:.7')
+    if italic:
+        css.append('font-style:italic')
+    if underline:
+        css.append('text-decoration:underline')
+    return f'<span style="{";".join(css)}">{text}</span>'
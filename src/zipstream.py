@@ -0,0 +1,182 @@
+import os
+import struct
+import zipfile
+import zlib
+from typing import Any, Callable
+
+
+CHUNK_SIZE = 1024 * 1024
+LOCAL_FILE = b'PK\x03\x04'
+CENTRAL_DIRECTORY = b'PK\x01\x02'
+END_OF_CENTRAL_DIRECTORY = b'PK\x05\x06'
+DATA_DESCRIPTOR = b'PK\x07\x08'
+LOCAL_HEADER = struct.Struct('<5H3L2H')
+ZIP64_EXTRA = 0x0001
+FLAG_ENCRYPTED = 0x1
+FLAG_DESCRIPTOR = 0x8
+FLAG_UTF8 = 0x800
+
+
+class Stream:
+    # a non-seekable source with room to push back what the inflater read
+    # past the end of a member
+    def __init__(self, source: Any) -> None:
+        self.source = source
+        self.buffer = b''
+
+    def read(self, size: int) -> bytes:
+        if self.buffer:
+            data, self.buffer = self.buffer[:size], self.buffer[size:]
+            return data
+        return self.source.read(size)
+
+    def read_exact(self, size: int) -> bytes:
+        data = b''
+        while len(data) < size:
+            chunk = self.read(size - len(data))
+            if not chunk:
+                raise zipfile.BadZipFile("Truncated zip archive")
+            data += chunk
+        return data
+
+    def unread(self, data: bytes) -> None:
+        self.buffer = data + self.buffer
+
+
+def member_path(root: str, name: str) -> str | None:
+    # like zipfile, absolute paths and .. never leave the target directory
+    parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.', '..')]
+    if not parts:
+        return None
+    return os.path.join(root, *parts)
+
+
+def zip64_sizes(extra: bytes, compressed: int, uncompressed: int) -> tuple[int, int, bool]:
+    offset = 0
+    while offset + 4 <= len(extra):
+        kind, length = struct.unpack_from('<2H', extra, offset)
+        if kind == ZIP64_EXTRA:
+            values = list(struct.unpack_from(f'<{length // 8}Q', extra, offset + 4))
+            if uncompressed == 0xffffffff and values:
+                uncompressed = values.pop(0)
+            if compressed == 0xffffffff and values:
+                compressed = values.pop(0)
+            return compressed, uncompressed, True
+        offset += 4 + length
+    return compressed, uncompressed, False
+
+
+def extract(source: Any, root: str, wanted: Callable[[str], bool]) -> None:
+    # Extracts a zip archive front to back from its local file headers, so
+    # it never has to be on disk as a whole. The central directory at the
+    # end is not read, it only repeats what the local headers said.
+    stream = Stream(source)
+    while True:
+        signature = stream.read_exact(4)
+        if signature in (CENTRAL_DIRECTORY, END_OF_CENTRAL_DIRECTORY):
+            return
+        if signature != LOCAL_FILE:
+            raise zipfile.BadZipFile(f"Bad local file header signature {signature!r}")
+        _, flags, method, _, _, crc, compressed, uncompressed, name_length, extra_length = LOCAL_HEADER.unpack(stream.read_exact(LOCAL_HEADER.size))
+        name = stream.read_exact(name_length).decode('utf-8' if flags & FLAG_UTF8 else 'cp437')
+        compressed, uncompressed, zip64 = zip64_sizes(stream.read_exact(extra_length), compressed, uncompressed)
+        if flags & FLAG_ENCRYPTED:
+            raise zipfile.BadZipFile(f"{name} is encrypted")
+
+        target = member_path(root, name) if wanted(name) else None
+        output = None
+        if target and name.endswith('/'):
+            os.makedirs(target, exist_ok=True)
+        elif target:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            output = open(target, 'wb')
+        try:
+            if method == zipfile.ZIP_STORED and flags & FLAG_DESCRIPTOR:
+                actual_crc, actual_size = copy_unsized(stream, output, zip64)
+            else:
+                actual_crc, actual_size = copy_member(stream, output, name, method, flags, compressed)
+        finally:
+            if output:
+                output.close()
+
+        if flags & FLAG_DESCRIPTOR:
+            descriptor = stream.read_exact(4)
+            if descriptor == DATA_DESCRIPTOR:
+                descriptor = stream.read_exact(4)
+            crc, = struct.unpack('<L', descriptor)
+            sizes = stream.read_exact(16 if zip64 else 8)
+            compressed, uncompressed = struct.unpack('<2Q' if zip64 else '<2L', sizes)
+        if actual_crc != crc or actual_size != uncompressed:
+            raise zipfile.BadZipFile(f"Bad CRC-32 for file {name!r}")
+
+
+def copy_member(stream: Stream, output: Any, name: str, method: int, flags: int, compressed: int) -> tuple[int, int]:
+    # returns the crc and size of the member's uncompressed data
+    crc = 0
+    size = 0
+    sized = not flags & FLAG_DESCRIPTOR
+    if method == zipfile.ZIP_STORED:
+        remaining = compressed
+        while remaining:
+            data = stream.read_exact(min(remaining, CHUNK_SIZE))
+            remaining -= len(data)
+            crc = zlib.crc32(data, crc)
+            size += len(data)
+            if output:
+                output.write(data)
+        return crc, size
+    if method != zipfile.ZIP_DEFLATED:
+        raise zipfile.BadZipFile(f"{name} uses unsupported compression method {method}")
+
+    inflater = zlib.decompressobj(-zlib.MAX_WBITS)
+    remaining = compressed
+    while not inflater.eof:
+        if sized and not remaining:
+            raise zipfile.BadZipFile(f"{name} ends before its compressed data does")
+        chunk = stream.read(min(remaining, CHUNK_SIZE) if sized else CHUNK_SIZE)
+        if not chunk:
+            raise zipfile.BadZipFile("Truncated zip archive")
+        remaining -= len(chunk)
+        data = inflater.decompress(chunk)
+        crc = zlib.crc32(data, crc)
+        size += len(data)
+        if output:
+            output.write(data)
+    stream.unread(inflater.unused_data)
+    return crc, size
+
+
+def copy_unsized(stream: Stream, output: Any, zip64: bool) -> tuple[int, int]:
+    # a stored member followed by a data descriptor has no size up front,
+    # it ends at the first descriptor whose crc and sizes match the data
+    # before it. the descriptor is left on the stream.
+    fields = struct.Struct('<L2Q' if zip64 else '<3L')
+    limit = 0xffffffffffffffff if zip64 else 0xffffffff
+    crc = 0
+    size = 0
+    pending = b''
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            raise zipfile.BadZipFile("Truncated zip archive")
+        pending += chunk
+        # everything before keep is member data
+        keep = max(len(pending) - 4 - fields.size + 1, 0)
+        search = 0
+        while (found := pending.find(DATA_DESCRIPTOR, search)) != -1:
+            if found + 4 + fields.size > len(pending):
+                keep = min(keep, found)
+                break
+            candidate_crc = zlib.crc32(pending[:found], crc)
+            candidate_size = (size + found) & limit
+            if fields.unpack_from(pending, found + 4) == (candidate_crc, candidate_size, candidate_size):
+                if output:
+                    output.write(pending[:found])
+                stream.unread(pending[found:])
+                return candidate_crc, size + found
+            search = found + 1
+        data, pending = pending[:keep], pending[keep:]
+        crc = zlib.crc32(data, crc)
+        size += len(data)
+        if output:
+            output.write(data)